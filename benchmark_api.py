@@ -0,0 +1,137 @@
+"""
+Throughput benchmark for the FHIR Mock API under many concurrent connections
+
+Opens N keep-alive HTTP/1.1 connections with plain asyncio streams (no extra
+dependencies) and has each one issue requests back-to-back for a fixed time.
+
+Usage:
+    python fhir_api.py                      # in another terminal
+    python benchmark_api.py --connections 500 --duration 10
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from urllib.parse import urlparse
+
+BASE_URL = "http://localhost:8000"
+
+PATIENT_ID = "ePtdJFCrnl2edlBDdz1C5Ja"
+
+# Mix of index lookups (reads, patient searches) and scans
+PATHS = [
+    f"/Patient/{PATIENT_ID}",
+    f"/Condition?patient={PATIENT_ID}",
+    f"/Observation?patient={PATIENT_ID}&category=vital-signs",
+    f"/Appointment?patient={PATIENT_ID}",
+    "/Encounter?class=AMB",
+    "/Organization",
+]
+
+async def read_response(reader):
+    """Read one HTTP/1.1 response, returning the status code"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    length = 0
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value.strip())
+        elif name == "transfer-encoding" and "chunked" in value.lower():
+            chunked = True
+    if chunked:
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(length)
+    return status
+
+async def worker(host, port, paths, deadline, latencies, errors, offset):
+    """Issue requests on one keep-alive connection until the deadline"""
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        errors.append("connect")
+        return
+    i = offset
+    try:
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n"
+            started = time.perf_counter()
+            writer.write(request.encode("ascii"))
+            await writer.drain()
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors.append(status)
+    except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+        errors.append("io")
+    finally:
+        writer.close()
+
+async def run(base_url, connections, duration, paths):
+    parsed = urlparse(base_url)
+    host, port = parsed.hostname, parsed.port or 80
+    latencies, errors = [], []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*[
+        worker(host, port, paths, deadline, latencies, errors, n)
+        for n in range(connections)
+    ])
+    elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent throughput benchmark")
+    parser.add_argument("--url", default=BASE_URL)
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--path", action="append", help="Request path (repeatable, defaults to a mixed workload)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Epic FHIR Mock API - Concurrency Benchmark")
+    print("=" * 60)
+    print(f"Target:      {args.url}")
+    print(f"Connections: {args.connections}")
+    print(f"Duration:    {args.duration:.0f}s")
+
+    latencies, errors, elapsed = asyncio.run(
+        run(args.url, args.connections, args.duration, args.path or PATHS)
+    )
+
+    if not latencies:
+        print("\n[ERROR] No requests completed. Start the server with: python fhir_api.py")
+        return 1
+
+    print(f"\nRequests:    {len(latencies)}")
+    print(f"Errors:      {len(errors)}")
+    print(f"Throughput:  {len(latencies) / elapsed:.0f} req/s")
+    print(f"Latency p50: {percentile(latencies, 50) * 1000:.1f} ms")
+    print(f"Latency p95: {percentile(latencies, 95) * 1000:.1f} ms")
+    print(f"Latency p99: {percentile(latencies, 99) * 1000:.1f} ms")
+    print(f"Latency avg: {statistics.mean(latencies) * 1000:.1f} ms")
+    return 0 if not errors else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
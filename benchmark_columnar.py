@@ -0,0 +1,237 @@
+"""
+Scan benchmark: per-resource filter loops vs compiled predicates vs columnar masks
+
+Replicates the synthetic Observations and Encounters to a large row count and
+times the same unindexed searches three ways over every row:
+
+    legacy    the filter_observations / filter_encounters loops the endpoints
+              used before the search-parameter registry
+    compiled  fhir_search predicates (what run_search falls back to)
+    columnar  fhir_columnar masks over dictionary-encoded codes and epoch days
+
+With --processes, the columnar scans are then repeated partitioned across
+that many worker processes (fhir_parallel) to report speedup vs core count.
+
+Usage:
+    python benchmark_columnar.py --rows 1000000
+    python benchmark_columnar.py --rows 5000000 --processes 2,4,8,16
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+from fhir_columnar import ColumnStore, np
+from fhir_parallel import PartitionedScanner
+from fhir_search import DATE_PREFIXES, SEARCH_PARAMETERS, compile_query, filter_resources
+
+DATA_DIR = Path("Sythetic_Data")
+
+ORGANIZATION = "eLGk8cgSCifdFzctEq8oB7GVvouNndNWYzjFn"
+
+# (resource type, search parameters); legacy loops only know substring dates
+CASES = [
+    ("Observation", {"code": "789-8", "date": "2025"}),
+    ("Observation", {"category": "vital-signs", "date": "2025-07"}),
+    ("Observation", {"code": "789-8", "date": "ge2025-06-01"}),
+    ("Encounter", {"class": "AMB", "date": "2024"}),
+    ("Encounter", {"class": "AMB", "organization": ORGANIZATION}),
+    ("Encounter", {"status": "finished", "date": "lt2025-01-01"}),
+]
+
+def matches_organization(resource, org_id):
+    """Check serviceProvider or payor references against an organization ID"""
+    org_id = org_id.replace("Organization/", "")
+    service_provider = resource.get("serviceProvider", {}).get("reference", "")
+    payor_refs = resource.get("payor", [])
+
+    if isinstance(payor_refs, list):
+        payor_match = any(f"Organization/{org_id}" in payor.get("reference", "") for payor in payor_refs)
+    else:
+        payor_match = False
+
+    return f"Organization/{org_id}" in service_provider or payor_match
+
+def filter_encounters(encounters, _id=None, organization=None, status=None, class_code=None, date=None):
+    """Apply Encounter search parameters (loop removed from search_encounters)"""
+    filtered = []
+    for enc in encounters:
+        match = True
+
+        if _id and enc.get("id") != _id:
+            match = False
+
+        if organization and match:
+            if not matches_organization(enc, organization):
+                match = False
+
+        if status and match:
+            if enc.get("status") != status:
+                match = False
+
+        if class_code and match:
+            enc_class = enc.get("class", {}).get("code", "")
+            if enc_class != class_code:
+                match = False
+
+        if date and match:
+            period_start = enc.get("period", {}).get("start", "")
+            if date not in period_start:
+                match = False
+
+        if match:
+            filtered.append(enc)
+
+    return filtered
+
+def filter_observations(observations, _id=None, encounter=None, category=None, code=None, date=None):
+    """Apply Observation search parameters (loop removed from search_observations)"""
+    filtered = []
+    for obs in observations:
+        match = True
+
+        if _id and obs.get("id") != _id:
+            match = False
+
+        if encounter and match:
+            encounter_id = encounter.replace("Encounter/", "")
+            if obs.get("encounter", {}).get("reference", "").replace("Encounter/", "") != encounter_id:
+                match = False
+
+        if category and match:
+            categories = obs.get("category", [])
+            cat_match = any(cat.get("coding", [{}])[0].get("code", "") == category for cat in categories)
+            if not cat_match:
+                match = False
+
+        if code and match:
+            codes = obs.get("code", {}).get("coding", [])
+            code_match = any(c.get("code", "") == code for c in codes)
+            if not code_match:
+                match = False
+
+        if date and match:
+            effective_date = obs.get("effectiveDateTime", "")
+            if date not in effective_date:
+                match = False
+
+        if match:
+            filtered.append(obs)
+
+    return filtered
+
+def legacy_filter(resource_type, resources, params):
+    """The pre-registry loop for a search, or None when it had no such semantics"""
+    if params.get("date", "")[:2] in DATE_PREFIXES:
+        return None
+    if resource_type == "Observation":
+        return filter_observations(resources, **params)
+    params = dict(params)
+    params["class_code"] = params.pop("class", None)
+    return filter_encounters(resources, **params)
+
+def load(rows):
+    """Synthetic Observations and Encounters replicated to `rows` each"""
+    with open(DATA_DIR / "observation.json", "r", encoding="utf-8") as f:
+        observations = json.load(f)
+    with open(DATA_DIR / "encounterr.json", "r", encoding="utf-8") as f:
+        encounters = [entry.get("resource", {}) for entry in json.load(f).get("entry", [])]
+    data = {}
+    for resource_type, resources in (("Observation", observations), ("Encounter", encounters)):
+        data[resource_type] = [
+            dict(resources[n % len(resources)], id=f"{resources[n % len(resources)]['id']}-{n}")
+            for n in range(rows)
+        ]
+    return data
+
+def best_of(repeat, func):
+    """Fastest of `repeat` runs as (seconds, result)"""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter-engine scan benchmark")
+    parser.add_argument("--rows", type=int, default=1000000, help="Rows per resource type")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--processes", default="", help="Comma-separated worker process counts, e.g. 2,4,8")
+    args = parser.parse_args()
+    processes = [int(count) for count in args.processes.split(",") if count]
+
+    if np is None:
+        print("[ERROR] numpy is not installed; the columnar engine is unavailable")
+        return 1
+
+    print("=" * 78)
+    print("Epic FHIR Mock API - Filter Engine Benchmark")
+    print("=" * 78)
+    data = load(args.rows)
+    started = time.perf_counter()
+    columns = ColumnStore(data, SEARCH_PARAMETERS, 0)
+    print(f"Rows:        {args.rows} per type")
+    print(f"Columns:     built in {time.perf_counter() - started:.2f}s, "
+          + ", ".join(f"{t} {columns.nbytes(t) / 1e6:.1f} MB" for t in columns.build_seconds))
+    print()
+    print(f"{'search':<44}{'matched':>9}{'legacy':>9}{'compiled':>10}{'columnar':>10}{'speedup':>9}")
+
+    for resource_type, params in CASES:
+        resources = data[resource_type]
+        predicate = compile_query(resource_type, tuple(sorted(params))).predicate(params)
+        legacy, legacy_result = best_of(args.repeat, lambda: legacy_filter(resource_type, resources, params))
+        compiled, compiled_result = best_of(args.repeat, lambda: filter_resources(resources, predicate))
+
+        def columnar_search():
+            positions, _ = columns.select(resource_type, params, None)
+            return [resources[position] for position in positions]
+        vectorized, columnar_result = best_of(args.repeat, columnar_search)
+
+        if columnar_result != compiled_result or (legacy_result is not None and legacy_result != compiled_result):
+            print(f"[ERROR] engines disagree for {resource_type}?{params}")
+            return 1
+        search = f"{resource_type}?" + "&".join(f"{name}={value}" for name, value in params.items())
+        baseline = legacy if legacy_result is not None else compiled
+        print(f"{search[:43]:<44}{len(compiled_result):>9}"
+              + (f"{legacy * 1000:>7.0f}ms" if legacy_result is not None else f"{'n/a':>9}")
+              + f"{compiled * 1000:>8.0f}ms{vectorized * 1000:>8.0f}ms{baseline / vectorized:>8.1f}x")
+
+    if processes:
+        return report_scaling(columns, processes, args.repeat)
+    return 0
+
+def report_scaling(columns, processes, repeat):
+    """Partitioned columnar scans per process count, as speedup over the in-process scan"""
+    in_process = [
+        best_of(repeat, lambda: columns.select(resource_type, params, None))[0]
+        for resource_type, params in CASES
+    ]
+    scanner = PartitionedScanner(columns, max(processes), 0)
+    print()
+    print(f"Partitioned scans (shared memory {scanner.shared_bytes / 1e6:.1f} MB)")
+    print(f"{'processes':<11}" + "".join(f"{f'case {n + 1}':>11}" for n in range(len(CASES))) + f"{'speedup':>10}")
+    print(f"{1:<11}" + "".join(f"{seconds * 1000:>9.1f}ms" for seconds in in_process) + f"{1:>9.1f}x")
+    try:
+        for count in processes:
+            scanner.shutdown()
+            scanner.workers = count
+            timings = []
+            for resource_type, params in CASES:
+                expected, _ = columns.select(resource_type, params, None)
+                scanner.select(resource_type, params, None)  # start the pool
+                seconds, (positions, _) = best_of(repeat, lambda: scanner.select(resource_type, params, None))
+                if positions != expected:
+                    print(f"[ERROR] partitioned scan disagrees for {resource_type}?{params}")
+                    return 1
+                timings.append(seconds)
+            speedup = sum(in_process) / sum(timings)
+            print(f"{count:<11}" + "".join(f"{seconds * 1000:>9.1f}ms" for seconds in timings) + f"{speedup:>9.1f}x")
+    finally:
+        scanner.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,40 @@
 """
 FastAPI service for serving synthetic FHIR R4 data
 """
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
 from pathlib import Path
+import asyncio
+import base64
+import binascii
+import functools
 import json
-from typing import Optional, List, Dict, Any
+import os
+import time
+import zlib
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Any, Callable, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
 import re
 from datetime import datetime, date
 
+from fhir_columnar import ColumnStore
+from fhir_compression import CompressedCache, CompressionStats, compress, negotiate_encoding
+from fhir_index import FHIRIndex, REFERENCE_PARAMS, resource_body
+from fhir_metrics import MetricsRegistry, format_metric
+from fhir_parallel import PartitionedScanner
+from fhir_planner import SearchPlan, index_lookup, plan_search, sort_positions
+from fhir_search import (
+    SEARCH_PARAMETERS, compile_query, date_indexes, filter_positions, parse_chain, parse_has, parse_instant,
+    parse_sort, series_indexes, sort_indexes, split_values, string_indexes, token_indexes,
+)
+from fhir_profiler import ProfilerBusy, SamplingProfiler
+from fhir_projection import ProjectionCache, ProjectionError, parse_projection
+from fhir_querylog import SlowQueryLog
+from fhir_schedule import Schedules, parse_window, parse_working_hours
+
 app = FastAPI(
     title="GooClaim FHIR Mock API",
     description="Synthetic FHIR R4 test data API - Epic Compatible",
@@ -20,6 +46,222 @@ app = FastAPI(
 # Data directory
 DATA_DIR = Path("Sythetic_Data")
 
+# Async execution: index lookups run on the event loop, scans and large
+# serializations above these row counts go to a sized executor
+SCAN_WORKERS = int(os.environ.get("FHIR_SCAN_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+SCAN_OFFLOAD_ROWS = int(os.environ.get("FHIR_SCAN_OFFLOAD_ROWS", "2000"))
+SERIALIZE_OFFLOAD_ROWS = int(os.environ.get("FHIR_SERIALIZE_OFFLOAD_ROWS", "200"))
+SCAN_EXECUTOR = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="fhir-scan")
+
+# Columnar search extracts (NumPy) for resource types with at
+# least this many rows; candidate sets this large are filtered with masks
+COLUMNAR_MIN_ROWS = int(os.environ.get("FHIR_COLUMNAR_MIN_ROWS", "20000"))
+
+# Columnar scans of resource types with at least this many rows are split
+# across a pool of worker processes; FHIR_SCAN_PROCESSES=1 keeps them in-process
+SCAN_PROCESSES = int(os.environ.get("FHIR_SCAN_PROCESSES", os.cpu_count() or 1))
+PARALLEL_SCAN_MIN_ROWS = int(os.environ.get("FHIR_PARALLEL_SCAN_MIN_ROWS", "500000"))
+
+# Response compression (gzip always, brotli when the package is installed)
+COMPRESSION_ENABLED = os.environ.get("FHIR_COMPRESSION", "1") != "0"
+COMPRESSION_MIN_BYTES = int(os.environ.get("FHIR_COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_OFFLOAD_BYTES = int(os.environ.get("FHIR_COMPRESSION_OFFLOAD_BYTES", "65536"))
+GZIP_LEVEL = int(os.environ.get("FHIR_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("FHIR_BROTLI_QUALITY", "5"))
+COMPRESSION_CACHE = CompressedCache(int(os.environ.get("FHIR_COMPRESSION_CACHE_MB", "64")) * 1024 * 1024)
+COMPRESSION_STATS = CompressionStats()
+
+# Decoded Binary content, so raw downloads and Range requests skip base64 decoding
+BINARY_CACHE = CompressedCache(int(os.environ.get("FHIR_BINARY_CACHE_MB", "128")) * 1024 * 1024)
+BINARY_ETAGS: Dict[str, str] = {}
+BINARY_DECODE_OFFLOAD_BYTES = 65536
+
+# Batch / transaction Bundles
+BATCH_MAX_ENTRIES = int(os.environ.get("FHIR_BATCH_MAX_ENTRIES", "1000"))
+BATCH_CONCURRENCY = int(os.environ.get("FHIR_BATCH_CONCURRENCY", "64"))
+
+# _summary / _elements projections, cached per (resource, mode)
+PROJECTION_CACHE = ProjectionCache(int(os.environ.get("FHIR_PROJECTION_CACHE_ENTRIES", "50000")))
+
+# Schedules: default working week (UTC) of Practitioners and Locations without
+# PractitionerRole.availableTime, and the longest Slot / $find window
+WORKING_HOURS = parse_working_hours(os.environ.get("FHIR_WORKING_HOURS", "mon-fri 08:00-17:00"))
+SCHEDULE_MAX_DAYS = int(os.environ.get("FHIR_SCHEDULE_MAX_DAYS", "366"))
+
+# Parameters that shape the result rather than select resources
+RESULT_PARAMETERS = {"_count", "_sort", "_summary", "_elements", "_include", "_revinclude", "_explain"}
+
+# Server-Timing header with per-stage durations (off by default)
+SERVER_TIMING_ENABLED = os.environ.get("FHIR_SERVER_TIMING", "0") == "1"
+
+# Slow-query log; FHIR_SLOW_QUERY_MS=0 disables it
+SLOW_QUERY_MS = float(os.environ.get("FHIR_SLOW_QUERY_MS", "500"))
+SLOW_QUERY_LOG = SlowQueryLog(
+    os.environ.get("FHIR_SLOW_QUERY_LOG", "slow_queries.log"),
+    SLOW_QUERY_MS / 1000,
+    int(os.environ.get("FHIR_SLOW_QUERY_LOG_MB", "10")) * 1024 * 1024,
+    int(os.environ.get("FHIR_SLOW_QUERY_LOG_BACKUPS", "5")),
+) if SLOW_QUERY_MS > 0 else None
+
+# Stage timings and plan steps are only collected when something reports them
+QUERY_TRACE_ENABLED = SERVER_TIMING_ENABLED or SLOW_QUERY_LOG is not None
+
+# Admin endpoints (/admin/profile) are unauthenticated, so they are off unless
+# FHIR_ADMIN_ENDPOINTS=1 turns them on
+ADMIN_ENDPOINTS_ENABLED = os.environ.get("FHIR_ADMIN_ENDPOINTS", "0") == "1"
+PROFILE_MAX_SECONDS = int(os.environ.get("FHIR_PROFILE_MAX_SECONDS", "60"))
+PROFILER = SamplingProfiler()
+
+# ASGI scope of the request being handled, so helpers can read headers
+# without every route taking a Request parameter
+REQUEST_SCOPE: ContextVar[Optional[Dict]] = ContextVar("request_scope", default=None)
+
+# Per-route request metrics, exported at /metrics
+METRICS = MetricsRegistry()
+
+class RequestContextMiddleware:
+    """Expose the current request scope through REQUEST_SCOPE and record per-route metrics"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = REQUEST_SCOPE.set(scope)
+        started = time.perf_counter()
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING_ENABLED:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", server_timing(scope.get("fhir.timings", {}), started))
+                    ]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SCOPE.reset(token)
+            elapsed = time.perf_counter() - started
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            METRICS.route_stats(scope["method"], route.path if route else "unmatched").record(
+                status, elapsed, scope.get("fhir.result_size")
+            )
+            if (SLOW_QUERY_LOG is not None and elapsed >= SLOW_QUERY_LOG.threshold
+                    and route is not None and not route.path.startswith("/admin/")):
+                SLOW_QUERY_LOG.record(slow_query_entry(scope, status, elapsed))
+
+app.add_middleware(RequestContextMiddleware)
+
+def record_timing(stage: str, started: float):
+    """Add the time since started to a Server-Timing stage of the current request"""
+    if not QUERY_TRACE_ENABLED:
+        return
+    scope = REQUEST_SCOPE.get()
+    if scope is not None:
+        timings = scope.setdefault("fhir.timings", {})
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+def record_plan(step: str, examined: int = 0):
+    """Note an execution step (index used, scan, filter) and the rows it examined"""
+    if not QUERY_TRACE_ENABLED:
+        return
+    scope = REQUEST_SCOPE.get()
+    if scope is not None:
+        scope.setdefault("fhir.plan", []).append(step)
+        scope["fhir.examined"] = scope.get("fhir.examined", 0) + examined
+
+def slow_query_entry(scope: Dict, status: int, seconds: float) -> Dict:
+    """Slow-query log entry for a finished request"""
+    params: Dict[str, List[str]] = {}
+    query = parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+    for name, value in sorted(query, key=lambda param: param[0]):
+        params.setdefault(name, []).append(value)
+    
+    plan = scope.get("fhir.plan", [])
+    if any(step.startswith("index") for step in plan):
+        strategy = "index"
+    else:
+        strategy = "full scan" if plan else None
+    
+    return {
+        "time": datetime.now().isoformat(),
+        "method": scope["method"],
+        "route": scope["route"].path,
+        "path": scope["path"],
+        "params": params,
+        "status": status,
+        "duration_ms": round(seconds * 1000, 3),
+        "strategy": strategy,
+        "plan": plan,
+        "rows_examined": scope.get("fhir.examined", 0),
+        "rows_returned": scope.get("fhir.result_size"),
+        "stages_ms": {stage: round(value * 1000, 3) for stage, value in scope.get("fhir.timings", {}).items()},
+    }
+
+def server_timing(timings: Dict[str, float], started: float) -> bytes:
+    """Server-Timing header value (milliseconds) for the recorded stages plus the total"""
+    metrics = [f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in timings.items()]
+    metrics.append(f"total;dur={(time.perf_counter() - started) * 1000:.3f}")
+    return ", ".join(metrics).encode("latin-1")
+
+def request_header(name: bytes) -> Optional[str]:
+    """Read a header from the current request"""
+    scope = REQUEST_SCOPE.get()
+    if scope is None:
+        return None
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+def record_result_size(entries: int):
+    """Note the number of matched resources for the result-size histogram"""
+    scope = REQUEST_SCOPE.get()
+    if scope is not None:
+        scope["fhir.result_size"] = entries
+
+def request_route() -> Optional[str]:
+    """Route template of the current request"""
+    scope = REQUEST_SCOPE.get()
+    route = scope.get("route") if scope is not None else None
+    return route.path if route is not None else None
+
+def search_plan() -> Optional[SearchPlan]:
+    """Plan of the search being executed for the current request"""
+    scope = REQUEST_SCOPE.get()
+    return scope.get("fhir.search_plan") if scope is not None else None
+
+def request_params() -> List[tuple]:
+    """Query parameters of the current request as (name, value) pairs"""
+    scope = REQUEST_SCOPE.get()
+    if scope is None:
+        return []
+    return parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+
+def request_key() -> Optional[str]:
+    """Normalized path and query of the current request, used as a cache key"""
+    scope = REQUEST_SCOPE.get()
+    if scope is None:
+        return None
+    # Stable sort keeps the order of repeated parameters (e.g. date=ge...&date=le...)
+    query = urlencode(sorted(request_params(), key=lambda param: param[0]))
+    return f"{scope['path']}?{query}" if query else scope["path"]
+
+def projection_params():
+    """Parse _summary / _elements from the current request"""
+    params = dict(request_params())
+    try:
+        return parse_projection(params.get("_summary"), params.get("_elements"))
+    except ProjectionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # Load all data files
 def load_data():
     """Load all synthetic data files"""
@@ -107,89 +349,428 @@ def load_data():
     return data
 
 # Load data on startup
-FHIR_DATA = load_data()
+_load_started = time.perf_counter()
+# Scan worker processes re-import the main script as __mp_main__; they only
+# read the shared-memory columns, so they skip loading the data
+FHIR_DATA = load_data() if __name__ != "__mp_main__" else {}
+SCHEDULES = Schedules(FHIR_DATA, WORKING_HOURS)
+if FHIR_DATA:
+    FHIR_DATA["Schedule"] = SCHEDULES.schedules
+DATA_LOAD_SECONDS = time.perf_counter() - _load_started
+INDEX = FHIRIndex(FHIR_DATA, token_indexes(), sort_indexes(), string_indexes(), date_indexes(), series_indexes())
+COLUMNS = ColumnStore(FHIR_DATA, SEARCH_PARAMETERS, COLUMNAR_MIN_ROWS)
+SCANNER = PartitionedScanner(COLUMNS, SCAN_PROCESSES, PARALLEL_SCAN_MIN_ROWS)
 
 def get_resource_by_id(resource_type: str, resource_id: str) -> Optional[Dict]:
     """Get a resource by ID"""
-    resources = FHIR_DATA.get(resource_type, [])
-    
-    for resource in resources:
-        if isinstance(resource, dict):
-            # Handle wrapped Patient resources
-            if resource_type == "Patient" and "data" in resource:
-                if resource.get("id") == resource_id or resource.get("data", {}).get("id") == resource_id:
-                    return resource
-            # Handle regular resources
-            elif resource.get("id") == resource_id:
-                return resource
-    
-    return None
+    record_plan(f"index {resource_type}._id")
+    return INDEX.get(resource_type, resource_id)
 
-def search_resources(resource_type: str, filters: Dict[str, Any]) -> List[Dict]:
-    """Search resources with filters"""
-    resources = FHIR_DATA.get(resource_type, [])
-    results = []
+def search_positions(
+    resource_type: str,
+    filters: Dict[str, Any],
+    required: frozenset = frozenset()
+) -> Tuple[Optional[List[int]], SearchPlan]:
+    """
+    Candidate positions for a search: indexed filters are looked up and
+    intersected, most selective first (None means a full scan)
+    """
+    started = time.perf_counter()
+    plan = plan_search(INDEX, resource_type, filters, required)
+    positions = plan.execute()
+    if positions is None:
+        record_plan(f"scan {resource_type}")
+    else:
+        for param in plan.applied:
+            record_plan(f"index {resource_type}.{param}")
     
-    for resource in resources:
-        if not isinstance(resource, dict):
+    scope = REQUEST_SCOPE.get()
+    if scope is not None:
+        scope["fhir.search_plan"] = plan
+    record_timing("index", started)
+    return positions, plan
+
+def candidate_positions(resource_type: str, positions: Optional[List[int]]) -> List[int]:
+    """Candidate positions (every resource of the type for a full scan)"""
+    if positions is None:
+        return [position for position, resource in enumerate(FHIR_DATA.get(resource_type, [])) if isinstance(resource, dict)]
+    return positions
+
+def candidate_resources(resource_type: str, positions: Optional[List[int]]) -> List[Dict]:
+    """Materialize candidate positions (every resource of the type for a full scan)"""
+    if positions is None:
+        return [resource for resource in FHIR_DATA.get(resource_type, []) if isinstance(resource, dict)]
+    return INDEX.resources(resource_type, positions)
+
+def request_sort(resource_type: str) -> List[Tuple[str, bool]]:
+    """_sort keys of the current request as (parameter, descending)"""
+    value = dict(request_params()).get("_sort")
+    if not value:
+        return []
+    try:
+        return parse_sort(resource_type, value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def request_chains(resource_type: str) -> Dict[str, str]:
+    """
+    Chained (patient.family=...) and reverse-chained (_has:...) parameters of
+    the current request, answered by index joins
+    """
+    chains = {}
+    for name, value in request_params():
+        if not value or not ("." in name or name.startswith("_has:")):
             continue
-        
-        match = True
-        
-        # Patient filter
-        if "patient" in filters:
-            patient_id = filters["patient"]
-            # Check subject.reference, patient.reference, or beneficiary
-            subject_ref = resource.get("subject", {}).get("reference", "")
-            patient_ref = resource.get("patient", {}).get("reference", "")
-            beneficiary_ref = resource.get("beneficiary", "")
-            
-            if isinstance(beneficiary_ref, str):
-                beneficiary_id = beneficiary_ref.replace("Patient/", "")
+        try:
+            if name.startswith("_has:"):
+                parse_has(resource_type, name)
             else:
-                beneficiary_id = beneficiary_ref.get("reference", "").replace("Patient/", "") if isinstance(beneficiary_ref, dict) else ""
-            
-            patient_id_check = patient_id.replace("Patient/", "")
-            
-            if (f"Patient/{patient_id_check}" not in subject_ref and 
-                f"Patient/{patient_id_check}" not in patient_ref and
-                patient_id_check != beneficiary_id):
-                match = False
-        
-        # Organization filter
-        if "organization" in filters and match:
-            org_id = filters["organization"].replace("Organization/", "")
-            service_provider = resource.get("serviceProvider", {}).get("reference", "")
-            payor_refs = resource.get("payor", [])
-            
-            if isinstance(payor_refs, list):
-                payor_match = any(f"Organization/{org_id}" in payor.get("reference", "") for payor in payor_refs)
-            else:
-                payor_match = False
-            
-            if f"Organization/{org_id}" not in service_provider and not payor_match:
-                match = False
-        
-        if match:
-            results.append(resource)
+                parse_chain(resource_type, name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        chains[name] = value
+    return chains
+
+def request_count() -> Optional[int]:
+    """_count of the current request, when it is a positive number"""
+    count = dict(request_params()).get("_count")
+    return int(count) if count and count.isdigit() and int(count) > 0 else None
+
+async def run_sort(resource_type: str, positions: Optional[List[int]], keys: List[Tuple[str, bool]]) -> List[int]:
+    """Order matched positions by _sort, keeping only the first _count"""
+    started = time.perf_counter()
+    examined = len(FHIR_DATA.get(resource_type, [])) if positions is None else len(positions)
+    if examined < SCAN_OFFLOAD_ROWS:
+        ordered, strategy = sort_positions(INDEX, resource_type, positions, keys, request_count())
+    else:
+        ordered, strategy = await offload(sort_positions, INDEX, resource_type, positions, keys, request_count())
+    
+    label = f"{strategy} " + ", ".join(("-" if descending else "") + name for name, descending in keys)
+    record_plan(f"sort {label}", examined)
+    record_timing("sort", started)
+    plan = search_plan()
+    if plan is not None:
+        plan.add_step("sort", label, None, len(ordered), examined, started)
+    return ordered
+
+async def run_columnar(
+    resource_type: str,
+    values: Dict[str, str],
+    positions: Optional[List[int]]
+) -> Tuple[Optional[List[int]], Tuple[str, ...]]:
+    """
+    Evaluate the parameters that have columns as vectorized masks over the
+    candidates (partitioned across the scan processes for the largest types)
+    """
+    started = time.perf_counter()
+    examined = len(FHIR_DATA.get(resource_type, [])) if positions is None else len(positions)
+    if examined < SCAN_OFFLOAD_ROWS:
+        selected, evaluated = SCANNER.select(resource_type, values, positions)
+    else:
+        selected, evaluated = await offload(SCANNER.select, resource_type, values, positions)
+    if not evaluated:
+        return positions, evaluated
+    
+    label = f"columnar({', '.join(evaluated)})"
+    if SCANNER.covers(resource_type):
+        label += f" across {SCANNER.workers} processes"
+    record_plan(f"filter {label}", examined)
+    record_timing("filter", started)
+    plan = search_plan()
+    if plan is not None:
+        plan.add_step("filter", label, None, len(selected), examined, started)
+    return selected, evaluated
+
+async def run_search(resource_type: str, params: Dict[str, Optional[str]]) -> List[Dict]:
+    """
+    Execute a search with the compiled query for its parameter signature:
+    index lookups first, then columnar masks for large candidate sets, then
+    row predicates for whatever is left, then _sort
+    """
+    values = {name: value for name, value in params.items() if value}
+    query = compile_query(resource_type, tuple(sorted(values)))
+    sort = request_sort(resource_type)
+    chains = request_chains(resource_type)
+    positions, plan = search_positions(
+        resource_type, {**{name: values[name] for name in query.indexed}, **chains},
+        query.index_only.union(chains)
+    )
+    
+    applied = tuple(plan.applied)
+    evaluated: Tuple[str, ...] = ()
+    if COLUMNS.covers(resource_type) and (positions is None or len(positions) >= COLUMNAR_MIN_ROWS):
+        residual = {name: values[name] for name in query.predicate_names(applied)}
+        positions, evaluated = await run_columnar(resource_type, residual, positions)
+    
+    predicate = query.predicate(values, applied, evaluated)
+    if predicate is not None:
+        label = f"filter_positions({', '.join(query.predicate_names(applied, evaluated))})"
+        positions = await run_scan(
+            candidate_positions(resource_type, positions), filter_positions, FHIR_DATA[resource_type], predicate,
+            label=label
+        )
+    if sort:
+        positions = await run_sort(resource_type, positions, sort)
+    return candidate_resources(resource_type, positions)
+
+async def offload(func: Callable, *args) -> Any:
+    """Run func on the scan executor (attributed to the current route while profiling)"""
+    call = functools.partial(func, *args)
+    if PROFILER.active:
+        call = PROFILER.attributed(request_route(), call)
+    return await asyncio.get_running_loop().run_in_executor(SCAN_EXECUTOR, call)
+
+async def run_scan(rows: List[Any], func: Callable, *args, label: Optional[str] = None) -> List[Any]:
+    """Run a filter pass inline for small candidate sets, on the scan executor otherwise"""
+    started = time.perf_counter()
+    label = label or func.__name__
+    record_plan(f"filter {label}", len(rows))
+    if len(rows) < SCAN_OFFLOAD_ROWS:
+        filtered = func(rows, *args)
+    else:
+        filtered = await offload(func, rows, *args)
+    record_timing("filter", started)
+    
+    plan = search_plan()
+    if plan is not None:
+        plan.add_step("filter", label, None, len(filtered), len(rows), started)
+    return filtered
+
+def serialize(payload: Any) -> bytes:
+    """Encode a payload the same way FastAPI's JSONResponse does"""
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+async def json_response(payload: Any, rows: int = 1, cache: bool = False) -> Response:
+    """
+    Serialize a payload, offloading large bundles to the scan executor.
+    Already-encoded payloads (bytes) are sent as they are.
+    
+    Bodies above COMPRESSION_MIN_BYTES are compressed with the encoding negotiated
+    from Accept-Encoding. With cache=True the compressed bytes are kept per
+    request URL, so repeated reads and searches skip serialization and compression.
+    """
+    encoding = negotiate_encoding(request_header(b"accept-encoding")) if COMPRESSION_ENABLED else None
+    headers = {"Vary": "Accept-Encoding"} if COMPRESSION_ENABLED else None
+    key = request_key() if cache and encoding else None
+    
+    if key:
+        started = time.perf_counter()
+        cached = COMPRESSION_CACHE.get(key, encoding)
+        if cached is not None:
+            record_timing("cache", started)
+            compressed, original_size = cached
+            COMPRESSION_STATS.cache_hits += 1
+            COMPRESSION_STATS.record(original_size, len(compressed))
+            return Response(content=compressed, media_type="application/json",
+                            headers={**headers, "Content-Encoding": encoding})
+    
+    started = time.perf_counter()
+    if isinstance(payload, bytes):
+        body = payload
+    elif rows < SERIALIZE_OFFLOAD_ROWS:
+        body = serialize(payload)
+    else:
+        body = await offload(serialize, payload)
+    record_timing("serialize", started)
+    
+    if not encoding or len(body) < COMPRESSION_MIN_BYTES:
+        return Response(content=body, media_type="application/json", headers=headers)
+    
+    started = time.perf_counter()
+    if len(body) < COMPRESSION_OFFLOAD_BYTES:
+        compressed = compress(body, encoding, GZIP_LEVEL, BROTLI_QUALITY)
+    else:
+        compressed = await offload(compress, body, encoding, GZIP_LEVEL, BROTLI_QUALITY)
+    record_timing("compress", started)
+    COMPRESSION_STATS.record(len(body), len(compressed))
+    if key:
+        COMPRESSION_STATS.cache_misses += 1
+        COMPRESSION_CACHE.put(key, encoding, compressed, len(body))
     
-    return results
+    return Response(content=compressed, media_type="application/json",
+                    headers={**headers, "Content-Encoding": encoding})
 
-def create_bundle_response(resources: List[Dict], resource_type: str, total: Optional[int] = None) -> Dict:
+def project_resource(resource: Dict, summary: Optional[str], elements) -> Dict:
+    """Apply a _summary / _elements projection (Patient wrappers project their data)"""
+    if summary is None and elements is None:
+        return resource
+    body = resource_body(resource)
+    if body is not resource:
+        return {**resource, "data": PROJECTION_CACHE.project(body, summary, elements)}
+    return PROJECTION_CACHE.project(resource, summary, elements)
+
+async def resource_response(resource: Dict) -> Response:
+    """Serialize a single resource for a read, honouring _summary / _elements"""
+    summary, elements = projection_params()
+    # _summary=count only applies to searches
+    if summary == "count":
+        summary = None
+    return await json_response(project_resource(resource, summary, elements), cache=True)
+
+async def count_response(resource_type: str, total: int, cache: bool = True) -> Response:
+    """Bundle carrying only a total, for _summary=count"""
+    bundle = create_bundle_response([], resource_type, total)
+    del bundle["entry"]
+    return await json_response(bundle, cache=cache)
+
+async def count_from_index(resource_type: str) -> Optional[Response]:
+    """
+    Answer _summary=count straight from index cardinalities when the search
+    has no filters or only a patient filter; returns None otherwise
+    """
+    summary, _ = projection_params()
+    params = request_params()
+    if summary != "count" or any(name == "_explain" for name, _ in params):
+        return None
+    
+    search = [(name, value) for name, value in params if name not in RESULT_PARAMETERS]
+    if not search:
+        total = len(FHIR_DATA.get(resource_type, []))
+    elif len(search) == 1 and search[0][0] == "patient":
+        total = len(index_lookup(INDEX, resource_type, "patient", search[0][1]))
+    else:
+        return None
+    record_plan(f"index {resource_type} count")
+    
+    count = request_count()
+    if count:
+        total = min(total, count)
+    return await count_response(resource_type, total)
+
+def parse_include(value: str, kind: str) -> List[tuple]:
+    """Parse 'Source:param[:Target]' (or 'Source:*') into (source, param, target) tuples"""
+    parts = value.split(":")
+    if len(parts) not in (2, 3) or parts[0] not in REFERENCE_PARAMS:
+        raise HTTPException(status_code=400, detail=f"Unsupported {kind} '{value}'")
+    source, param = parts[0], parts[1]
+    target = parts[2] if len(parts) == 3 else None
+    if param == "*":
+        return [(source, name, target) for name in REFERENCE_PARAMS[source]]
+    if param not in REFERENCE_PARAMS[source]:
+        raise HTTPException(status_code=400, detail=f"Unsupported {kind} '{value}'")
+    return [(source, param, target)]
+
+def resolve_includes(resources: List[Dict], resource_type: str) -> List[Dict]:
+    """
+    Resolve _include / _revinclude for a page of matches through the
+    reference indexes, returning each included resource once
+    """
+    params = request_params()
+    includes = [spec for name, value in params if name == "_include" for spec in parse_include(value, "_include")]
+    revincludes = [spec for name, value in params if name == "_revinclude" for spec in parse_include(value, "_revinclude")]
+    if not includes and not revincludes:
+        return []
+    
+    seen = {f"{resource_type}/{resource.get('id')}" for resource in resources}
+    included = []
+    
+    def add(reference: str, resource: Optional[Dict]):
+        if resource is not None and reference not in seen:
+            seen.add(reference)
+            included.append(resource)
+    
+    # _include: follow references held by the matches
+    for source, param, target in includes:
+        if source != resource_type:
+            continue
+        for resource in resources:
+            for reference in INDEX.references_from(source, param, resource):
+                if target and not reference.startswith(f"{target}/"):
+                    continue
+                add(reference, INDEX.resolve(reference))
+    
+    # _revinclude: resources of another type that point at the matches
+    for source, param, target in revincludes:
+        if target and target != resource_type:
+            continue
+        source_resources = FHIR_DATA.get(source, [])
+        for resource in resources:
+            for position in INDEX.referencing(source, param, f"{resource_type}/{resource.get('id')}"):
+                other = source_resources[position]
+                add(f"{source}/{other.get('id')}", other)
+    
+    return included
+
+async def bundle_response(
+    resources: List[Dict],
+    resource_type: str,
+    total: Optional[int] = None,
+    cache: bool = True
+) -> Response:
+    """
+    Create and serialize a FHIR Bundle response. cache=False keeps it out of
+    the URL-keyed response cache, for results that depend on more than the URL.
+    """
+    summary, elements = projection_params()
+    record_result_size(len(resources))
+    if dict(request_params()).get("_explain", "false") != "false":
+        return await explain_response(resources, resource_type)
+    if summary == "count":
+        return await count_response(resource_type, len(resources) if total is None else total, cache)
+    started = time.perf_counter()
+    included = resolve_includes(resources, resource_type)
+    if summary is not None or elements is not None:
+        resources = [project_resource(resource, summary, elements) for resource in resources]
+        included = [project_resource(resource, summary, elements) for resource in included]
+    bundle = create_bundle_response(resources, resource_type, total, included)
+    record_timing("bundle", started)
+    return await json_response(bundle, len(resources) + len(included), cache=cache)
+
+async def explain_response(resources: List[Dict], resource_type: str) -> Response:
+    """_explain: the executed search plan instead of the Bundle"""
+    plan = search_plan()
+    if plan is None:
+        # Endpoints without index-backed parameters read the whole type
+        plan = plan_search(INDEX, resource_type, {})
+        plan.execute()
+    search = [(name, value) for name, value in request_params() if name not in RESULT_PARAMETERS]
+    explained = plan.to_dict()
+    explained["search"] = [{"param": name, "value": value} for name, value in search]
+    explained["residual"] = list(dict.fromkeys(name for name, _ in search if name not in plan.applied))
+    explained["returned"] = len(resources)
+    explained["ms"] = round(sum(step.seconds for step in plan.steps) * 1000, 3)
+    return await json_response(explained)
+
+FHIR_BASE_URL = "https://fhir.epic.com/interconnect-fhir-oauth/api/FHIR/R4"
+
+# Serialized bundle entries keyed by (type, id, mode), filled on first use
+ENTRY_FRAGMENTS: Dict[tuple, bytes] = {}
+
+def bundle_entry(resource: Dict, resource_type: str, mode: str = "match") -> Dict:
+    """A Bundle.entry for a resource"""
+    resource_id = resource.get("id", "")
+    return {
+        "fullUrl": f"{FHIR_BASE_URL}/{resource_type}/{resource_id}",
+        "resource": resource,
+        "search": {
+            "mode": mode
+        }
+    }
+
+def entry_fragment(resource: Dict, resource_type: str, mode: str = "match") -> bytes:
+    """Pre-serialized Bundle.entry, so large bundles can be assembled by joining bytes"""
+    key = (resource_type, resource.get("id"), mode)
+    fragment = ENTRY_FRAGMENTS.get(key)
+    if fragment is None:
+        fragment = serialize(bundle_entry(resource, resource_type, mode))
+        ENTRY_FRAGMENTS[key] = fragment
+    return fragment
+
+def create_bundle_response(
+    resources: List[Dict],
+    resource_type: str,
+    total: Optional[int] = None,
+    included: Optional[List[Dict]] = None
+) -> Dict:
     """Create a FHIR Bundle response"""
     if total is None:
         total = len(resources)
     
-    entries = []
-    for resource in resources:
-        resource_id = resource.get("id", "")
-        entries.append({
-            "fullUrl": f"https://fhir.epic.com/interconnect-fhir-oauth/api/FHIR/R4/{resource_type}/{resource_id}",
-            "resource": resource,
-            "search": {
-                "mode": "match"
-            }
-        })
+    entries = [bundle_entry(resource, resource_type) for resource in resources]
+    
+    # _include / _revinclude entries
+    for resource in included or []:
+        entries.append(bundle_entry(resource, resource.get("resourceType", ""), "include"))
     
     return {
         "resourceType": "Bundle",
@@ -197,34 +778,287 @@ def create_bundle_response(resources: List[Dict], resource_type: str, total: Opt
         "total": total,
         "link": [{
             "relation": "self",
-            "url": f"https://fhir.epic.com/interconnect-fhir-oauth/api/FHIR/R4/{resource_type}?_count=100"
+            "url": f"{FHIR_BASE_URL}/{resource_type}?_count=100"
         }],
         "entry": entries
     }
 
 # Root endpoint
 @app.get("/")
-def root():
+async def root(
+    identifier: Optional[str] = Query(None, description="Identifier to look up across all resource types"),
+    _type: Optional[str] = Query(None, description="Comma-separated resource types to return"),
+    _count: Optional[int] = Query(None)
+):
+    """Server summary, or a system-level search by identifier (GET [base]?identifier=system|value)"""
+    if identifier:
+        return await search_identifiers(identifier, _type, _count)
     return {
         "message": "GooClaim FHIR Mock API",
         "version": "1.0.0",
         "resources": list(FHIR_DATA.keys())
     }
 
+async def search_identifiers(identifier: str, _type: Optional[str], _count: Optional[int]) -> Response:
+    """
+    Resources of any type holding the identifier, from the global identifier
+    index (value, system|value or system|; comma-separated values are ORed)
+    """
+    started = time.perf_counter()
+    matches = INDEX.identified(split_values(identifier))
+    record_plan("index identifier (all types)")
+    if _type:
+        types = {t.strip() for t in _type.split(",") if t.strip()}
+        matches = [match for match in matches if match[0] in types]
+    record_timing("index", started)
+    
+    total = len(matches)
+    page = matches[:_count] if _count else matches
+    record_result_size(len(page))
+    started = time.perf_counter()
+    fragments = [entry_fragment(FHIR_DATA[resource_type][position], resource_type) for resource_type, position in page]
+    links = [{"relation": "self", "url": f"{FHIR_BASE_URL}?{urlencode(request_params())}"}]
+    head = serialize({"resourceType": "Bundle", "type": "searchset", "total": total, "link": links})
+    body = head[:-1] + b',"entry":[' + b",".join(fragments) + b"]}"
+    record_timing("bundle", started)
+    return await json_response(body, cache=True)
+
+def operation_outcome(status: int, diagnostics: str) -> Dict:
+    """OperationOutcome describing a failed request"""
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [{
+            "severity": "error",
+            "code": "not-found" if status == 404 else "processing",
+            "diagnostics": diagnostics
+        }]
+    }
+
+def normalize_entry_url(url: str) -> str:
+    """Turn a batch entry request.url ('Patient/x', '/Patient?..', absolute) into a path?query"""
+    if "://" in url:
+        parts = urlsplit(url)
+        path = parts.path
+        # Drop the server base (everything before the resource type)
+        marker = "/R4/"
+        if marker in path:
+            path = path.split(marker, 1)[1]
+        url = path + (f"?{parts.query}" if parts.query else "")
+    url = "/" + url.lstrip("/")
+    path, _, query = url.partition("?")
+    params = sorted(parse_qsl(query, keep_blank_values=True), key=lambda param: param[0])
+    return path + (f"?{urlencode(params)}" if params else "")
+
+async def dispatch_get(url: str) -> tuple:
+    """Run a GET through the application's own ASGI stack, returning (status, content type, body)"""
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("latin-1"),
+        "query_string": query.encode("latin-1"),
+        "root_path": "",
+        "headers": [(b"accept", b"application/fhir+json")],
+        "client": ("batch", 0),
+        "server": ("batch", 0),
+    }
+    status = 500
+    content_type = ""
+    chunks = []
+    
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+    
+    async def send(message):
+        nonlocal status, content_type
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            headers = dict(message.get("headers", []))
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+    
+    await app(scope, receive, send)
+    return status, content_type, b"".join(chunks)
+
+def batch_entry_result(status: int, content_type: str, body: bytes) -> tuple:
+    """(status, body) of a sub-request; non-JSON responses (/metrics, /docs) become a 400 error entry"""
+    if status < 400 and "json" not in content_type:
+        detail = f"Batch entries must address FHIR resources ({content_type or 'no content type'} returned)"
+        return 400, serialize({"detail": detail})
+    return status, body
+
+def batch_entry_fragment(status: int, body: bytes) -> bytes:
+    """Serialized batch-response entry wrapping a sub-request's response body"""
+    status_text = f"{status} {HTTPStatus(status).phrase}"
+    if status >= 400:
+        try:
+            detail = json.loads(body).get("detail", "")
+        except (ValueError, AttributeError):
+            detail = body.decode("utf-8", "replace")
+        body = serialize(operation_outcome(status, detail if isinstance(detail, str) else json.dumps(detail)))
+        return b'{"response":{"status":' + serialize(status_text) + b',"outcome":' + body + b"}}"
+    return b'{"resource":' + body + b',"response":{"status":' + serialize(status_text) + b"}}"
+
+# Batch / transaction endpoint
+@app.post("/")
+async def process_bundle(request: Request):
+    """
+    Process a batch or transaction Bundle of GET entries (reads and searches)
+    
+    Identical sub-requests are executed once, and the unique ones run
+    concurrently through the normal routes. Transactions fail as a whole
+    if any entry fails.
+    """
+    started = time.perf_counter()
+    try:
+        bundle = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be a FHIR Bundle")
+    
+    if not isinstance(bundle, dict) or bundle.get("resourceType") != "Bundle" or bundle.get("type") not in ("batch", "transaction"):
+        raise HTTPException(status_code=400, detail="Expected a Bundle of type batch or transaction")
+    
+    is_transaction = bundle["type"] == "transaction"
+    entries = bundle.get("entry", []) or []
+    if len(entries) > BATCH_MAX_ENTRIES:
+        raise HTTPException(status_code=413, detail=f"Bundle has {len(entries)} entries (limit {BATCH_MAX_ENTRIES})")
+    
+    # Validate entries and collect unique sub-requests
+    urls: List[Optional[str]] = []
+    for entry in entries:
+        entry_request = entry.get("request") if isinstance(entry, dict) else None
+        if not isinstance(entry_request, dict):
+            entry_request = {}
+        method = str(entry_request.get("method", "")).upper()
+        url = entry_request.get("url")
+        if method != "GET" or not isinstance(url, str) or not url:
+            if is_transaction:
+                raise HTTPException(status_code=400, detail="Transaction entries must be GET requests with a url")
+            urls.append(None)
+        else:
+            urls.append(normalize_entry_url(url))
+    unique_urls = list(dict.fromkeys(url for url in urls if url is not None))
+    
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def run(url: str) -> tuple:
+        async with semaphore:
+            return batch_entry_result(*await dispatch_get(url))
+    
+    results = dict(zip(unique_urls, await asyncio.gather(*[run(url) for url in unique_urls])))
+    
+    if is_transaction:
+        for url in unique_urls:
+            status, body = results[url]
+            if status >= 400:
+                raise HTTPException(status_code=status, detail=f"Transaction failed at {url}: {body.decode('utf-8', 'replace')}")
+    
+    fragments = []
+    for url in urls:
+        if url is None:
+            fragments.append(batch_entry_fragment(400, serialize({"detail": "Only GET entries with a url are supported"})))
+        else:
+            fragments.append(batch_entry_fragment(*results[url]))
+    
+    response_type = "transaction-response" if is_transaction else "batch-response"
+    body = b'{"resourceType":"Bundle","type":"' + response_type.encode() + b'","entry":[' + b",".join(fragments) + b"]}"
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    response = await json_response(body)
+    response.headers["X-Batch-Entries"] = str(len(entries))
+    response.headers["X-Batch-Unique-Requests"] = str(len(unique_urls))
+    response.headers["X-Batch-Duration-Ms"] = f"{elapsed_ms:.2f}"
+    return response
+
 # Patient endpoints
 @app.get("/Patient/{patient_id}")
-def get_patient(patient_id: str):
+async def get_patient(patient_id: str):
     """Get a specific patient by ID - Epic compatible format"""
     patient = get_resource_by_id("Patient", patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     # Return patient with wrapper structure (matches Epic format)
-    return patient
+    return await resource_response(patient)
+
+@app.get("/Patient/{patient_id}/$everything")
+async def patient_everything(
+    patient_id: str,
+    _since: Optional[str] = Query(None, description="Only resources updated at or after this instant"),
+    _type: Optional[str] = Query(None, description="Comma-separated resource types to return"),
+    _count: Optional[int] = Query(None, description="Page size"),
+    _offset: int = Query(0, ge=0, description="Index of the first entry on this page")
+):
+    """
+    Patient $everything - the Patient, its compartment and the resources they
+    reference, in one Bundle
+    
+    Members come from the per-patient compartment index and each entry is a
+    cached pre-serialized fragment, so the bundle is assembled by joining bytes.
+    """
+    if get_resource_by_id("Patient", patient_id) is None:
+        raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
+    since = parse_instant(_since) if _since else None
+    if _since and since is None:
+        raise HTTPException(status_code=400, detail=f"Invalid _since instant '{_since}'")
+    
+    started = time.perf_counter()
+    members = INDEX.compartment(patient_id)
+    record_plan("index Patient.compartment")
+    record_timing("index", started)
+    
+    started = time.perf_counter()
+    if _type or _since:
+        record_plan("filter _type/_since", len(members))
+    # Filter by _type
+    if _type:
+        types = {t.strip() for t in _type.split(",") if t.strip()}
+        members = [member for member in members if member[0] in types]
+    
+    # Filter by _since, comparing instants (resources with no known or parseable update time are kept)
+    if since is not None:
+        since_members = []
+        for resource_type, position, mode in members:
+            updated = INDEX.last_updated[resource_type][position]
+            instant = parse_instant(updated) if updated else None
+            if instant is None or instant >= since:
+                since_members.append((resource_type, position, mode))
+        members = since_members
+    record_timing("filter", started)
+    
+    total = len(members)
+    page = members[_offset:_offset + _count] if _count else members[_offset:]
+    
+    # Paging links
+    base_params = [(name, value) for name, value in request_params() if name != "_offset"]
+    def page_url(offset: int) -> str:
+        query = urlencode(base_params + ([("_offset", str(offset))] if offset else []))
+        return f"{FHIR_BASE_URL}/Patient/{patient_id}/$everything" + (f"?{query}" if query else "")
+    links = [{"relation": "self", "url": page_url(_offset)}]
+    if _count and _offset + _count < total:
+        links.append({"relation": "next", "url": page_url(_offset + _count)})
+    if _count and _offset > 0:
+        links.append({"relation": "previous", "url": page_url(max(0, _offset - _count))})
+    
+    record_result_size(len(page))
+    started = time.perf_counter()
+    fragments = [
+        entry_fragment(FHIR_DATA[resource_type][position], resource_type, mode)
+        for resource_type, position, mode in page
+    ]
+    head = serialize({"resourceType": "Bundle", "type": "searchset", "total": total, "link": links})
+    body = head[:-1] + b',"entry":[' + b",".join(fragments) + b"]}"
+    record_timing("bundle", started)
+    return await json_response(body, cache=True)
 
 @app.get("/Patient")
-def search_patients(
+async def search_patients(
     _id: Optional[str] = Query(None, description="Patient ID"),
-    identifier: Optional[str] = Query(None, description="Identifier value"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
     name: Optional[str] = Query(None, description="Patient name"),
     family: Optional[str] = Query(None, description="Family name"),
     given: Optional[str] = Query(None, description="Given name"),
@@ -233,124 +1067,98 @@ def search_patients(
     _count: Optional[int] = Query(None, description="Number of results")
 ):
     """Search for patients - Epic compatible"""
-    patients = FHIR_DATA.get("Patient", [])
-    filtered = []
+    counted = await count_from_index("Patient")
+    if counted:
+        return counted
     
-    for patient in patients:
-        match = True
-        patient_data = patient.get("data", patient)
-        
-        # Filter by _id
-        if _id and patient.get("id") != _id:
-            match = False
-        
-        # Filter by identifier
-        if identifier and match:
-            identifiers = patient_data.get("identifier", [])
-            ident_match = any(ident.get("value") == identifier for ident in identifiers)
-            if not ident_match:
-                match = False
-        
-        # Filter by family name
-        if family and match:
-            names = patient_data.get("name", [])
-            family_match = any(family.lower() in name.get("family", "").lower() for name in names)
-            if not family_match:
-                match = False
-        
-        # Filter by given name
-        if given and match:
-            names = patient_data.get("name", [])
-            given_match = any(given.lower() in " ".join(name.get("given", [])).lower() for name in names)
-            if not given_match:
-                match = False
-        
-        # Filter by name (full name search)
-        if name and match:
-            names = patient_data.get("name", [])
-            name_match = any(name.lower() in (name_obj.get("text", "") or 
-                                              f"{' '.join(name_obj.get('given', []))} {name_obj.get('family', '')}").lower() 
-                             for name_obj in names)
-            if not name_match:
-                match = False
-        
-        # Filter by birthdate
-        if birthdate and match:
-            if patient_data.get("birthDate") != birthdate:
-                match = False
-        
-        # Filter by gender
-        if gender and match:
-            if patient_data.get("gender") != gender:
-                match = False
-        
-        if match:
-            filtered.append(patient)
+    filtered = await run_search("Patient", {
+        "_id": _id, "identifier": identifier, "name": name, "family": family, "given": given,
+        "birthdate": birthdate, "gender": gender
+    })
     
     # Limit results
     if _count:
         filtered = filtered[:_count]
     
-    return create_bundle_response(filtered, "Patient")
+    return await bundle_response(filtered, "Patient")
 
 # Organization endpoints
 @app.get("/Organization/{org_id}")
-def get_organization(org_id: str):
+async def get_organization(org_id: str):
     """Get a specific organization by ID"""
     org = get_resource_by_id("Organization", org_id)
     if not org:
         raise HTTPException(status_code=404, detail=f"Organization {org_id} not found")
-    return org
+    return await resource_response(org)
 
 @app.get("/Organization")
-def search_organizations(_count: Optional[int] = Query(None)):
+async def search_organizations(
+    _id: Optional[str] = Query(None, description="Organization ID"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
+    name: Optional[str] = Query(None, description="Organization name or alias"),
+    address_city: Optional[str] = Query(None, alias="address-city", description="City"),
+    address_state: Optional[str] = Query(None, alias="address-state", description="State"),
+    _count: Optional[int] = Query(None)
+):
     """Search for organizations"""
-    orgs = FHIR_DATA.get("Organization", [])
+    counted = await count_from_index("Organization")
+    if counted:
+        return counted
+    
+    orgs = await run_search("Organization", {
+        "_id": _id, "identifier": identifier, "name": name, "address-city": address_city, "address-state": address_state
+    })
     if _count:
         orgs = orgs[:_count]
-    return create_bundle_response(orgs, "Organization")
+    return await bundle_response(orgs, "Organization")
 
 # Coverage endpoints
 @app.get("/Coverage/{coverage_id}")
-def get_coverage(coverage_id: str):
+async def get_coverage(coverage_id: str):
     """Get a specific coverage by ID"""
     coverage = get_resource_by_id("Coverage", coverage_id)
     if not coverage:
         raise HTTPException(status_code=404, detail=f"Coverage {coverage_id} not found")
-    return coverage
+    return await resource_response(coverage)
 
 @app.get("/Coverage")
-def search_coverages(
+async def search_coverages(
     patient: Optional[str] = Query(None, description="Patient ID"),
     beneficiary: Optional[str] = Query(None, description="Beneficiary ID"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
     _count: Optional[int] = Query(None)
 ):
     """Search for coverage"""
-    filters = {}
+    counted = await count_from_index("Coverage")
+    if counted:
+        return counted
+    
+    filters = {"identifier": identifier}
     if patient:
         filters["patient"] = patient
     if beneficiary:
         filters["patient"] = beneficiary
     
-    coverages = search_resources("Coverage", filters) if filters else FHIR_DATA.get("Coverage", [])
+    coverages = await run_search("Coverage", filters)
     if _count:
         coverages = coverages[:_count]
     
-    return create_bundle_response(coverages, "Coverage")
+    return await bundle_response(coverages, "Coverage")
 
 # Encounter endpoints
 @app.get("/Encounter/{encounter_id}")
-def get_encounter(encounter_id: str):
+async def get_encounter(encounter_id: str):
     """Get a specific encounter by ID"""
     encounter = get_resource_by_id("Encounter", encounter_id)
     if not encounter:
         raise HTTPException(status_code=404, detail=f"Encounter {encounter_id} not found")
-    return encounter
+    return await resource_response(encounter)
 
 @app.get("/Encounter")
-def search_encounters(
+async def search_encounters(
     _id: Optional[str] = Query(None, description="Encounter ID"),
     patient: Optional[str] = Query(None, description="Patient ID"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
     organization: Optional[str] = Query(None, description="Organization ID"),
     status: Optional[str] = Query(None, description="Encounter status"),
     class_code: Optional[str] = Query(None, alias="class", description="Encounter class"),
@@ -358,568 +1166,716 @@ def search_encounters(
     _count: Optional[int] = Query(None)
 ):
     """Search for encounters - Epic compatible"""
-    filters = {}
-    if patient:
-        filters["patient"] = patient
-    if organization:
-        filters["organization"] = organization
+    counted = await count_from_index("Encounter")
+    if counted:
+        return counted
     
-    encounters = search_resources("Encounter", filters) if filters else FHIR_DATA.get("Encounter", [])
-    
-    # Additional filters
-    filtered = []
-    for enc in encounters:
-        match = True
-        
-        # Filter by _id
-        if _id and enc.get("id") != _id:
-            match = False
-        
-        # Filter by status
-        if status and match:
-            if enc.get("status") != status:
-                match = False
-        
-        # Filter by class
-        if class_code and match:
-            enc_class = enc.get("class", {}).get("code", "")
-            if enc_class != class_code:
-                match = False
-        
-        # Filter by date
-        if date and match:
-            period_start = enc.get("period", {}).get("start", "")
-            if date not in period_start:
-                match = False
-        
-        if match:
-            filtered.append(enc)
+    filtered = await run_search("Encounter", {
+        "_id": _id, "patient": patient, "identifier": identifier, "organization": organization, "status": status,
+        "class": class_code, "date": date
+    })
     
     if _count:
         filtered = filtered[:_count]
     
-    return create_bundle_response(filtered, "Encounter", total=len(filtered))
+    return await bundle_response(filtered, "Encounter", total=len(filtered))
 
 # Condition endpoints
 @app.get("/Condition/{condition_id}")
-def get_condition(condition_id: str):
+async def get_condition(condition_id: str):
     """Get a specific condition by ID"""
     condition = get_resource_by_id("Condition", condition_id)
     if not condition:
         raise HTTPException(status_code=404, detail=f"Condition {condition_id} not found")
-    return condition
+    return await resource_response(condition)
 
 @app.get("/Condition")
-def search_conditions(
+async def search_conditions(
     _id: Optional[str] = Query(None, description="Condition ID"),
     patient: Optional[str] = Query(None, description="Patient ID"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
     clinical_status: Optional[str] = Query(None, alias="clinical-status", description="Clinical status"),
     category: Optional[str] = Query(None, description="Category"),
     code: Optional[str] = Query(None, description="Condition code"),
     _count: Optional[int] = Query(None)
 ):
     """Search for conditions - Epic compatible"""
-    filters = {}
-    if patient:
-        filters["patient"] = patient
+    counted = await count_from_index("Condition")
+    if counted:
+        return counted
     
-    conditions = search_resources("Condition", filters) if filters else FHIR_DATA.get("Condition", [])
-    
-    # Additional filters
-    filtered = []
-    for condition in conditions:
-        match = True
-        
-        # Filter by _id
-        if _id and condition.get("id") != _id:
-            match = False
-        
-        # Filter by clinical-status
-        if clinical_status and match:
-            status = condition.get("clinicalStatus", {}).get("coding", [{}])[0].get("code", "")
-            if status != clinical_status:
-                match = False
-        
-        # Filter by category
-        if category and match:
-            categories = condition.get("category", [])
-            cat_match = any(cat.get("coding", [{}])[0].get("code", "") == category for cat in categories)
-            if not cat_match:
-                match = False
-        
-        # Filter by code
-        if code and match:
-            codes = condition.get("code", {}).get("coding", [])
-            code_match = any(c.get("code", "") == code for c in codes)
-            if not code_match:
-                match = False
-        
-        if match:
-            filtered.append(condition)
+    filtered = await run_search("Condition", {
+        "_id": _id, "patient": patient, "identifier": identifier, "clinical-status": clinical_status,
+        "category": category, "code": code
+    })
     
     if _count:
         filtered = filtered[:_count]
     
-    return create_bundle_response(filtered, "Condition", total=len(filtered))
+    return await bundle_response(filtered, "Condition", total=len(filtered))
 
 # Procedure endpoints
 @app.get("/Procedure/{procedure_id}")
-def get_procedure(procedure_id: str):
+async def get_procedure(procedure_id: str):
     """Get a specific procedure by ID"""
     procedure = get_resource_by_id("Procedure", procedure_id)
     if not procedure:
         raise HTTPException(status_code=404, detail=f"Procedure {procedure_id} not found")
-    return procedure
+    return await resource_response(procedure)
 
 @app.get("/Procedure")
-def search_procedures(
+async def search_procedures(
     _id: Optional[str] = Query(None, description="Procedure ID"),
     patient: Optional[str] = Query(None, description="Patient ID"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
     date: Optional[str] = Query(None, description="Date filter"),
     status: Optional[str] = Query(None, description="Procedure status"),
     _count: Optional[int] = Query(None)
 ):
     """Search for procedures - Epic compatible"""
-    filters = {}
-    if patient:
-        filters["patient"] = patient
-    
-    procedures = search_resources("Procedure", filters) if filters else FHIR_DATA.get("Procedure", [])
+    counted = await count_from_index("Procedure")
+    if counted:
+        return counted
     
-    # Additional filters
-    filtered = []
-    for proc in procedures:
-        match = True
-        
-        # Filter by _id
-        if _id and proc.get("id") != _id:
-            match = False
-        
-        # Filter by status
-        if status and match:
-            if proc.get("status") != status:
-                match = False
-        
-        # Filter by date
-        if date and match:
-            performed_date = proc.get("performedDateTime", "")
-            if date not in performed_date:
-                match = False
-        
-        if match:
-            filtered.append(proc)
+    filtered = await run_search("Procedure", {
+        "_id": _id, "patient": patient, "identifier": identifier, "status": status, "date": date
+    })
     
     if _count:
         filtered = filtered[:_count]
     
-    return create_bundle_response(filtered, "Procedure", total=len(filtered))
+    return await bundle_response(filtered, "Procedure", total=len(filtered))
 
 # Observation endpoints
+@app.get("/Observation/$lastn")
+async def observation_lastn(
+    patient: str = Query(..., description="Patient ID"),
+    category: str = Query(..., description="Observation category, e.g. 'vital-signs'"),
+    code: Optional[str] = Query(None, description="Observation codes (comma-separated); all of the patient's codes when absent"),
+    max_count: int = Query(1, alias="max", ge=1, description="Most recent observations returned per code")
+):
+    """
+    Observation $lastn - the most recent observations per code for a patient
+    
+    Read from the per-(patient, category, code) series, kept most recent first
+    at load, so only the first `max` entries of each matching series are read
+    however long the history is.
+    """
+    started = time.perf_counter()
+    codes = split_values(code) if code else None
+    positions = INDEX.last_n("Observation", patient, split_values(category), codes, max_count)
+    record_plan("index Observation.series")
+    record_timing("index", started)
+    
+    observations = INDEX.resources("Observation", positions)
+    return await bundle_response(observations, "Observation")
+
 @app.get("/Observation/{observation_id}")
-def get_observation(observation_id: str):
+async def get_observation(observation_id: str):
     """Get a specific observation by ID"""
     observation = get_resource_by_id("Observation", observation_id)
     if not observation:
         raise HTTPException(status_code=404, detail=f"Observation {observation_id} not found")
-    return observation
+    return await resource_response(observation)
 
 @app.get("/Observation")
-def search_observations(
+async def search_observations(
     _id: Optional[str] = Query(None, description="Observation ID"),
     patient: Optional[str] = Query(None, description="Patient ID"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
     encounter: Optional[str] = Query(None, description="Encounter ID"),
     category: Optional[str] = Query(None, description="Category (e.g., vital-signs, laboratory)"),
     code: Optional[str] = Query(None, description="Observation code"),
     date: Optional[str] = Query(None, description="Date filter"),
+    value_quantity: Optional[str] = Query(None, alias="value-quantity", description="Value quantity, e.g. 'gt5.4|http://unitsofmeasure.org|mg'"),
     _count: Optional[int] = Query(None)
 ):
     """Search for observations - Epic compatible (requires category or code)"""
-    filters = {}
-    if patient:
-        filters["patient"] = patient
-    
-    observations = search_resources("Observation", filters) if filters else FHIR_DATA.get("Observation", [])
-    
-    # Epic requires category or code parameter
-    if not category and not code and not patient:
+    # Epic requires category or code parameter (or a patient, possibly chained)
+    if not category and not code and not patient and not any(
+        name.startswith("patient") for name in request_chains("Observation")
+    ):
         raise HTTPException(
             status_code=400, 
             detail="At least one of category, code, or patient parameter is required"
         )
     
-    # Additional filters
-    filtered = []
-    for obs in observations:
-        match = True
-        
-        # Filter by _id
-        if _id and obs.get("id") != _id:
-            match = False
-        
-        # Filter by encounter
-        if encounter and match:
-            encounter_id = encounter.replace("Encounter/", "")
-            if obs.get("encounter", {}).get("reference", "").replace("Encounter/", "") != encounter_id:
-                match = False
-        
-        # Filter by category
-        if category and match:
-            categories = obs.get("category", [])
-            cat_match = any(cat.get("coding", [{}])[0].get("code", "") == category for cat in categories)
-            if not cat_match:
-                match = False
-        
-        # Filter by code
-        if code and match:
-            codes = obs.get("code", {}).get("coding", [])
-            code_match = any(c.get("code", "") == code for c in codes)
-            if not code_match:
-                match = False
-        
-        # Filter by date
-        if date and match:
-            effective_date = obs.get("effectiveDateTime", "")
-            if date not in effective_date:
-                match = False
-        
-        if match:
-            filtered.append(obs)
+    counted = await count_from_index("Observation")
+    if counted:
+        return counted
+    
+    filtered = await run_search("Observation", {
+        "_id": _id, "patient": patient, "identifier": identifier, "encounter": encounter, "category": category,
+        "code": code, "date": date, "value-quantity": value_quantity
+    })
     
     if _count:
         filtered = filtered[:_count]
     
-    return create_bundle_response(filtered, "Observation", total=len(filtered))
+    return await bundle_response(filtered, "Observation", total=len(filtered))
 
 # Practitioner endpoints
 @app.get("/Practitioner/{practitioner_id}")
-def get_practitioner(practitioner_id: str):
+async def get_practitioner(practitioner_id: str):
     """Get a specific practitioner by ID"""
     practitioner = get_resource_by_id("Practitioner", practitioner_id)
     if not practitioner:
         raise HTTPException(status_code=404, detail=f"Practitioner {practitioner_id} not found")
-    return practitioner
+    return await resource_response(practitioner)
 
 @app.get("/Practitioner")
-def search_practitioners(_count: Optional[int] = Query(None)):
+async def search_practitioners(
+    _id: Optional[str] = Query(None, description="Practitioner ID"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
+    name: Optional[str] = Query(None, description="Practitioner name"),
+    family: Optional[str] = Query(None, description="Family name"),
+    given: Optional[str] = Query(None, description="Given name"),
+    address_city: Optional[str] = Query(None, alias="address-city", description="City"),
+    address_state: Optional[str] = Query(None, alias="address-state", description="State"),
+    _count: Optional[int] = Query(None)
+):
     """Search for practitioners"""
-    practitioners = FHIR_DATA.get("Practitioner", [])
+    counted = await count_from_index("Practitioner")
+    if counted:
+        return counted
+    
+    practitioners = await run_search("Practitioner", {
+        "_id": _id, "identifier": identifier, "name": name, "family": family, "given": given,
+        "address-city": address_city, "address-state": address_state
+    })
     if _count:
         practitioners = practitioners[:_count]
-    return create_bundle_response(practitioners, "Practitioner")
+    return await bundle_response(practitioners, "Practitioner")
 
 # PractitionerRole endpoints
 @app.get("/PractitionerRole/{role_id}")
-def get_practitioner_role(role_id: str):
+async def get_practitioner_role(role_id: str):
     """Get a specific practitioner role by ID"""
     role = get_resource_by_id("PractitionerRole", role_id)
     if not role:
         raise HTTPException(status_code=404, detail=f"PractitionerRole {role_id} not found")
-    return role
+    return await resource_response(role)
 
 @app.get("/PractitionerRole")
-def search_practitioner_roles(
+async def search_practitioner_roles(
+    _id: Optional[str] = Query(None, description="PractitionerRole ID"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
     practitioner: Optional[str] = Query(None, description="Practitioner ID"),
+    organization: Optional[str] = Query(None, description="Organization ID"),
+    location: Optional[str] = Query(None, description="Location ID"),
+    specialty: Optional[str] = Query(None, description="Specialty code"),
     _count: Optional[int] = Query(None)
 ):
     """Search for practitioner roles"""
-    roles = FHIR_DATA.get("PractitionerRole", [])
+    counted = await count_from_index("PractitionerRole")
+    if counted:
+        return counted
     
-    if practitioner:
-        practitioner_id = practitioner.replace("Practitioner/", "")
-        roles = [
-            role for role in roles 
-            if role.get("practitioner", {}).get("reference", "").replace("Practitioner/", "") == practitioner_id
-        ]
+    roles = await run_search("PractitionerRole", {
+        "_id": _id, "identifier": identifier, "practitioner": practitioner, "organization": organization,
+        "location": location, "specialty": specialty
+    })
     
     if _count:
         roles = roles[:_count]
     
-    return create_bundle_response(roles, "PractitionerRole")
+    return await bundle_response(roles, "PractitionerRole")
+
+# Schedule and Slot endpoints
+@app.get("/Schedule/{schedule_id}")
+async def get_schedule(schedule_id: str):
+    """Get a specific schedule by ID"""
+    schedule = get_resource_by_id("Schedule", schedule_id)
+    if not schedule:
+        raise HTTPException(status_code=404, detail=f"Schedule {schedule_id} not found")
+    return await resource_response(schedule)
+
+@app.get("/Schedule")
+async def search_schedules(
+    _id: Optional[str] = Query(None, description="Schedule ID"),
+    actor: Optional[str] = Query(None, description="Actor reference (Practitioner/id or Location/id)"),
+    _count: Optional[int] = Query(None)
+):
+    """Search for practitioner and location schedules"""
+    counted = await count_from_index("Schedule")
+    if counted:
+        return counted
+    
+    schedules = await run_search("Schedule", {"_id": _id, "actor": actor})
+    
+    if _count:
+        schedules = schedules[:_count]
+    
+    return await bundle_response(schedules, "Schedule")
+
+@app.get("/Slot")
+async def search_slots(
+    schedule: str = Query(..., description="Schedule ID"),
+    start: Optional[str] = Query(None, description="Window start (date or dateTime, default today)"),
+    end: Optional[str] = Query(None, description="Window end (default a week after start)"),
+    status: Optional[str] = Query(None, description="free or busy"),
+    duration: int = Query(30, ge=5, le=1440, description="Length of free slots in minutes"),
+    _count: Optional[int] = Query(None)
+):
+    """Free slots cut from a schedule's working hours, and busy slots of its bookings"""
+    actor = SCHEDULES.actor(schedule)
+    if actor is None:
+        raise HTTPException(status_code=404, detail=f"Schedule {schedule} not found")
+    if status not in (None, "free", "busy"):
+        raise HTTPException(status_code=400, detail="Slot status must be free or busy")
+    window_start, window_end = request_window(start, end)
+    
+    started = time.perf_counter()
+    slots = SCHEDULES.slots(actor, window_start, window_end, duration, status)
+    record_plan("index Schedule.booked")
+    record_timing("index", started)
+    
+    if _count:
+        slots = slots[:_count]
+    
+    # Without a start the window is today's, so the URL alone does not identify the response
+    return await bundle_response(slots, "Slot", total=len(slots), cache=start is not None)
 
 # DocumentReference endpoints
 @app.get("/DocumentReference/{doc_id}")
-def get_document_reference(doc_id: str):
+async def get_document_reference(doc_id: str):
     """Get a specific document reference by ID"""
     doc = get_resource_by_id("DocumentReference", doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail=f"DocumentReference {doc_id} not found")
-    return doc
+    return await resource_response(doc)
 
 @app.get("/DocumentReference")
-def search_document_references(
+async def search_document_references(
     _id: Optional[str] = Query(None, description="DocumentReference ID"),
     patient: Optional[str] = Query(None, description="Patient ID"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
     status: Optional[str] = Query(None, description="Status"),
     date: Optional[str] = Query(None, description="Date filter"),
     type: Optional[str] = Query(None, description="Document type"),
     _count: Optional[int] = Query(None)
 ):
     """Search for document references - Epic compatible"""
-    filters = {}
-    if patient:
-        filters["patient"] = patient
+    counted = await count_from_index("DocumentReference")
+    if counted:
+        return counted
     
-    docs = search_resources("DocumentReference", filters) if filters else FHIR_DATA.get("DocumentReference", [])
-    
-    # Additional filters
-    filtered = []
-    for doc in docs:
-        match = True
-        
-        # Filter by _id
-        if _id and doc.get("id") != _id:
-            match = False
-        
-        # Filter by status
-        if status and match:
-            if doc.get("status") != status:
-                match = False
-        
-        # Filter by date
-        if date and match:
-            doc_date = doc.get("date", "")
-            if date not in doc_date:
-                match = False
-        
-        # Filter by type
-        if type and match:
-            doc_types = doc.get("type", {}).get("coding", [])
-            type_match = any(t.get("code", "") == type for t in doc_types)
-            if not type_match:
-                match = False
-        
-        if match:
-            filtered.append(doc)
+    filtered = await run_search("DocumentReference", {
+        "_id": _id, "patient": patient, "identifier": identifier, "status": status, "date": date, "type": type
+    })
     
     if _count:
         filtered = filtered[:_count]
     
-    return create_bundle_response(filtered, "DocumentReference", total=len(filtered))
+    return await bundle_response(filtered, "DocumentReference", total=len(filtered))
 
 # Consent endpoints
 @app.get("/Consent/{consent_id}")
-def get_consent(consent_id: str):
+async def get_consent(consent_id: str):
     """Get a specific consent by ID"""
     consent = get_resource_by_id("Consent", consent_id)
     if not consent:
         raise HTTPException(status_code=404, detail=f"Consent {consent_id} not found")
-    return consent
+    return await resource_response(consent)
 
 @app.get("/Consent")
-def search_consents(
+async def search_consents(
     _id: Optional[str] = Query(None, description="Consent ID"),
     patient: Optional[str] = Query(None, description="Patient ID"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
     status: Optional[str] = Query(None, description="Status"),
     category: Optional[str] = Query(None, description="Category"),
     _count: Optional[int] = Query(None)
 ):
     """Search for consents - Epic compatible"""
-    filters = {}
-    if patient:
-        filters["patient"] = patient
+    counted = await count_from_index("Consent")
+    if counted:
+        return counted
     
-    consents = search_resources("Consent", filters) if filters else FHIR_DATA.get("Consent", [])
-    
-    # Additional filters
-    filtered = []
-    for consent in consents:
-        match = True
-        
-        # Filter by _id
-        if _id and consent.get("id") != _id:
-            match = False
-        
-        # Filter by status
-        if status and match:
-            if consent.get("status") != status:
-                match = False
-        
-        # Filter by category
-        if category and match:
-            categories = consent.get("category", [])
-            cat_match = any(cat.get("coding", [{}])[0].get("code", "") == category for cat in categories)
-            if not cat_match:
-                match = False
-        
-        if match:
-            filtered.append(consent)
+    filtered = await run_search("Consent", {
+        "_id": _id, "patient": patient, "identifier": identifier, "status": status, "category": category
+    })
     
     if _count:
         filtered = filtered[:_count]
     
-    return create_bundle_response(filtered, "Consent", total=len(filtered))
+    return await bundle_response(filtered, "Consent", total=len(filtered))
 
 # Binary endpoints
+FHIR_JSON_TYPES = ("application/fhir+json", "application/json", "application/json+fhir")
+
+def accepts_raw_content(accept: Optional[str], content_type: str) -> bool:
+    """True when Accept names the Binary's contentType (or its type/*) at least as highly as FHIR JSON"""
+    if not accept or not content_type:
+        return False
+    content_type = content_type.split(";")[0].strip().lower()
+    raw_q = json_q = 0.0
+    for part in accept.split(","):
+        media, _, params = part.strip().partition(";")
+        media = media.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media in FHIR_JSON_TYPES:
+            json_q = max(json_q, q)
+        elif media == content_type or (media.endswith("/*") and media != "*/*" and content_type.startswith(media[:-1])):
+            raw_q = max(raw_q, q)
+    return raw_q > 0 and raw_q >= json_q
+
+def decode_binary(data: str) -> bytes:
+    try:
+        return base64.b64decode(data, validate=False)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=500, detail="Binary data is not valid base64")
+
+async def binary_content(binary: Dict) -> tuple:
+    """Decoded bytes and ETag of a Binary, from the decoded-content cache when possible"""
+    binary_id = binary.get("id", "")
+    cached = BINARY_CACHE.get(binary_id, "identity")
+    if cached is not None:
+        return cached[0], BINARY_ETAGS[binary_id]
+    
+    data = binary.get("data", "") or ""
+    if len(data) < BINARY_DECODE_OFFLOAD_BYTES:
+        content = decode_binary(data)
+    else:
+        content = await offload(decode_binary, data)
+    
+    etag = f'"{binary_id}-{len(content)}-{zlib.crc32(content):08x}"'
+    BINARY_ETAGS[binary_id] = etag
+    BINARY_CACHE.put(binary_id, "identity", content, len(content))
+    return content, etag
+
+def parse_range(range_header: str, length: int) -> Optional[tuple]:
+    """
+    Parse a single 'bytes=' range into (start, end) inclusive.
+    Returns None to serve the whole body (absent, malformed or multi-range);
+    raises 416 when the range cannot be satisfied.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if not start_text:
+            # Suffix range: last N bytes
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise ValueError
+            start, end = max(0, length - suffix), length - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else length - 1
+    except ValueError:
+        return None
+    if start >= length or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{length}"}
+        )
+    return start, min(end, length - 1)
+
 @app.get("/Binary/{binary_id}")
-def get_binary(binary_id: str):
-    """Get a specific binary resource by ID"""
+async def get_binary(binary_id: str):
+    """
+    Get a specific binary resource by ID
+    
+    Returns the FHIR JSON resource by default. When Accept names the Binary's
+    contentType, the decoded bytes are served instead, with ETag and Range support.
+    """
     binary = get_resource_by_id("Binary", binary_id)
     if not binary:
         raise HTTPException(status_code=404, detail=f"Binary {binary_id} not found")
-    return binary
+    
+    content_type = binary.get("contentType", "")
+    if not accepts_raw_content(request_header(b"accept"), content_type):
+        return await resource_response(binary)
+    
+    content, etag = await binary_content(binary)
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Vary": "Accept"}
+    # Set Content-Type directly so text/* types don't get a charset appended
+    content_headers = {**headers, "Content-Type": content_type}
+    
+    if_none_match = request_header(b"if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    range_header = request_header(b"range")
+    if_range = request_header(b"if-range")
+    byte_range = parse_range(range_header, len(content)) if range_header and (not if_range or if_range == etag) else None
+    if byte_range is None:
+        return Response(content=content, headers=content_headers)
+    
+    start, end = byte_range
+    content_headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+    return Response(content=content[start:end + 1], status_code=206, headers=content_headers)
 
 # Provenance endpoints
 @app.get("/Provenance/{provenance_id}")
-def get_provenance(provenance_id: str):
+async def get_provenance(provenance_id: str):
     """Get a specific provenance by ID"""
     provenance = get_resource_by_id("Provenance", provenance_id)
     if not provenance:
         raise HTTPException(status_code=404, detail=f"Provenance {provenance_id} not found")
-    return provenance
+    return await resource_response(provenance)
 
 @app.get("/Provenance")
-def search_provenance(
-    target: Optional[str] = Query(None, description="Target resource reference"),
+async def search_provenance(
+    _id: Optional[str] = Query(None, description="Provenance ID"),
+    target: Optional[str] = Query(None, description="Target reference (Type/id, or a bare id of any type)"),
+    target_contains: Optional[str] = Query(None, alias="target:contains", description="Part of a target reference"),
+    target_type: Optional[str] = Query(None, alias="target-type", description="Target resource type"),
+    agent: Optional[str] = Query(None, description="Agent (who) reference"),
+    recorded: Optional[str] = Query(None, description="Recorded date (supports ge, le, gt, lt, eq prefixes)"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
     _count: Optional[int] = Query(None)
 ):
     """Search for provenance"""
-    provenances = FHIR_DATA.get("Provenance", [])
+    counted = await count_from_index("Provenance")
+    if counted:
+        return counted
     
-    if target:
-        provenances = [
-            prov for prov in provenances 
-            if any(target in t.get("reference", "") for t in prov.get("target", []))
-        ]
+    provenances = await run_search("Provenance", {
+        "_id": _id, "target": target, "target:contains": target_contains, "target-type": target_type,
+        "agent": agent, "recorded": recorded, "identifier": identifier,
+    })
     
     if _count:
         provenances = provenances[:_count]
     
-    return create_bundle_response(provenances, "Provenance", total=len(provenances))
+    return await bundle_response(provenances, "Provenance", total=len(provenances))
 
 # ExplanationOfBenefit endpoint
 @app.get("/ExplanationOfBenefit")
-def search_eob(
+async def search_eob(
     patient: Optional[str] = Query(None, description="Patient ID"),
     _count: Optional[int] = Query(None)
 ):
     """Search for ExplanationOfBenefit (returns OperationOutcome)"""
     # Return the EOB bundle (which contains OperationOutcome)
-    return FHIR_DATA.get("ExplanationOfBenefit", {})
+    return await json_response(FHIR_DATA.get("ExplanationOfBenefit", {}), cache=True)
 
 # Appointment endpoints
+def scheduled_actor(actor: str, actor_type: str) -> str:
+    """Scheduled actor reference of a $find / Slot parameter (404 when it has no schedule)"""
+    reference = SCHEDULES.resolve(actor, actor_type)
+    if reference is None:
+        raise HTTPException(status_code=404, detail=f"No schedule for {actor_type} {actor}")
+    return reference
+
+def request_window(start: Optional[str], end: Optional[str]) -> Tuple[int, int]:
+    """Search window of a $find / Slot request (400 when invalid)"""
+    try:
+        return parse_window(start, end, SCHEDULE_MAX_DAYS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/Appointment/$find")
+async def appointment_find(
+    practitioner: Optional[str] = Query(None, description="Practitioner ID"),
+    location: Optional[str] = Query(None, description="Location ID"),
+    start: Optional[str] = Query(None, description="Window start (date or dateTime, default today)"),
+    end: Optional[str] = Query(None, description="Window end (default a week after start)"),
+    duration: int = Query(30, ge=5, le=1440, description="Slot length in minutes"),
+    _count: Optional[int] = Query(None)
+):
+    """
+    Appointment $find - free slots when the practitioner and/or location are
+    both working and unbooked, as a Bundle of Slot resources
+    
+    Bookings come from the per-actor interval trees, so only the appointments
+    overlapping the window are read.
+    """
+    if not practitioner and not location:
+        raise HTTPException(status_code=400, detail="$find needs a practitioner or a location")
+    actors = [scheduled_actor(practitioner, "Practitioner")] if practitioner else []
+    if location:
+        actors.append(scheduled_actor(location, "Location"))
+    window_start, window_end = request_window(start, end)
+    
+    started = time.perf_counter()
+    free = SCHEDULES.free(actors, window_start, window_end, duration)
+    record_plan("index Schedule.booked")
+    record_timing("index", started)
+    
+    if _count:
+        free = free[:_count]
+    
+    slots = [SCHEDULES.slot(actors[0], slot_start, slot_end, "free") for slot_start, slot_end in free]
+    # Without a start the window is today's, so the URL alone does not identify the response
+    return await bundle_response(slots, "Slot", total=len(slots), cache=start is not None)
+
 @app.get("/Appointment/{appointment_id}")
-def get_appointment(appointment_id: str):
+async def get_appointment(appointment_id: str):
     """Get a specific appointment by ID"""
     appointment = get_resource_by_id("Appointment", appointment_id)
     if not appointment:
         raise HTTPException(status_code=404, detail=f"Appointment {appointment_id} not found")
-    return appointment
+    return await resource_response(appointment)
 
 @app.get("/Appointment")
-def search_appointments(
+async def search_appointments(
     _id: Optional[str] = Query(None, description="Appointment ID"),
     patient: Optional[str] = Query(None, description="Patient ID"),
+    identifier: Optional[str] = Query(None, description="Identifier (value, system|value or system|)"),
     status: Optional[str] = Query(None, description="Appointment status"),
     date: Optional[str] = Query(None, description="Date filter - Epic standard: 'ge2025-01-01', 'le2025-12-31', 'eq2025-11-05', 'gt2025-01-01', 'lt2025-12-31', or partial '2025-11'"),
-    actor: Optional[str] = Query(None, description="Actor (Patient/Practitioner/Location)"),
+    actor: Optional[str] = Query(None, description="Actor reference (Patient/Practitioner/Location, or a bare id)"),
+    actor_contains: Optional[str] = Query(None, alias="actor:contains", description="Part of an actor reference"),
+    practitioner: Optional[str] = Query(None, description="Practitioner participant ID"),
+    location: Optional[str] = Query(None, description="Location participant ID"),
+    service_category: Optional[str] = Query(None, alias="service-category", description="Service category code, e.g. 'surgery'"),
     _count: Optional[int] = Query(None)
 ):
     """
     Search for appointments - Epic compatible
     
     Epic Scope: Appointment.Read (Appointments) (R4), Appointment.Search (Appointments) (R4)
-    Epic Parameters: _id, patient, status, date, actor, _count
+    Epic Parameters: _id, patient, identifier, status, date, actor, practitioner, location, service-category, _count
     Date Format: Epic standard FHIR (eqYYYY-MM-DD, geYYYY-MM-DD, leYYYY-MM-DD, gtYYYY-MM-DD, ltYYYY-MM-DD)
     """
-    filters = {}
-    if patient:
-        filters["patient"] = patient
+    counted = await count_from_index("Appointment")
+    if counted:
+        return counted
     
-    appointments = search_resources("Appointment", filters) if filters else FHIR_DATA.get("Appointment", [])
-    
-    # Additional filters
-    filtered = []
-    for apt in appointments:
-        match = True
-        
-        # Filter by _id
-        if _id and apt.get("id") != _id:
-            match = False
-        
-        # Filter by status
-        if status and match:
-            if apt.get("status") != status:
-                match = False
-        
-        # Filter by date (Epic supports date prefixes: ge, le, gt, lt, eq, and "today")
-        if date and match:
-            start_date_str = apt.get("start", "")
-            if not start_date_str:
-                match = False
-            else:
-                # Parse appointment start date
-                try:
-                    # Handle ISO format: 2025-11-05T14:00:00Z
-                    if "T" in start_date_str:
-                        apt_date = datetime.fromisoformat(start_date_str.replace("Z", "+00:00")).date()
-                    else:
-                        apt_date = datetime.fromisoformat(start_date_str).date()
-                    
-                    # Handle date parameter (Epic standard FHIR format: ge2025-01-01, le2025-12-31, eq2025-11-05)
-                    # Note: Epic does NOT support "today" - only standard FHIR prefixes
-                    date_param = date.lower().strip()
-                    
-                    # Epic standard: date=eqYYYY-MM-DD, date=geYYYY-MM-DD, date=leYYYY-MM-DD, etc.
-                    if date_param.startswith(("ge", "le", "gt", "lt", "eq")):
-                        # Handle FHIR date prefixes
-                        prefix = date_param[:2]
-                        date_str = date_param[2:]
-                        
-                        try:
-                            filter_date = datetime.fromisoformat(date_str).date()
-                            
-                            if prefix == "ge":  # greater than or equal
-                                if apt_date < filter_date:
-                                    match = False
-                            elif prefix == "le":  # less than or equal
-                                if apt_date > filter_date:
-                                    match = False
-                            elif prefix == "gt":  # greater than
-                                if apt_date <= filter_date:
-                                    match = False
-                            elif prefix == "lt":  # less than
-                                if apt_date >= filter_date:
-                                    match = False
-                            elif prefix == "eq":  # equals
-                                if apt_date != filter_date:
-                                    match = False
-                        except:
-                            # Fallback to simple string matching
-                            if date_str not in start_date_str:
-                                match = False
-                    else:
-                        # Simple string matching (for partial dates like "2025-11")
-                        if date not in start_date_str:
-                            match = False
-                except:
-                    # Fallback to simple string matching
-                    if date not in start_date_str:
-                        match = False
-        
-        # Filter by actor
-        if actor and match:
-            participants = apt.get("participant", [])
-            actor_match = any(actor in p.get("actor", {}).get("reference", "") for p in participants)
-            if not actor_match:
-                match = False
-        
-        if match:
-            filtered.append(apt)
+    filtered = await run_search("Appointment", {
+        "_id": _id, "patient": patient, "identifier": identifier, "status": status, "date": date, "actor": actor,
+        "actor:contains": actor_contains, "practitioner": practitioner, "location": location,
+        "service-category": service_category,
+    })
     
     if _count:
         filtered = filtered[:_count]
     
-    return create_bundle_response(filtered, "Appointment", total=len(filtered))
+    return await bundle_response(filtered, "Appointment", total=len(filtered))
 
 # Health check endpoint
 @app.get("/health")
-def health_check():
+async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
         "resources_loaded": len(FHIR_DATA),
-        "resource_types": list(FHIR_DATA.keys())
+        "resource_types": list(FHIR_DATA.keys()),
+        "compression": {
+            **COMPRESSION_STATS.to_dict(),
+            "cached_responses": len(COMPRESSION_CACHE),
+            "cache_bytes": COMPRESSION_CACHE.size
+        }
+    }
+
+# Admin: sampling profiler
+@app.get("/admin/profile")
+async def admin_profile(
+    seconds: float = Query(10, gt=0, description="How long to sample"),
+    route: Optional[str] = Query(None, description="Only keep samples of this route template, e.g. /Observation"),
+    format: str = Query("collapsed", description="collapsed or speedscope"),
+    interval_ms: float = Query(5, ge=1, le=1000, description="Sampling interval in milliseconds")
+):
+    """
+    Sample the running server's Python stacks for a number of seconds and
+    return them as collapsed stacks (flamegraph.pl) or a speedscope profile
+    """
+    if not ADMIN_ENDPOINTS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if seconds > PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be at most {PROFILE_MAX_SECONDS}")
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be 'collapsed' or 'speedscope'")
+    
+    endpoints = {
+        app_route.endpoint.__code__: app_route.path
+        for app_route in app.routes
+        if hasattr(app_route, "endpoint") and hasattr(app_route.endpoint, "__code__")
     }
+    if route is not None and route not in endpoints.values():
+        raise HTTPException(status_code=400, detail=f"Unknown route '{route}'")
+    
+    try:
+        PROFILER.start(interval_ms / 1000, endpoints, route)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile = PROFILER.stop()
+    
+    headers = {"X-Profile-Samples": str(profile.samples), "X-Profile-Seconds": f"{profile.duration:.3f}"}
+    if format == "speedscope":
+        headers["Content-Disposition"] = 'attachment; filename="fhir_api.speedscope.json"'
+        return Response(content=serialize(profile.speedscope()), media_type="application/json", headers=headers)
+    return Response(content=profile.collapsed(), media_type="text/plain", headers=headers)
+
+# Metrics endpoint
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text-format metrics: requests, latency, result sizes, caches, indexes and dataset"""
+    lines = METRICS.render()
+    
+    datasets = [(t, resources) for t, resources in FHIR_DATA.items() if isinstance(resources, list)]
+    lines += format_metric(
+        "fhir_resources", "gauge", "Loaded resources per type",
+        [({"resource_type": t}, len(resources)) for t, resources in datasets]
+    )
+    lines += format_metric("fhir_data_load_seconds", "gauge", "Time spent loading data files", [({}, DATA_LOAD_SECONDS)])
+    lines += format_metric(
+        "fhir_index_build_seconds", "gauge", "Time spent building indexes per resource type",
+        [({"resource_type": t}, seconds) for t, seconds in INDEX.build_seconds.items()]
+    )
+    lines += format_metric(
+        "fhir_columnar_bytes", "gauge", "Memory held by columnar search extracts per resource type",
+        [({"resource_type": t}, COLUMNS.nbytes(t)) for t in COLUMNS.build_seconds]
+    )
+    lines += format_metric(
+        "fhir_parallel_scans_total", "counter", "Columnar scans partitioned across worker processes",
+        [({}, SCANNER.scans)]
+    )
+    lines += format_metric(
+        "fhir_index_keys", "gauge", "Distinct keys per index",
+        [({"resource_type": t, "index": "id"}, len(ids)) for t, ids in INDEX.by_id.items()]
+        + [({"resource_type": t, "index": "patient"}, len(patients)) for t, patients in INDEX.by_patient.items()]
+        + [({"resource_type": t, "index": f"reference:{param}"}, len(refs)) for (t, param), refs in INDEX.referenced_by.items()]
+    )
+    
+    queries = compile_query.cache_info()
+    caches = [
+        ("compression", COMPRESSION_STATS.cache_hits, COMPRESSION_STATS.cache_misses, len(COMPRESSION_CACHE), COMPRESSION_CACHE.size),
+        ("binary", BINARY_CACHE.hits, BINARY_CACHE.misses, len(BINARY_CACHE), BINARY_CACHE.size),
+        ("projection", PROJECTION_CACHE.hits, PROJECTION_CACHE.misses, len(PROJECTION_CACHE), None),
+        ("compiled_queries", queries.hits, queries.misses, queries.currsize, None),
+    ]
+    lines += format_metric("fhir_cache_hits_total", "counter", "Cache hits", [({"cache": c[0]}, c[1]) for c in caches])
+    lines += format_metric("fhir_cache_misses_total", "counter", "Cache misses", [({"cache": c[0]}, c[2]) for c in caches])
+    lines += format_metric(
+        "fhir_cache_hit_ratio", "gauge", "Cache hits / lookups",
+        [({"cache": c[0]}, c[1] / (c[1] + c[2]) if c[1] + c[2] else 0.0) for c in caches]
+    )
+    lines += format_metric(
+        "fhir_cache_entries", "gauge", "Entries held per cache",
+        [({"cache": c[0]}, c[3]) for c in caches] + [({"cache": "entry_fragments"}, len(ENTRY_FRAGMENTS))]
+    )
+    lines += format_metric(
+        "fhir_cache_bytes", "gauge", "Bytes held per cache",
+        [({"cache": c[0]}, c[4]) for c in caches if c[4] is not None]
+    )
+    
+    compression = COMPRESSION_STATS.to_dict()
+    lines += format_metric(
+        "fhir_slow_queries_total", "counter", "Requests written to the slow-query log",
+        [({}, SLOW_QUERY_LOG.logged if SLOW_QUERY_LOG is not None else 0)]
+    )
+    lines += format_metric("fhir_compressed_responses_total", "counter", "Responses sent compressed", [({}, compression["responses"])])
+    lines += format_metric("fhir_compression_bytes_in_total", "counter", "Uncompressed bytes of compressed responses", [({}, compression["bytes_in"])])
+    lines += format_metric("fhir_compression_bytes_out_total", "counter", "Bytes sent for compressed responses", [({}, compression["bytes_out"])])
+    lines += format_metric("fhir_compression_bytes_saved_total", "counter", "Bytes saved by compression", [({}, compression["bytes_saved"])])
+    
+    return Response(content="\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
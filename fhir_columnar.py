@@ -0,0 +1,254 @@
+"""
+Columnar extracts of search parameters, evaluated as vectorized NumPy masks
+
+For resource types with many rows, every token, reference, date and string
+parameter is extracted once at load into flat arrays holding one
+(row, value) pair per value: dictionary-encoded codes for tokens and exact
+references, int64 epoch days plus the stored text for dates, and the
+(lowercased) UTF-8 text for string and partial-reference matches. A predicate an
+index could not answer then becomes one mask over all rows instead of a
+Python call per resource. NumPy is in requirements.txt; if it is missing
+anyway, a warning is logged when the store is built and every predicate
+runs row by row.
+"""
+import logging
+import time
+from datetime import date
+from typing import Optional, List, Dict, Any, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # predicates then run per resource
+    np = None
+
+from fhir_index import normalize_reference
+from fhir_search import (
+    DATE_COMPARATORS, SearchParameter, date_search, parse_date, reference_needle, split_values,
+)
+
+logger = logging.getLogger(__name__)
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def epoch_day(value: date) -> int:
+    """Days since 1970-01-01"""
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def _encode(values: List[str]):
+    """UTF-8 byte-string array (a quarter of the memory of a unicode array for ASCII text)"""
+    return np.asarray([value.encode("utf-8") for value in values], dtype=bytes)
+
+
+def _contains(texts, needle: bytes):
+    """Vectorized `needle in text`; substring tests on UTF-8 bytes agree with str"""
+    if not texts.size:
+        return np.zeros(0, dtype=bool)
+    return np.char.find(texts, needle) >= 0
+
+
+def evaluate(arrays: Dict[str, Any], operand: tuple):
+    """Boolean array over a column's extracted values matching an operand (see Column.operand)"""
+    kind = operand[0]
+    if kind == "code":
+        return arrays["codes"] == operand[1]
+    if kind == "codes":
+        return np.isin(arrays["codes"], np.asarray(operand[1], dtype=np.int32))
+    if kind == "any":
+        matched = np.zeros(len(arrays["rows"]), dtype=bool)
+        for inner in operand[1]:
+            matched |= evaluate(arrays, inner)
+        return matched
+    if kind == "date":
+        # Same rules as fhir_search.date_matches, one array operation each
+        _, prefix, bound, text, value = operand
+        if bound is None:
+            matched = _contains(arrays["texts"], text)
+        else:
+            matched = DATE_COMPARATORS[prefix](arrays["days"], bound)
+        return np.where(arrays["parsed"], matched, _contains(arrays["texts"], value))
+    return _contains(arrays["texts"], operand[1])
+
+
+def row_mask(columns: Dict[str, Dict[str, Any]], operands: Dict[str, tuple], start: int, stop: int):
+    """
+    Boolean array over rows [start, stop): resources matching every operand.
+    columns maps parameter names to their arrays; rows are ascending, so a
+    row range is one contiguous slice of each column.
+    """
+    mask = None
+    for name, operand in operands.items():
+        arrays = columns[name]
+        low, high = np.searchsorted(arrays["rows"], (start, stop))
+        values = {key: array[low:high] for key, array in arrays.items()}
+        matched = np.zeros(stop - start, dtype=bool)
+        matched[values["rows"][evaluate(values, operand)] - start] = True
+        mask = matched if mask is None else mask & matched
+    return mask
+
+
+def select_positions(mask, positions: Optional[List[int]]) -> List[int]:
+    """Positions set in mask, restricted to and in the order of positions when given"""
+    if positions is None:
+        return np.flatnonzero(mask).tolist()
+    candidates = np.asarray(positions, dtype=np.int64)
+    return candidates[mask[candidates]].tolist()
+
+
+class Column:
+    """
+    One parameter of one resource type as parallel arrays: rows[i] is the
+    position of the resource holding the i-th extracted value
+    """
+
+    def __init__(self, param: SearchParameter, size: int, rows: List[int], values: List[str]):
+        self.param = param
+        self.size = size
+        # token / exact reference: value -> code
+        self.dictionary: Optional[Dict[str, int]] = None
+        # rows, plus codes (token / exact reference), texts (date / string /
+        # partial reference) and days where parsed (date), one entry per value
+        self.arrays: Dict[str, Any] = {"rows": np.asarray(rows, dtype=np.int64)}
+
+        if param.type == "token" or (param.type == "reference" and param.match == "exact"):
+            dictionary: Dict[str, int] = {}
+            self.arrays["codes"] = np.fromiter(
+                (dictionary.setdefault(value, len(dictionary)) for value in values),
+                dtype=np.int32, count=len(values),
+            )
+            self.dictionary = dictionary
+        elif param.type == "date":
+            days = []
+            for value in values:
+                try:
+                    days.append(epoch_day(parse_date(value)))
+                except ValueError:
+                    days.append(None)
+            self.arrays["parsed"] = np.fromiter((day is not None for day in days), dtype=bool, count=len(days))
+            self.arrays["days"] = np.fromiter((day or 0 for day in days), dtype=np.int64, count=len(days))
+            self.arrays["texts"] = _encode(values)
+        else:
+            self.arrays["texts"] = _encode([value.lower() if param.type == "string" else value for value in values])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def operand(self, value: str) -> tuple:
+        """A search value in the column's encoding, as evaluate() compares it"""
+        items = split_values(value)
+        if len(items) == 1:
+            return self._operand(items[0])
+        # OR values: one isin() over the codes, otherwise any of the operands
+        if self.dictionary is not None:
+            return ("codes", tuple(code for item in items for code in self._codes(item)))
+        return ("any", tuple(self._operand(item) for item in items))
+
+    def _codes(self, value: str) -> Tuple[int, ...]:
+        """Dictionary codes one value matches (an untyped bare id matches every type)"""
+        param = self.param
+        if param.type == "reference":
+            if param.target is None:
+                if "/" not in value:
+                    return tuple(code for reference, code in self.dictionary.items()
+                                 if reference.rpartition("/")[2] == value)
+                value = normalize_reference(value)
+            else:
+                value = value.replace(f"{param.target}/", "")
+        # -1 is no code, so an unknown value matches nothing
+        return (self.dictionary.get(value, -1),)
+
+    def _operand(self, value: str) -> tuple:
+        param = self.param
+        if self.dictionary is not None:
+            codes = self._codes(value)
+            return ("code", codes[0]) if len(codes) == 1 else ("codes", codes)
+        if param.type == "date":
+            prefix, bound, text = date_search(value)
+            return ("date", prefix, None if bound is None else epoch_day(bound),
+                    text.encode("utf-8"), value.encode("utf-8"))
+        if param.type == "string":
+            return ("contains", value.lower().encode("utf-8"))
+        return ("contains", reference_needle(param, value).encode("utf-8"))
+
+    @classmethod
+    def extract(cls, param: SearchParameter, resources: List[Any]) -> "Column":
+        """Build the column from the parameter's expression"""
+        # Exact references are stored as the predicate compares them: without
+        # their target prefix, or normalized to 'Type/id' when untyped
+        exact = param.type == "reference" and param.match == "exact"
+        strip = f"{param.target}/" if exact and param.target else None
+        rows, values = [], []
+        for position, resource in enumerate(resources):
+            if not isinstance(resource, dict):
+                continue
+            for value in param.extract(resource):
+                if isinstance(value, str) and value:
+                    if exact and not strip:
+                        value = normalize_reference(value) or value
+                    rows.append(position)
+                    values.append(value.replace(strip, "") if strip else value)
+        return cls(param, len(resources), rows, values)
+
+
+# Parameter types with a vectorized form (quantity comparisons stay per resource)
+COLUMNAR_TYPES = ("token", "reference", "date", "string")
+
+
+class ColumnStore:
+    """Columns for every resource type with at least min_rows resources"""
+
+    def __init__(self, data: Dict[str, Any], parameters: Dict[str, Dict[str, SearchParameter]], min_rows: int):
+        self.min_rows = min_rows
+        self.columns: Dict[tuple, Column] = {}
+        # type -> rows, and seconds spent extracting its columns
+        self.sizes: Dict[str, int] = {}
+        self.build_seconds: Dict[str, float] = {}
+        if np is None:
+            large = sorted(t for t, resources in data.items() if isinstance(resources, list) and len(resources) >= min_rows)
+            if large:
+                logger.warning("numpy is not installed; columnar filtering is disabled for %s", ", ".join(large))
+            return
+
+        for resource_type, params in parameters.items():
+            resources = data.get(resource_type)
+            if not isinstance(resources, list) or len(resources) < min_rows:
+                continue
+            started = time.perf_counter()
+            for name, param in params.items():
+                if param.type in COLUMNAR_TYPES and param.index != "only":
+                    self.columns[(resource_type, name)] = Column.extract(param, resources)
+            self.sizes[resource_type] = len(resources)
+            self.build_seconds[resource_type] = time.perf_counter() - started
+
+    def covers(self, resource_type: str) -> bool:
+        """Whether resource_type has columns"""
+        return resource_type in self.sizes
+
+    def nbytes(self, resource_type: str) -> int:
+        return sum(column.nbytes for (t, _), column in self.columns.items() if t == resource_type)
+
+    def operands(self, resource_type: str, values: Dict[str, str]) -> Dict[str, tuple]:
+        """Encoded operands for the parameters in values that have a column"""
+        return {
+            name: self.columns[(resource_type, name)].operand(value)
+            for name, value in values.items() if (resource_type, name) in self.columns
+        }
+
+    def arrays(self, resource_type: str) -> Dict[str, Dict[str, Any]]:
+        """Parameter name -> column arrays of resource_type"""
+        return {name: column.arrays for (t, name), column in self.columns.items() if t == resource_type}
+
+    def select(self, resource_type: str, values: Dict[str, str],
+               positions: Optional[List[int]]) -> Tuple[Optional[List[int]], Tuple[str, ...]]:
+        """
+        Positions (all rows when positions is None) matching every parameter
+        in values that has a column, in order, plus the names evaluated; the
+        other parameters are left to the row predicates
+        """
+        operands = self.operands(resource_type, values)
+        if not operands:
+            return positions, ()
+        mask = row_mask(self.arrays(resource_type), operands, 0, self.sizes[resource_type])
+        return select_positions(mask, positions), tuple(operands)
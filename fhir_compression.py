@@ -0,0 +1,124 @@
+"""
+Accept-Encoding negotiation and a cache of pre-compressed response bodies
+"""
+import gzip
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick the best supported content-coding from an Accept-Encoding header"""
+    if not accept_encoding:
+        return None
+
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding] = q
+
+    best, best_q = None, 0.0
+    # SUPPORTED_ENCODINGS is in preference order, so ties go to brotli
+    for coding in SUPPORTED_ENCODINGS:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, gzip_level: int, brotli_quality: int) -> bytes:
+    """Compress a body with the negotiated content-coding"""
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    # mtime=0 keeps output deterministic so cached and fresh bodies are identical
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class CompressionStats:
+    """Running totals for compressed responses"""
+
+    def __init__(self):
+        self.responses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def record(self, bytes_in: int, bytes_out: int):
+        self.responses += 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "responses": self.responses,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
+
+
+class CompressedCache:
+    """
+    LRU of encoded bodies keyed by (key, content-coding), bounded by total bytes.
+    Also holds decoded Binary content under the 'identity' coding.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[bytes, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, encoding: str) -> Optional[Tuple[bytes, int]]:
+        """Return (compressed body, original size) or None"""
+        with self._lock:
+            entry = self._entries.get((key, encoding))
+            if entry is not None:
+                self._entries.move_to_end((key, encoding))
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def put(self, key: str, encoding: str, body: bytes, original_size: int):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop((key, encoding), None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self._entries[(key, encoding)] = (body, original_size)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
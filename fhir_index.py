@@ -0,0 +1,613 @@
+"""
+In-memory indexes over the loaded synthetic FHIR data
+"""
+import heapq
+import time
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import Optional, List, Dict, Any, Iterable, Callable, Tuple
+
+
+def resource_body(resource: Dict) -> Dict:
+    """Return the FHIR resource itself (Patient records are wrapped in a data envelope)"""
+    if resource.get("resourceType") == "Patient" and isinstance(resource.get("data"), dict):
+        return resource["data"]
+    return resource
+
+
+def reference_id(reference: Any, resource_type: str) -> Optional[str]:
+    """Extract the id from a 'Type/id' reference (string or Reference object)"""
+    if isinstance(reference, dict):
+        reference = reference.get("reference", "")
+    if not isinstance(reference, str):
+        return None
+    prefix = f"{resource_type}/"
+    if reference.startswith(prefix):
+        return reference[len(prefix):]
+    # Absolute references, e.g. https://.../FHIR/R4/Patient/{id}
+    marker = f"/{prefix}"
+    if marker in reference:
+        return reference.rsplit(marker, 1)[1]
+    return None
+
+
+# Reference search parameters per resource type:
+# name -> (element path, allowed target types or None for any)
+REFERENCE_PARAMS = {
+    "Appointment": {
+        "actor": (("participant", "actor"), None),
+        "patient": (("participant", "actor"), ("Patient",)),
+        "practitioner": (("participant", "actor"), ("Practitioner",)),
+        "location": (("participant", "actor"), ("Location",)),
+    },
+    "Condition": {
+        "subject": (("subject",), None),
+        "patient": (("subject",), ("Patient",)),
+        "encounter": (("encounter",), None),
+        "recorder": (("recorder",), None),
+        "asserter": (("asserter",), None),
+    },
+    "Consent": {
+        "patient": (("patient",), None),
+        "organization": (("organization",), None),
+    },
+    "Coverage": {
+        "beneficiary": (("beneficiary",), None),
+        "patient": (("beneficiary",), ("Patient",)),
+        "payor": (("payor",), None),
+        "subscriber": (("subscriber",), None),
+    },
+    "DocumentReference": {
+        "subject": (("subject",), None),
+        "patient": (("subject",), ("Patient",)),
+        "author": (("author",), None),
+        "authenticator": (("authenticator",), None),
+        "encounter": (("context", "encounter"), None),
+    },
+    "Encounter": {
+        "subject": (("subject",), None),
+        "patient": (("subject",), ("Patient",)),
+        "participant": (("participant", "individual"), None),
+        "practitioner": (("participant", "individual"), ("Practitioner",)),
+        "service-provider": (("serviceProvider",), None),
+        "location": (("location", "location"), None),
+        "appointment": (("appointment",), None),
+    },
+    "Observation": {
+        "subject": (("subject",), None),
+        "patient": (("subject",), ("Patient",)),
+        "encounter": (("encounter",), None),
+        "performer": (("performer",), None),
+    },
+    "Patient": {
+        "organization": (("managingOrganization",), None),
+        "general-practitioner": (("generalPractitioner",), None),
+    },
+    "PractitionerRole": {
+        "practitioner": (("practitioner",), None),
+        "organization": (("organization",), None),
+        "location": (("location",), None),
+    },
+    "Procedure": {
+        "subject": (("subject",), None),
+        "patient": (("subject",), ("Patient",)),
+        "encounter": (("encounter",), None),
+        "performer": (("performer", "actor"), None),
+        "location": (("location",), None),
+    },
+    "Schedule": {
+        "actor": (("actor",), None),
+    },
+    "Provenance": {
+        "target": (("target",), None),
+        "patient": (("target",), ("Patient",)),
+        "agent": (("agent", "who"), None),
+    },
+}
+
+
+# Most frequent values kept per parameter in the load-time statistics
+STATISTICS_TOP_VALUES = 10
+
+
+def normalize_reference(reference: Any) -> Optional[str]:
+    """Reduce a Reference (object, relative or absolute string) to 'Type/id'"""
+    if isinstance(reference, dict):
+        reference = reference.get("reference")
+    if not isinstance(reference, str) or "/" not in reference:
+        return None
+    parts = reference.rstrip("/").split("/")
+    return f"{parts[-2]}/{parts[-1]}"
+
+
+def _follow(resource: Dict, path: tuple) -> List[Any]:
+    """Nodes at the end of an element path, descending into lists"""
+    nodes = [resource_body(resource)]
+    for key in path:
+        next_nodes = []
+        for node in nodes:
+            if not isinstance(node, dict):
+                continue
+            value = node.get(key)
+            if isinstance(value, list):
+                next_nodes.extend(value)
+            elif value is not None:
+                next_nodes.append(value)
+        nodes = next_nodes
+    return nodes
+
+
+def extract_references(resource: Dict, path: tuple, target_types: Optional[tuple] = None) -> List[str]:
+    """Follow an element path (descending into lists) and collect 'Type/id' references"""
+    nodes = _follow(resource, path)
+    references = []
+    for node in nodes:
+        reference = normalize_reference(node)
+        if reference and (target_types is None or reference.split("/", 1)[0] in target_types):
+            references.append(reference)
+    return list(dict.fromkeys(references))
+
+
+def patient_ids(resource: Dict) -> List[str]:
+    """Patient ids a resource belongs to (subject, patient, beneficiary, appointment actor or provenance target)"""
+    ids = []
+    for field in ("subject", "patient", "beneficiary"):
+        patient_id = reference_id(resource.get(field), "Patient")
+        if patient_id:
+            ids.append(patient_id)
+
+    # Appointments reference the patient through participant actors
+    for participant in resource.get("participant", []) or []:
+        if isinstance(participant, dict):
+            patient_id = reference_id(participant.get("actor"), "Patient")
+            if patient_id:
+                ids.append(patient_id)
+
+    # Provenance joins the compartment of the patients it targets
+    if resource.get("resourceType") == "Provenance":
+        for target in resource.get("target", []) or []:
+            patient_id = reference_id(target, "Patient")
+            if patient_id:
+                ids.append(patient_id)
+
+    return list(dict.fromkeys(ids))
+
+
+# Element used as a stand-in for meta.lastUpdated when a resource has none
+LAST_UPDATED_PATHS = {
+    "Appointment": ("created",),
+    "Condition": ("recordedDate",),
+    "Consent": ("dateTime",),
+    "DocumentReference": ("date",),
+    "Encounter": ("period", "end"),
+    "Observation": ("issued",),
+    "Procedure": ("performedDateTime",),
+    "Provenance": ("recorded",),
+}
+
+
+def last_updated(resource: Dict) -> Optional[str]:
+    """meta.lastUpdated, falling back to the resource's own recorded date"""
+    body = resource_body(resource)
+    value = (body.get("meta") or {}).get("lastUpdated")
+    if value:
+        return value
+    if body is not resource and resource.get("retrieved_at"):
+        return resource["retrieved_at"]
+    node = body
+    for key in LAST_UPDATED_PATHS.get(body.get("resourceType"), ()):
+        node = node.get(key) if isinstance(node, dict) else None
+    return node if isinstance(node, str) and node else None
+
+
+def value_statistics(postings: Dict[str, List[int]]) -> Dict[str, Any]:
+    """Value-frequency summary of one index: distinct values, postings and the most common values"""
+    counts = sorted(((value, len(positions)) for value, positions in postings.items()), key=lambda item: -item[1])
+    return {
+        "distinct": len(counts),
+        "postings": sum(count for _, count in counts),
+        "most_common": counts[:STATISTICS_TOP_VALUES],
+    }
+
+
+# String parameters are indexed by every substring of up to NGRAM characters:
+# shorter needles are looked up directly, longer ones through their trigrams
+NGRAM = 3
+
+
+def ngrams(text: str, sizes: Iterable[int] = range(1, NGRAM + 1)) -> set:
+    """Distinct substrings of text of the given lengths"""
+    return {text[start:start + size] for size in sizes for start in range(len(text) - size + 1)}
+
+
+# Date prefix -> slice bounds over ascending day ordinals
+DATE_RANGES = {
+    "ge": lambda days, bound: (bisect_left(days, bound), len(days)),
+    "gt": lambda days, bound: (bisect_right(days, bound), len(days)),
+    "le": lambda days, bound: (0, bisect_right(days, bound)),
+    "lt": lambda days, bound: (0, bisect_left(days, bound)),
+    "eq": lambda days, bound: (bisect_left(days, bound), bisect_right(days, bound)),
+}
+
+
+def _ranked(keyed: List[Tuple[Any, int]], values: List[Optional[List[Any]]]) -> Tuple[List[int], List[int]]:
+    """(ordering, rank per position) from (key, position) pairs already in sort order"""
+    ranks = [0] * len(values)
+    rank, previous = -1, None
+    for key, position in keyed:
+        if rank < 0 or key != previous:
+            rank, previous = rank + 1, key
+        ranks[position] = rank
+    missing = []
+    for position, found in enumerate(values):
+        if not found:
+            ranks[position] = rank + 1
+            if found is not None:
+                missing.append(position)
+    return [position for _, position in keyed] + missing, ranks
+
+
+def presort(values: List[Optional[List[Any]]]) -> Dict[bool, Tuple[List[int], List[int]]]:
+    """
+    Sort orders of one parameter, ascending (False) and descending (True), as
+    (ordering, rank per position). Ascending sorts by each resource's lowest
+    value, descending by its highest; equal values share a rank, ties keep
+    load order and resources without a value come last. values[position] is
+    None for rows that are not resources.
+    """
+    ascending = sorted(
+        ((min(found), position) for position, found in enumerate(values) if found),
+        key=lambda item: item[0]
+    )
+    if any(found and len(found) > 1 for found in values):
+        # sort() is stable with reverse=True too
+        descending = sorted(
+            ((max(found), position) for position, found in enumerate(values) if found),
+            key=lambda item: item[0], reverse=True
+        )
+    else:
+        # Single-valued: the ascending runs of equal keys in reverse order
+        runs: List[List[Tuple[Any, int]]] = []
+        for item in ascending:
+            if runs and runs[-1][0][0] == item[0]:
+                runs[-1].append(item)
+            else:
+                runs.append([item])
+        descending = [item for run in reversed(runs) for item in run]
+    return {False: _ranked(ascending, values), True: _ranked(descending, values)}
+
+
+# Patient compartment members in $everything order (the Patient itself comes first)
+COMPARTMENT_TYPES = [
+    "Coverage", "Encounter", "Condition", "Procedure", "Observation", "Appointment",
+    "Consent", "DocumentReference", "Provenance",
+]
+
+
+class FHIRIndex:
+    """
+    Lookup structures built once from FHIR_DATA.
+
+    Posting lists hold positions into FHIR_DATA[resource_type], so results
+    always come back in the original load order.
+    """
+
+    def __init__(self, data: Dict[str, Any], token_params: Optional[Dict[str, Dict[str, Callable]]] = None,
+                 sort_params: Optional[Dict[str, Dict[str, Callable]]] = None,
+                 string_params: Optional[Dict[str, Dict[str, Callable]]] = None,
+                 date_params: Optional[Dict[str, Dict[str, Callable]]] = None,
+                 series_params: Optional[Dict[str, Tuple[Callable, Callable, Callable]]] = None):
+        self.data = data
+        # type -> token parameter -> value extractor (see fhir_search.token_indexes)
+        self.token_params = token_params or {}
+        # type -> sortable parameter -> sort value extractor (see fhir_search.sort_indexes)
+        self.sort_params = sort_params or {}
+        # type -> string parameter -> lowercased text extractor (see fhir_search.string_indexes)
+        self.string_params = string_params or {}
+        # type -> date parameter -> day ordinals extractor (see fhir_search.date_indexes)
+        self.date_params = date_params or {}
+        # type -> (series group, code and instant extractors) (see fhir_search.series_indexes)
+        self.series_params = series_params or {}
+        self.by_id: Dict[str, Dict[str, Dict]] = {}
+        self.by_patient: Dict[str, Dict[str, List[int]]] = {}
+        # type -> resource id -> position
+        self.positions: Dict[str, Dict[str, int]] = {}
+        # (type, param) -> position -> references, and reference -> positions
+        self.references: Dict[tuple, Dict[int, List[str]]] = {}
+        self.referenced_by: Dict[tuple, Dict[str, List[int]]] = {}
+        # (type, param) -> bare target id -> positions, for references given without a type
+        self.referenced_by_id: Dict[tuple, Dict[str, List[int]]] = {}
+        # (type, param) -> token value -> positions
+        self.tokens: Dict[tuple, Dict[str, List[int]]] = {}
+        # identifier token (value, system|value, system|) -> (type, position) across all types
+        self.identifiers: Dict[str, List[Tuple[str, int]]] = {}
+        # (type, param) -> n-gram -> positions, for substring (string) searches
+        self.substrings: Dict[tuple, Dict[str, List[int]]] = {}
+        # (type, param) -> (day ordinals ascending, their positions, positions with unparseable dates)
+        self.dates: Dict[tuple, Tuple[List[int], List[int], List[int]]] = {}
+        # type -> (patient id, group, code) -> positions, most recent first (Observation $lastn)
+        self.series: Dict[str, Dict[Tuple[str, str, str], List[int]]] = {}
+        # type -> (patient id, group) -> series codes, the most recently observed first
+        self.series_codes: Dict[str, Dict[Tuple[str, str], List[str]]] = {}
+        # type -> position -> rank in series order, for merging the series of several groups
+        self.series_ranks: Dict[str, Dict[int, int]] = {}
+        # (type, param) -> value-frequency statistics, computed at load
+        self.statistics: Dict[tuple, Dict[str, Any]] = {}
+        # (type, param, descending) -> presorted positions, and rank per position
+        self.orderings: Dict[tuple, List[int]] = {}
+        self.sort_ranks: Dict[tuple, List[int]] = {}
+        # type -> position -> lastUpdated (or its stand-in)
+        self.last_updated: Dict[str, List[Optional[str]]] = {}
+        # patient id -> ordered compartment members, built on first use
+        self._compartments: Dict[str, tuple] = {}
+        # type -> seconds spent building its indexes
+        self.build_seconds: Dict[str, float] = {}
+
+        for resource_type, resources in data.items():
+            # ExplanationOfBenefit is served as a single OperationOutcome bundle
+            if not isinstance(resources, list):
+                continue
+            started = time.perf_counter()
+            self._index_type(resource_type, resources)
+            self.build_seconds[resource_type] = time.perf_counter() - started
+
+    def _index_type(self, resource_type: str, resources: List[Any]):
+        ids: Dict[str, Dict] = {}
+        positions: Dict[str, int] = {}
+        patients: Dict[str, List[int]] = {}
+        params = REFERENCE_PARAMS.get(resource_type, {})
+        forward = {param: {} for param in params}
+        reverse = {param: {} for param in params}
+        reverse_ids = {param: {} for param in params}
+        token_params = self.token_params.get(resource_type, {})
+        tokens = {param: {} for param in token_params}
+        string_params = self.string_params.get(resource_type, {})
+        substrings = {param: {} for param in string_params}
+        date_params = self.date_params.get(resource_type, {})
+        dated = {param: [] for param in date_params}
+        undated = {param: [] for param in date_params}
+        sort_params = self.sort_params.get(resource_type, {})
+        sort_values = {param: [] for param in sort_params}
+        series_params = self.series_params.get(resource_type)
+        # (patient id, group, code) -> [(instant, position)]
+        timed: Dict[Tuple[str, str, str], List[Tuple[Optional[float], int]]] = {}
+        updated: List[Optional[str]] = []
+
+        for position, resource in enumerate(resources):
+            if not isinstance(resource, dict):
+                updated.append(None)
+                for values in sort_values.values():
+                    values.append(None)
+                continue
+            updated.append(last_updated(resource))
+
+            # Patient wrappers are addressable by the wrapper id and the inner resource id
+            for resource_id in (resource.get("id"), resource_body(resource).get("id")):
+                if resource_id and resource_id not in ids:
+                    ids[resource_id] = resource
+                    positions[resource_id] = position
+
+            members = patient_ids(resource)
+            for patient_id in members:
+                patients.setdefault(patient_id, []).append(position)
+
+            if series_params and members:
+                groups = series_params[0](resource)
+                instants = series_params[2](resource)
+                instant = max(instants) if instants else None
+                for code in series_params[1](resource):
+                    for group in groups:
+                        for patient_id in members:
+                            timed.setdefault((patient_id, group, code), []).append((instant, position))
+
+            for param, (path, target_types) in params.items():
+                references = extract_references(resource, path, target_types)
+                if references:
+                    forward[param][position] = references
+                    for reference in references:
+                        reverse[param].setdefault(reference, []).append(position)
+                    for target_id in dict.fromkeys(reference.split("/", 1)[1] for reference in references):
+                        reverse_ids[param].setdefault(target_id, []).append(position)
+
+            for param, extract in token_params.items():
+                for value in extract(resource):
+                    tokens[param].setdefault(value, []).append(position)
+
+            for param, extract in string_params.items():
+                for gram in set().union(*map(ngrams, extract(resource))):
+                    substrings[param].setdefault(gram, []).append(position)
+
+            for param, extract in date_params.items():
+                for day in extract(resource):
+                    if day is not None:
+                        dated[param].append((day, position))
+                    elif not undated[param] or undated[param][-1] != position:
+                        undated[param].append(position)
+
+            for param, extract in sort_params.items():
+                sort_values[param].append(extract(resource))
+
+        self.by_id[resource_type] = ids
+        self.positions[resource_type] = positions
+        self.by_patient[resource_type] = patients
+        self.last_updated[resource_type] = updated
+        for param in params:
+            self.references[(resource_type, param)] = forward[param]
+            self.referenced_by[(resource_type, param)] = reverse[param]
+            self.referenced_by_id[(resource_type, param)] = reverse_ids[param]
+            self.statistics[(resource_type, param)] = value_statistics(reverse[param])
+        for param in token_params:
+            self.tokens[(resource_type, param)] = tokens[param]
+            self.statistics[(resource_type, param)] = value_statistics(tokens[param])
+        for param in string_params:
+            self.substrings[(resource_type, param)] = substrings[param]
+        for param in date_params:
+            dated[param].sort(key=lambda item: item[0])
+            self.dates[(resource_type, param)] = (
+                [day for day, _ in dated[param]], [position for _, position in dated[param]], undated[param]
+            )
+        if series_params:
+            self._index_series(resource_type, timed)
+        self.statistics[(resource_type, "patient")] = value_statistics(patients)
+        for value, postings in tokens.get("identifier", {}).items():
+            self.identifiers.setdefault(value, []).extend((resource_type, position) for position in postings)
+        for param, values in sort_values.items():
+            for descending, (ordering, ranks) in presort(values).items():
+                self.orderings[(resource_type, param, descending)] = ordering
+                self.sort_ranks[(resource_type, param, descending)] = ranks
+
+    def _index_series(self, resource_type: str, timed: Dict[Tuple[str, str, str], List[Tuple[Optional[float], int]]]):
+        """Order each (patient, group, code) series most recent first; undated entries go last, in load order"""
+        order = lambda entry: (entry[0] is None, -(entry[0] or 0.0), entry[1])
+        series: Dict[Tuple[str, str, str], List[int]] = {}
+        latest: Dict[Tuple[str, str], List[Tuple[float, str]]] = {}
+        instants: Dict[int, Optional[float]] = {}
+        for key, entries in timed.items():
+            entries.sort(key=order)
+            series[key] = [position for _, position in entries]
+            patient_id, group, code = key
+            latest.setdefault((patient_id, group), []).append((entries[0][0] or float("-inf"), code))
+            instants.update((position, instant) for instant, position in entries)
+        self.series[resource_type] = series
+        self.series_codes[resource_type] = {
+            key: [code for _, code in sorted(codes, key=lambda item: (-item[0], item[1]))]
+            for key, codes in latest.items()
+        }
+        ranked = sorted(((instant, position) for position, instant in instants.items()), key=order)
+        self.series_ranks[resource_type] = {position: rank for rank, (_, position) in enumerate(ranked)}
+
+    def get(self, resource_type: str, resource_id: str) -> Optional[Dict]:
+        """Get a resource by ID"""
+        return self.by_id.get(resource_type, {}).get(resource_id)
+
+    def position(self, resource_type: str, resource_id: str) -> Optional[int]:
+        """Position of a resource in FHIR_DATA[resource_type]"""
+        return self.positions.get(resource_type, {}).get(resource_id)
+
+    def references_from(self, resource_type: str, param: str, resource: Dict) -> List[str]:
+        """References held by a resource under a reference search parameter"""
+        position = self.position(resource_type, resource.get("id"))
+        if position is None:
+            return []
+        return self.references.get((resource_type, param), {}).get(position, [])
+
+    def referencing(self, resource_type: str, param: str, reference: str) -> List[int]:
+        """Positions of resource_type resources whose param points at reference"""
+        return self.referenced_by.get((resource_type, param), {}).get(reference, [])
+
+    def referencing_id(self, resource_type: str, param: str, target_id: str) -> List[int]:
+        """Positions of resource_type resources whose param points at any resource with this id"""
+        return self.referenced_by_id.get((resource_type, param), {}).get(target_id, [])
+
+    def identified(self, values: Iterable[str]) -> List[Tuple[str, int]]:
+        """(type, position) of resources of any type holding one of the identifier tokens, in load order"""
+        found = dict.fromkeys(match for value in values for match in self.identifiers.get(value, []))
+        type_order = {resource_type: rank for rank, resource_type in enumerate(self.positions)}
+        return sorted(found, key=lambda match: (type_order[match[0]], match[1]))
+
+    def token(self, resource_type: str, param: str, value: str) -> List[int]:
+        """Positions of resource_type resources whose token param has this value"""
+        return self.tokens.get((resource_type, param), {}).get(value, [])
+
+    def substring(self, resource_type: str, param: str, text: str) -> List[int]:
+        """
+        Positions whose string param may contain text (lowercased): exact
+        for up to NGRAM characters, otherwise the intersection of its
+        trigrams' postings (smallest first), which the predicate confirms
+        """
+        grams = {text} if len(text) <= NGRAM else ngrams(text, (NGRAM,))
+        substrings = self.substrings.get((resource_type, param), {})
+        postings = sorted((substrings.get(gram, []) for gram in grams), key=len)
+        positions = postings[0]
+        for other in postings[1:]:
+            if not positions:
+                break
+            members = set(other)
+            positions = [position for position in positions if position in members]
+        return list(positions)
+
+    def date_range(self, resource_type: str, param: str, prefix: str, bound: int) -> List[int]:
+        """
+        Positions with a param date (day ordinal) matching prefix and bound,
+        plus those holding an unparseable date (left to the predicate), in
+        load order
+        """
+        days, positions, undated = self.dates.get((resource_type, param), ([], [], []))
+        low, high = DATE_RANGES[prefix](days, bound)
+        return sorted(set(positions[low:high]).union(undated))
+
+    def last_n(self, resource_type: str, patient_id: str, groups: List[str], codes: Optional[Iterable[str]],
+               count: int) -> List[int]:
+        """
+        Positions of the `count` most recent resources per code of a patient's
+        series in any of groups (every code the patient has there when codes
+        is None), grouped by code. Only the first `count` entries of each
+        series are read, so the cost does not grow with the length of the
+        patient's history.
+        """
+        patient_id = patient_id.replace("Patient/", "")
+        series = self.series.get(resource_type, {})
+        if codes is None:
+            series_codes = self.series_codes.get(resource_type, {})
+            codes = dict.fromkeys(code for group in groups for code in series_codes.get((patient_id, group), []))
+        found: Dict[int, None] = {}
+        for code in codes:
+            heads = [series.get((patient_id, group, code), [])[:count] for group in groups]
+            if len(heads) > 1:
+                # A resource in several groups sits at the same rank in each head
+                merged = heapq.merge(*heads, key=self.series_ranks[resource_type].__getitem__)
+                head = list(islice(dict.fromkeys(merged), count))
+            else:
+                head = heads[0] if heads else []
+            # A resource coded several ways counts in each series but is returned once
+            found.update(dict.fromkeys(head))
+        return list(found)
+
+    def resolve(self, reference: str) -> Optional[Dict]:
+        """Look up a 'Type/id' reference"""
+        resource_type, _, resource_id = reference.partition("/")
+        return self.get(resource_type, resource_id)
+
+    def resources(self, resource_type: str, positions: Iterable[int]) -> List[Dict]:
+        """Materialize a posting list into resources"""
+        resources = self.data.get(resource_type, [])
+        return [resources[position] for position in positions]
+
+    def compartment(self, patient_id: str) -> tuple:
+        """
+        Everything for one patient as ((type, position, mode), ...): the Patient,
+        its compartment in COMPARTMENT_TYPES order, then the resources those
+        reference (mode 'include'), each once
+        """
+        patient_id = patient_id.replace("Patient/", "")
+        cached = self._compartments.get(patient_id)
+        if cached is not None:
+            return cached
+
+        members = []
+        seen = set()
+        patient_position = self.position("Patient", patient_id)
+        if patient_position is not None:
+            members.append(("Patient", patient_position, "match"))
+            seen.add(f"Patient/{patient_id}")
+
+        for resource_type in COMPARTMENT_TYPES:
+            for position in self.by_patient.get(resource_type, {}).get(patient_id, []):
+                members.append((resource_type, position, "match"))
+                seen.add(f"{resource_type}/{self.data[resource_type][position].get('id')}")
+
+        referenced = []
+        for resource_type, position, _ in members:
+            for param in REFERENCE_PARAMS.get(resource_type, {}):
+                for reference in self.references.get((resource_type, param), {}).get(position, []):
+                    if reference in seen:
+                        continue
+                    target_type, _, target_id = reference.partition("/")
+                    target_position = self.position(target_type, target_id)
+                    if target_position is not None:
+                        seen.add(reference)
+                        referenced.append((target_type, target_position, "include"))
+
+        compartment = tuple(members + referenced)
+        self._compartments[patient_id] = compartment
+        return compartment
@@ -0,0 +1,117 @@
+"""
+Low-overhead request metrics exported in Prometheus text format
+
+Recording happens on the event loop thread only, so counters are plain
+integers (no locks), and every histogram is allocated once per route.
+"""
+from bisect import bisect_left
+from typing import Optional, List, Dict, Tuple
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RESULT_SIZE_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+
+
+class Histogram:
+    """Fixed-bucket histogram (cumulated only when rendered)"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RouteStats:
+    """Counters and histograms for one route template"""
+
+    __slots__ = ("method", "route", "resource_type", "statuses", "latency", "result_size")
+
+    def __init__(self, method: str, route: str):
+        self.method = method
+        self.route = route
+        # "/Patient/{patient_id}/$everything" -> "Patient"
+        segment = route.strip("/").split("/", 1)[0]
+        self.resource_type = segment if segment[:1].isupper() else ""
+        self.statuses: Dict[int, int] = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.result_size = Histogram(RESULT_SIZE_BUCKETS)
+
+    def record(self, status: int, seconds: float, result_size: Optional[int]):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latency.observe(seconds)
+        if result_size is not None:
+            self.result_size.observe(result_size)
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_metric(name: str, kind: str, help_text: str, samples: List[Tuple[Dict[str, str], float]]) -> List[str]:
+    """Render one metric family"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels)} {value}")
+    return lines
+
+
+def _format_histogram(name: str, help_text: str, series: List[Tuple[Dict[str, str], Histogram]]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, histogram in series:
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': repr(float(bound))})} {cumulative}")
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+    return lines
+
+
+class MetricsRegistry:
+    """Per-route request metrics"""
+
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteStats] = {}
+
+    def route_stats(self, method: str, route: str) -> RouteStats:
+        """RouteStats for a route template, created on its first request"""
+        key = (method, route)
+        stats = self.routes.get(key)
+        if stats is None:
+            stats = self.routes[key] = RouteStats(method, route)
+        return stats
+
+    def render(self) -> List[str]:
+        routes = list(self.routes.values())
+        labels = [
+            ({"method": stats.method, "route": stats.route, "resource_type": stats.resource_type}, stats)
+            for stats in routes
+        ]
+        lines = format_metric(
+            "fhir_requests_total", "counter", "Requests handled, by route, resource type and status",
+            [({**route_labels, "status": str(status)}, count)
+             for route_labels, stats in labels for status, count in sorted(stats.statuses.items())]
+        )
+        lines += _format_histogram(
+            "fhir_request_duration_seconds", "Request latency",
+            [(route_labels, stats.latency) for route_labels, stats in labels]
+        )
+        lines += _format_histogram(
+            "fhir_result_entries", "Matched resources per search response",
+            [(route_labels, stats.result_size) for route_labels, stats in labels if stats.result_size.count]
+        )
+        return lines
@@ -0,0 +1,139 @@
+"""
+Partitioned scans of the columnar extracts across a process pool
+
+The column arrays of large resource types are moved into shared memory once;
+worker processes attach to them by name instead of receiving copies. A scan
+splits the rows into one contiguous partition per worker, each worker
+evaluates the encoded operands on its slice (fhir_columnar.row_mask) and
+returns the matching positions, and the partitions are concatenated in
+order. Resource types below min_rows are scanned in-process.
+"""
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Optional, List, Dict, Any, Tuple
+
+from fhir_columnar import ColumnStore, np, row_mask, select_positions
+
+# Worker process state: type -> param -> arrays mapped from shared memory
+_WORKER_COLUMNS: Dict[str, Dict[str, Dict[str, Any]]] = {}
+_WORKER_SEGMENTS: List[shared_memory.SharedMemory] = []
+
+
+def _attach(layout: Dict[str, Dict[str, Dict[str, tuple]]]):
+    """Pool initializer: map every exported array (segment name, dtype, shape)"""
+    for resource_type, params in layout.items():
+        for name, arrays in params.items():
+            for key, (segment_name, dtype, shape) in arrays.items():
+                segment = shared_memory.SharedMemory(name=segment_name)
+                _WORKER_SEGMENTS.append(segment)
+                _WORKER_COLUMNS.setdefault(resource_type, {}).setdefault(name, {})[key] = np.ndarray(
+                    shape, dtype=dtype, buffer=segment.buf
+                )
+
+
+def _scan_partition(resource_type: str, operands: Dict[str, tuple], start: int, stop: int):
+    """Matching positions in rows [start, stop)"""
+    return np.flatnonzero(row_mask(_WORKER_COLUMNS[resource_type], operands, start, stop)) + start
+
+
+class PartitionedScanner:
+    """
+    Process-pool executor for columnar scans of resource types with at
+    least min_rows rows. The pool is started on the first such scan.
+    """
+
+    def __init__(self, store: ColumnStore, workers: int, min_rows: int):
+        self.store = store
+        self.workers = workers
+        self.min_rows = min_rows
+        self.scans = 0
+        self._layout: Dict[str, Dict[str, Dict[str, tuple]]] = {}
+        self._segments: List[shared_memory.SharedMemory] = []
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        if np is None or workers < 2:
+            return
+
+        for resource_type, size in store.sizes.items():
+            if size >= min_rows:
+                self._layout[resource_type] = {
+                    name: self._share(arrays) for name, arrays in store.arrays(resource_type).items()
+                }
+        if self._segments:
+            atexit.register(self.close)
+
+    def _share(self, arrays: Dict[str, Any]) -> Dict[str, tuple]:
+        """Move a column's arrays into shared memory; the store keeps reading them from there"""
+        layout = {}
+        for key, array in list(arrays.items()):
+            segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+            shared[...] = array
+            arrays[key] = shared
+            self._segments.append(segment)
+            layout[key] = (segment.name, array.dtype.str, array.shape)
+        return layout
+
+    @property
+    def shared_bytes(self) -> int:
+        return sum(segment.size for segment in self._segments)
+
+    def covers(self, resource_type: str) -> bool:
+        """Whether scans of resource_type are partitioned across processes"""
+        return resource_type in self._layout
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a server with running threads is not safe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_attach, initargs=(self._layout,),
+                )
+            return self._pool
+
+    def select(self, resource_type: str, values: Dict[str, str],
+               positions: Optional[List[int]]) -> Tuple[Optional[List[int]], Tuple[str, ...]]:
+        """ColumnStore.select, with the rows split across the pool for covered types"""
+        if not self.covers(resource_type):
+            return self.store.select(resource_type, values, positions)
+        operands = self.store.operands(resource_type, values)
+        if not operands:
+            return positions, ()
+
+        size = self.store.sizes[resource_type]
+        bounds = [size * part // self.workers for part in range(self.workers + 1)]
+        pool = self._executor()
+        futures = [
+            pool.submit(_scan_partition, resource_type, operands, start, stop)
+            for start, stop in zip(bounds, bounds[1:]) if stop > start
+        ]
+        matched = np.concatenate([future.result() for future in futures])
+        self.scans += 1
+        if positions is None:
+            return matched.tolist(), tuple(operands)
+        mask = np.zeros(size, dtype=bool)
+        mask[matched] = True
+        return select_positions(mask, positions), tuple(operands)
+
+    def shutdown(self):
+        """Stop the worker processes; the next scan starts a new pool of self.workers"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    def close(self):
+        """Stop the pool and release the shared memory"""
+        self.shutdown()
+        for segment in self._segments:
+            try:
+                segment.close()
+            except BufferError:
+                # Still mapped by the store's arrays; the mapping ends with the process
+                pass
+            segment.unlink()
+        self._segments = []
@@ -0,0 +1,315 @@
+"""
+Search planning over the in-memory indexes
+
+A search's indexed parameters are looked up in their indexes, ordered by
+cardinality (most selective first) and intersected; OR values are looked
+up one by one and their posting lists merged. Chained parameters
+(patient.family) are joined through the reference postings of the targets
+they match, and reverse chains (_has) map the sources they match back
+through their forward references. Whatever the indexes cannot answer
+exactly is left to the compiled predicates (see fhir_search).
+"""
+import heapq
+import time
+from typing import Optional, List, Dict, Any, Tuple
+
+from fhir_index import FHIRIndex, REFERENCE_PARAMS, normalize_reference, presort, resource_body
+from fhir_search import SEARCH_PARAMETERS, date_search, parse_chain, parse_has, split_values
+
+# A posting list this many times larger than the current candidates is not
+# intersected; the filter pass checks the parameter on the few candidates instead
+INTERSECT_RATIO = 16
+
+
+def index_name(index: FHIRIndex, resource_type: str, param: str) -> Optional[str]:
+    """Name of the index answering param, or None when it has none"""
+    if param.startswith("_has:"):
+        return f"{resource_type}.{param} (reverse chain)"
+    if "." in param:
+        return f"{resource_type}.{param} (chain)"
+    if param == "_id":
+        return f"{resource_type}._id"
+    if param == "patient":
+        return f"{resource_type}.patient (compartment)"
+    if param in REFERENCE_PARAMS.get(resource_type, {}):
+        return f"{resource_type}.{param} (reference)"
+    if (resource_type, param) in index.tokens:
+        return f"{resource_type}.{param} (token)"
+    if (resource_type, param) in index.substrings:
+        return f"{resource_type}.{param} (n-gram)"
+    if (resource_type, param) in index.dates:
+        return f"{resource_type}.{param} (date)"
+    return None
+
+
+def union_postings(postings: List[List[int]]) -> List[int]:
+    """Union of ascending posting lists, in load order without duplicates"""
+    merged: List[int] = []
+    for position in heapq.merge(*postings):
+        if not merged or merged[-1] != position:
+            merged.append(position)
+    return merged
+
+
+def index_lookup(index: FHIRIndex, resource_type: str, param: str, value: str) -> Optional[List[int]]:
+    """
+    Posting list of positions matching param=value (a superset of them for
+    'superset' parameters), or None when param has no index; OR values (a,b)
+    are the union of their posting lists
+    """
+    if param.startswith("_has:"):
+        return has_lookup(index, resource_type, param, value)
+    if "." in param:
+        return chain_lookup(index, resource_type, param, value)
+    if index_name(index, resource_type, param) is None:
+        return None
+    postings = [_postings(index, resource_type, param, item) for item in split_values(value)]
+    if any(posting is None for posting in postings):
+        # A value the index cannot bound (a date without a prefix) needs every row
+        return None
+    if len(postings) == 1:
+        return postings[0]
+    return union_postings(postings)
+
+
+def _postings(index: FHIRIndex, resource_type: str, param: str, value: str) -> Optional[List[int]]:
+    """Posting list of one value of an indexed parameter, or None when the index cannot answer it"""
+    if param == "_id":
+        position = index.position(resource_type, value)
+        return [] if position is None else [position]
+    if param == "patient":
+        return index.by_patient.get(resource_type, {}).get(value.replace("Patient/", ""), [])
+    if param in REFERENCE_PARAMS.get(resource_type, {}):
+        if "/" in value:
+            return index.referencing(resource_type, param, normalize_reference(value))
+        return index.referencing_id(resource_type, param, value)
+    if (resource_type, param) in index.substrings:
+        return index.substring(resource_type, param, value.lower())
+    if (resource_type, param) in index.dates:
+        prefix, bound, _ = date_search(value)
+        if bound is None:
+            return None
+        return index.date_range(resource_type, param, prefix, bound.toordinal())
+    return index.token(resource_type, param, value)
+
+
+def match_positions(index: FHIRIndex, resource_type: str, param: str, value: str) -> List[int]:
+    """
+    Positions matching one parameter: its posting list when the index answers
+    it exactly, otherwise the predicate over the posting list (or every row)
+    """
+    postings = index_lookup(index, resource_type, param, value)
+    if param.startswith("_has:") or "." in param:
+        return postings
+    search_param = SEARCH_PARAMETERS[resource_type][param]
+    if postings is not None and search_param.index in ("exact", "only"):
+        return postings
+    resources = index.data.get(resource_type, [])
+    if postings is None:
+        postings = [position for position, resource in enumerate(resources) if isinstance(resource, dict)]
+    predicate = search_param.predicate(value)
+    return [position for position in postings if predicate(resources[position])]
+
+
+def chain_lookup(index: FHIRIndex, resource_type: str, name: str, value: str) -> List[int]:
+    """
+    Positions of resource_type resources whose reference parameter points at
+    a target matching the rest of the chain (Encounter?patient.family=x: the
+    Patients matching family=x, joined through the Encounter.patient postings)
+    """
+    param, target, rest = parse_chain(resource_type, name)
+    if "." in rest:
+        targets = chain_lookup(index, target, rest, value)
+    else:
+        targets = match_positions(index, target, rest, value)
+    resources = index.data.get(target, [])
+    target_ids = dict.fromkeys(resource_body(resources[position]).get("id") for position in targets)
+    return union_postings([
+        _postings(index, resource_type, param, f"{target}/{target_id}") for target_id in target_ids if target_id
+    ])
+
+
+def has_lookup(index: FHIRIndex, resource_type: str, name: str, value: str) -> List[int]:
+    """
+    Positions of resource_type resources referenced by the sources matching a
+    reverse chain (Patient?_has:Condition:patient:code=x: the Conditions with
+    code=x, mapped back through their patient references). Only the matched
+    sources' references are read.
+    """
+    source, param, rest = parse_has(resource_type, name)
+    references = index.references.get((source, param), {})
+    prefix = f"{resource_type}/"
+    positions = set()
+    for source_position in match_positions(index, source, rest, value):
+        for reference in references.get(source_position, []):
+            if reference.startswith(prefix):
+                position = index.position(resource_type, reference[len(prefix):])
+                if position is not None:
+                    positions.add(position)
+    return sorted(positions)
+
+
+class PlanStep:
+    """One executed step with its estimated and actual output rows"""
+
+    __slots__ = ("operation", "detail", "estimated", "actual", "examined", "seconds")
+
+    def __init__(self, operation: str, detail: str, estimated: Optional[int], actual: int,
+                 examined: int, seconds: float):
+        self.operation = operation
+        self.detail = detail
+        self.estimated = estimated
+        self.actual = actual
+        self.examined = examined
+        self.seconds = seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "operation": self.operation,
+            "detail": self.detail,
+            "estimated_rows": self.estimated,
+            "actual_rows": self.actual,
+            "rows_examined": self.examined,
+            "ms": round(self.seconds * 1000, 3),
+        }
+
+
+class SearchPlan:
+    """Index candidates for a search, their intersection order and the executed steps"""
+
+    def __init__(self, index: FHIRIndex, resource_type: str, filters: Dict[str, str],
+                 required: frozenset = frozenset()):
+        self.index = index
+        self.resource_type = resource_type
+        self.rows = len(index.data.get(resource_type, []))
+        self.filters = filters
+        # parameters only their index can answer, so they are never skipped
+        self.required = required
+        # (param, value, posting list) for every indexed parameter, most selective first
+        self.candidates = []
+        self.unindexed: List[str] = []
+        # parameters whose index actually narrowed the candidates
+        self.applied: List[str] = []
+        self.steps: List[PlanStep] = []
+
+        for param, value in filters.items():
+            postings = index_lookup(index, resource_type, param, value)
+            if postings is None:
+                self.unindexed.append(param)
+            else:
+                self.candidates.append((param, value, postings))
+        self.candidates.sort(key=lambda candidate: len(candidate[2]))
+
+    def execute(self) -> Optional[List[int]]:
+        """Intersect the candidate posting lists; None means a full scan is needed"""
+        started = time.perf_counter()
+        if not self.candidates:
+            self.add_step("scan", self.resource_type, self.rows, self.rows, 0, started)
+            return None
+
+        param, value, positions = self.candidates[0]
+        self.applied.append(param)
+        self.add_step("index", f"{index_name(self.index, self.resource_type, param)} = {value}",
+                      len(positions), len(positions), 0, started)
+        estimate = float(len(positions))
+
+        for param, value, postings in self.candidates[1:]:
+            started = time.perf_counter()
+            name = index_name(self.index, self.resource_type, param)
+            # Independence assumption: each parameter keeps its own fraction of the rows
+            estimate = estimate * len(postings) / self.rows if self.rows else 0.0
+            if not positions:
+                break
+            if param not in self.required and len(postings) > INTERSECT_RATIO * len(positions):
+                self.add_step("skip", f"{name} = {value} ({len(postings)} rows, left to the filter)",
+                              None, len(positions), 0, started)
+                continue
+            members = set(postings)
+            examined = len(positions)
+            positions = [position for position in positions if position in members]
+            self.applied.append(param)
+            self.add_step("intersect", f"{name} = {value}", round(estimate), len(positions), examined, started)
+
+        return positions
+
+    def add_step(self, operation: str, detail: str, estimated: Optional[int], actual: int,
+                 examined: int, started: float):
+        self.steps.append(PlanStep(operation, detail, estimated, actual, examined, time.perf_counter() - started))
+
+    def to_dict(self) -> Dict[str, Any]:
+        candidates = []
+        for param, value, postings in self.candidates:
+            statistics = self.index.statistics.get((self.resource_type, param))
+            candidates.append({
+                "param": param,
+                "value": value,
+                "index": index_name(self.index, self.resource_type, param),
+                "estimated_rows": len(postings),
+                "selectivity": round(len(postings) / self.rows, 6) if self.rows else 0.0,
+                "statistics": statistics,
+            })
+        return {
+            "resource_type": self.resource_type,
+            "rows": self.rows,
+            "candidate_indexes": candidates,
+            "intersection_order": [param for param, _, _ in self.candidates],
+            "steps": [step.to_dict() for step in self.steps],
+        }
+
+
+def plan_search(index: FHIRIndex, resource_type: str, filters: Dict[str, Optional[str]],
+                required: frozenset = frozenset()) -> SearchPlan:
+    """Plan a search over indexed filters (empty values are ignored)"""
+    return SearchPlan(index, resource_type, {param: value for param, value in filters.items() if value}, required)
+
+
+def _sort_ranks(index: FHIRIndex, resource_type: str, param: str, descending: bool,
+                positions: List[int]) -> Dict[int, int]:
+    """Rank per position: the presorted ranks, or ranks computed over positions for other keys"""
+    ranks = index.sort_ranks.get((resource_type, param, descending))
+    if ranks is not None:
+        return ranks
+    resources = index.data[resource_type]
+    extract = SEARCH_PARAMETERS[resource_type][param].sort_values
+    _, local = presort([extract(resources[position]) for position in positions])[descending]
+    return dict(zip(positions, local))
+
+
+def sort_positions(index: FHIRIndex, resource_type: str, positions: Optional[List[int]],
+                   keys: List[Tuple[str, bool]], limit: Optional[int] = None) -> Tuple[List[int], str]:
+    """
+    Order matched positions (None: every resource of the type) by _sort keys
+    of (param, descending), keeping the first `limit`. Returns the positions
+    and the strategy used:
+    - walk: read the presorted ordering of a single key, keeping matches,
+      when limit * rows < matches^2 (the walk is expected to stop early)
+    - top-k: a bounded heap over the matches' ranks when there is a limit
+    - sort: a full sort of the matches by rank
+    Each is stable, so ties keep load order.
+    """
+    ordering = index.orderings.get((resource_type, keys[0][0], keys[0][1])) if len(keys) == 1 else None
+    if positions is None:
+        if ordering is not None:
+            return list(ordering[:limit] if limit else ordering), "walk"
+        resources = index.data.get(resource_type, [])
+        positions = [position for position, resource in enumerate(resources) if isinstance(resource, dict)]
+
+    rows = len(index.data.get(resource_type, []))
+    if ordering is not None and limit and limit * rows < len(positions) ** 2:
+        members = set(positions)
+        walked = []
+        for position in ordering:
+            if position in members:
+                walked.append(position)
+                if len(walked) == limit:
+                    break
+        return walked, "walk"
+
+    ranks = [_sort_ranks(index, resource_type, param, descending, positions) for param, descending in keys]
+    if len(ranks) == 1:
+        key = ranks[0].__getitem__
+    else:
+        key = lambda position: tuple(rank[position] for rank in ranks)
+    if limit and limit < len(positions):
+        return heapq.nsmallest(limit, positions, key=key), "top-k"
+    return sorted(positions, key=key), "sort"
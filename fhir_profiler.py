@@ -0,0 +1,180 @@
+"""
+On-demand sampling profiler for the running server
+
+A background thread snapshots every thread's Python stack with
+sys._current_frames() at a fixed interval. Nothing is hooked into the
+interpreter (no sys.setprofile / sys.settrace), so an idle profiler costs
+nothing beyond one attribute check when scans are offloaded.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional, List, Dict, Callable, Tuple
+
+# Leaf frames of threads that are waiting rather than working
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    # uvloop waits for events in C, below asyncio.run()
+    ("runners.py", "run"),
+    ("thread.py", "_worker"),
+    ("threading.py", "wait"),
+}
+
+Frame = Tuple[str, str, int]
+
+
+class ProfilerBusy(RuntimeError):
+    """A profile is already being collected"""
+
+
+def _frame_key(code) -> Frame:
+    return code.co_name, code.co_filename, code.co_firstlineno
+
+
+def _frame_label(frame: Frame) -> str:
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class Profile:
+    """Aggregated samples of one profiling run"""
+
+    def __init__(self, stacks: Counter, samples: int, duration: float, interval: float, route: Optional[str]):
+        # root-first stack of frames -> number of samples
+        self.stacks = stacks
+        self.samples = samples
+        self.duration = duration
+        self.interval = interval
+        self.route = route
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed-stack format (flamegraph.pl, speedscope, inferno)"""
+        lines = [
+            ";".join(_frame_label(frame) for frame in stack) + f" {count}"
+            for stack, count in self.stacks.most_common()
+        ]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def speedscope(self) -> Dict:
+        """speedscope 'sampled' profile (https://www.speedscope.app)"""
+        frames: Dict[Frame, int] = {}
+        samples, weights = [], []
+        for stack, count in self.stacks.most_common():
+            samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+            weights.append(count * self.interval)
+
+        name = f"fhir_api {self.route or 'all routes'}"
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {
+                "frames": [
+                    {"name": frame[0], "file": frame[1], "line": frame[2]}
+                    for frame in frames
+                ]
+            },
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": name,
+            "activeProfileIndex": 0,
+            "exporter": "fhir_api",
+        }
+
+
+class SamplingProfiler:
+    """
+    Samples Python stacks of all threads while a profile is running.
+
+    With a route filter, event-loop samples are attributed to a route by the
+    endpoint function found on the stack; work handed to executor threads is
+    attributed through attributed().
+    """
+
+    def __init__(self):
+        self.active = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_routes: Dict[int, str] = {}
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._started = 0.0
+        self._interval = 0.0
+        self._route: Optional[str] = None
+        self._endpoints: Dict[object, str] = {}
+
+    def start(self, interval: float, endpoints: Dict[object, str], route: Optional[str] = None):
+        """
+        Begin sampling every `interval` seconds. `endpoints` maps endpoint code
+        objects to route templates; with `route` set only its samples are kept.
+        """
+        with self._lock:
+            if self.active:
+                raise ProfilerBusy("A profile is already running")
+            self.active = True
+        self._stop.clear()
+        self._stacks = Counter()
+        self._samples = 0
+        self._interval = interval
+        self._route = route
+        self._endpoints = endpoints
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="fhir-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Profile:
+        """Stop sampling and return the aggregated profile"""
+        self._stop.set()
+        self._thread.join()
+        profile = Profile(self._stacks, self._samples, time.perf_counter() - self._started,
+                          self._interval, self._route)
+        self._thread = None
+        self._endpoints = {}
+        with self._lock:
+            self.active = False
+        return profile
+
+    def attributed(self, route: Optional[str], func: Callable) -> Callable:
+        """Wrap work for an executor thread so its samples count towards route"""
+        def call():
+            ident = threading.get_ident()
+            self._thread_routes[ident] = route
+            try:
+                return func()
+            finally:
+                self._thread_routes.pop(ident, None)
+        return call
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self._interval):
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self._sample(ident, frame)
+
+    def _sample(self, ident: int, frame):
+        stack: List[Frame] = []
+        route = self._thread_routes.get(ident)
+        while frame is not None:
+            code = frame.f_code
+            if route is None:
+                route = self._endpoints.get(code)
+            stack.append(_frame_key(code))
+            frame = frame.f_back
+
+        leaf = stack[0]
+        if (os.path.basename(leaf[1]), leaf[0]) in IDLE_FRAMES:
+            return
+        if self._route is not None and route != self._route:
+            return
+        stack.reverse()
+        self._stacks[tuple(stack)] += 1
+        self._samples += 1
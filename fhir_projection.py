@@ -0,0 +1,145 @@
+"""
+_summary and _elements projections of FHIR resources
+"""
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple, FrozenSet
+
+SUMMARY_MODES = ("true", "text", "data", "count", "false")
+
+# Elements always kept in a subsetted resource
+MANDATORY_ELEMENTS = ("resourceType", "id", "meta")
+
+# Top-level elements flagged isSummary in FHIR R4 ("x[x]" matches any choice type)
+SUMMARY_ELEMENTS = {
+    "Patient": ["identifier", "active", "name", "telecom", "gender", "birthDate", "deceased[x]",
+                "address", "managingOrganization", "link"],
+    "Organization": ["identifier", "active", "type", "name", "partOf"],
+    "Coverage": ["identifier", "status", "type", "policyHolder", "subscriber", "subscriberId",
+                 "beneficiary", "dependent", "period", "payor", "order", "network"],
+    "Encounter": ["identifier", "status", "class", "type", "serviceType", "subject", "episodeOfCare",
+                  "participant", "appointment", "reasonCode", "reasonReference", "diagnosis"],
+    "Condition": ["identifier", "clinicalStatus", "verificationStatus", "severity", "code", "bodySite",
+                  "subject", "encounter", "onset[x]", "abatement[x]", "recordedDate", "recorder", "asserter"],
+    "Procedure": ["identifier", "instantiatesCanonical", "instantiatesUri", "basedOn", "partOf", "status",
+                  "statusReason", "category", "code", "subject", "encounter", "performed[x]", "recorder",
+                  "asserter", "performer", "location", "reasonCode", "reasonReference", "bodySite", "outcome"],
+    "Observation": ["identifier", "basedOn", "partOf", "status", "code", "subject", "focus", "encounter",
+                    "effective[x]", "issued", "performer", "value[x]", "hasMember", "derivedFrom", "component"],
+    "Practitioner": ["identifier", "active", "name", "telecom", "address", "gender", "birthDate"],
+    "PractitionerRole": ["identifier", "active", "period", "practitioner", "organization", "code", "specialty",
+                         "location", "telecom"],
+    "DocumentReference": ["masterIdentifier", "identifier", "status", "docStatus", "type", "category", "subject",
+                          "date", "author", "relatesTo", "description", "securityLabel", "content", "context"],
+    "Consent": ["identifier", "status", "scope", "category", "patient", "dateTime", "performer", "organization",
+                "source[x]", "policyRule", "verification", "provision"],
+    "Binary": ["contentType", "securityContext"],
+    "Provenance": ["target", "recorded"],
+    "Appointment": ["identifier", "status", "serviceCategory", "serviceType", "specialty", "appointmentType",
+                    "reasonCode", "start", "end", "participant"],
+}
+
+SUBSETTED_TAG = {
+    "system": "http://terminology.hl7.org/CodeSystem/v3-ObservationValue",
+    "code": "SUBSETTED",
+    "display": "Resource encoded in summary mode"
+}
+
+
+class ProjectionError(ValueError):
+    """Invalid _summary / _elements combination"""
+
+
+def parse_projection(summary: Optional[str], elements: Optional[str]) -> Tuple[Optional[str], Optional[FrozenSet[str]]]:
+    """Validate _summary / _elements values, returning (summary mode, element set)"""
+    if summary is not None:
+        summary = summary.strip().lower()
+        if summary not in SUMMARY_MODES:
+            raise ProjectionError(f"Unsupported _summary value '{summary}' (expected one of {', '.join(SUMMARY_MODES)})")
+        if summary == "false":
+            summary = None
+
+    element_set = None
+    if elements:
+        element_set = frozenset(e.strip() for e in elements.split(",") if e.strip())
+        if summary is not None and summary != "count":
+            raise ProjectionError("_summary and _elements cannot be combined")
+
+    return summary, element_set
+
+
+def _element_matches(key: str, names: List[str]) -> bool:
+    for name in names:
+        if name.endswith("[x]"):
+            stem = name[:-3]
+            if key.startswith(stem) and key[len(stem):len(stem) + 1].isupper():
+                return True
+        elif key == name:
+            return True
+    return False
+
+
+def _subsetted_meta(resource: Dict) -> Dict:
+    meta = dict(resource.get("meta") or {})
+    meta["tag"] = list(meta.get("tag", [])) + [SUBSETTED_TAG]
+    return meta
+
+
+def project(resource: Dict, summary: Optional[str], elements: Optional[FrozenSet[str]]) -> Dict:
+    """Return a projected copy of a resource (the original is never modified)"""
+    resource_type = resource.get("resourceType", "")
+
+    if elements is not None:
+        keep = lambda key: key in MANDATORY_ELEMENTS or key in elements
+    elif summary == "true":
+        names = SUMMARY_ELEMENTS.get(resource_type)
+        if names is None:
+            return resource
+        keep = lambda key: key in MANDATORY_ELEMENTS or _element_matches(key, names)
+    elif summary == "text":
+        keep = lambda key: key in MANDATORY_ELEMENTS or key == "text"
+    elif summary == "data":
+        keep = lambda key: key != "text"
+    else:
+        return resource
+
+    projected = {key: value for key, value in resource.items() if keep(key)}
+    if summary != "data":
+        projected["meta"] = _subsetted_meta(resource)
+    return projected
+
+
+class ProjectionCache:
+    """LRU of projected resources keyed by (type, id, mode)"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def project(self, resource: Dict, summary: Optional[str], elements: Optional[FrozenSet[str]]) -> Dict:
+        if summary is None and elements is None:
+            return resource
+        key = (resource.get("resourceType"), resource.get("id"), summary, elements)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        projected = project(resource, summary, elements)
+        with self._lock:
+            self._entries[key] = projected
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return projected
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,40 @@
+"""
+Slow-query log: one JSON object per line, written to a rotating file by a
+background thread so request handling never waits on disk I/O
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+from typing import Dict, Any
+
+
+class SlowQueryLog:
+    """Queue-backed logger for requests slower than a threshold"""
+
+    def __init__(self, path: str, threshold_seconds: float, max_bytes: int, backups: int):
+        self.path = path
+        self.threshold = threshold_seconds
+        self.logged = 0
+
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(records, handler)
+
+        self._logger = logging.getLogger("fhir_api.slow_queries")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.addHandler(logging.handlers.QueueHandler(records))
+
+        self._listener.start()
+        # Flush queued entries on interpreter exit
+        atexit.register(self._listener.stop)
+
+    def record(self, entry: Dict[str, Any]):
+        """Queue an entry; the listener thread writes it"""
+        self.logged += 1
+        self._logger.info(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
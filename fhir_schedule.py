@@ -0,0 +1,367 @@
+"""
+Practitioner and Location schedules, free Slots and Appointment $find
+
+Every Practitioner and Location (from the Practitioner resources,
+PractitionerRole and Appointment participants) gets a Schedule whose working
+hours come from its PractitionerRole.availableTime, or the configured default
+week. The appointments that hold an actor's time are kept in a per-actor
+interval tree, so the free time in a window is found from the few bookings
+overlapping it however many years of calendar the actor has. Slots are not
+stored: they are cut from the working hours of the requested window on demand.
+"""
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+
+from fhir_index import extract_references, normalize_reference
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+# Participant types that have a schedule
+SCHEDULED_TYPES = ("Practitioner", "Location")
+
+# Appointments in these states do not hold their participants' time
+NON_BLOCKING_STATUSES = ("cancelled", "noshow", "entered-in-error", "waitlist")
+
+DAY_SECONDS = 86400
+
+# weekday (0 = Monday) -> [(start minute, end minute)] within the day
+WorkingHours = Dict[int, List[Tuple[int, int]]]
+
+
+def _minutes(value: str) -> int:
+    """Minutes since midnight of 'HH:MM' or 'HH:MM:SS' (24:00 is the end of the day)"""
+    parts = value.strip().split(":")
+    if len(parts) not in (2, 3) or not all(part.isdigit() for part in parts):
+        raise ValueError(f"Invalid time '{value}', expected HH:MM")
+    minutes = int(parts[0]) * 60 + int(parts[1])
+    if minutes > 1440 or int(parts[1]) > 59:
+        raise ValueError(f"Invalid time '{value}'")
+    return minutes
+
+
+def _weekdays(spec: str) -> List[int]:
+    """Weekday numbers of 'mon-fri' or 'mon,wed,fri'"""
+    days = []
+    for part in spec.lower().split(","):
+        first, _, last = part.strip().partition("-")
+        if first not in WEEKDAYS or (last and last not in WEEKDAYS):
+            raise ValueError(f"Invalid weekdays '{spec}', expected e.g. mon-fri")
+        start = WEEKDAYS.index(first)
+        stop = WEEKDAYS.index(last) if last else start
+        days.extend(range(start, stop + 1))
+    return days
+
+
+def _merged(intervals: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Sorted, non-overlapping union of [start, end) intervals"""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _intersected(first: List[Tuple[int, int]], second: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Intersection of two sorted lists of disjoint [start, end) intervals"""
+    common = []
+    i = j = 0
+    while i < len(first) and j < len(second):
+        low, high = max(first[i][0], second[j][0]), min(first[i][1], second[j][1])
+        if high > low:
+            common.append((low, high))
+        if first[i][1] < second[j][1]:
+            i += 1
+        else:
+            j += 1
+    return common
+
+
+def parse_working_hours(spec: str) -> WorkingHours:
+    """
+    Weekly working hours from 'mon-fri 08:00-17:00; sat 09:00-12:00'
+    (several ranges per day are comma-separated: 'mon 08:00-12:00,13:00-17:00')
+    """
+    hours: Dict[int, List[Tuple[int, int]]] = {}
+    for segment in spec.split(";"):
+        if not segment.strip():
+            continue
+        days, _, ranges = segment.strip().partition(" ")
+        if not ranges.strip():
+            raise ValueError(f"Invalid working hours '{segment.strip()}', expected e.g. 'mon-fri 08:00-17:00'")
+        for time_range in ranges.split(","):
+            start, _, end = time_range.partition("-")
+            block = (_minutes(start), _minutes(end))
+            for day in _weekdays(days):
+                hours.setdefault(day, []).append(block)
+    return {day: _merged(blocks) for day, blocks in hours.items()}
+
+
+def available_hours(roles: List[Dict]) -> Optional[WorkingHours]:
+    """Working hours from PractitionerRole.availableTime, or None when no role declares any"""
+    hours: Dict[int, List[Tuple[int, int]]] = {}
+    for role in roles:
+        for available in role.get("availableTime", []) or []:
+            if not isinstance(available, dict):
+                continue
+            try:
+                if available.get("allDay"):
+                    block = (0, 1440)
+                else:
+                    block = (_minutes(available.get("availableStartTime", "")),
+                             _minutes(available.get("availableEndTime", "")))
+            except ValueError:
+                continue
+            for day in available.get("daysOfWeek", []) or []:
+                if day in WEEKDAYS:
+                    hours.setdefault(WEEKDAYS.index(day), []).append(block)
+    if not hours:
+        return None
+    return {day: _merged(blocks) for day, blocks in hours.items()}
+
+
+def describe_hours(hours: WorkingHours) -> str:
+    """'mon 08:00-17:00; tue 08:00-17:00; ...' for Schedule.comment"""
+    def clock(minutes: int) -> str:
+        return f"{minutes // 60:02d}:{minutes % 60:02d}"
+    return "; ".join(
+        f"{WEEKDAYS[day]} " + ",".join(f"{clock(start)}-{clock(end)}" for start, end in hours[day])
+        for day in sorted(hours)
+    )
+
+
+def parse_time(value: str) -> int:
+    """Epoch seconds of an ISO date or dateTime (UTC when it has no offset)"""
+    parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def format_time(seconds: int) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_window(start: Optional[str], end: Optional[str], max_days: int) -> Tuple[int, int]:
+    """
+    [start, end) in epoch seconds: start defaults to today (UTC), end to a
+    week after start; windows longer than max_days are rejected
+    """
+    if start:
+        window_start = parse_time(start)
+    else:
+        today = datetime.now(timezone.utc).date()
+        window_start = int(datetime(today.year, today.month, today.day, tzinfo=timezone.utc).timestamp())
+    window_end = parse_time(end) if end else window_start + 7 * DAY_SECONDS
+    if window_end <= window_start:
+        raise ValueError("end must be after start")
+    if window_end - window_start > max_days * DAY_SECONDS:
+        raise ValueError(f"The search window is limited to {max_days} days")
+    return window_start, window_end
+
+
+class IntervalTree:
+    """
+    Static interval tree of half-open [start, end) intervals. The intervals,
+    sorted by start, form an implicit balanced binary tree (each range's
+    middle element is its root) and every node keeps the latest end in its
+    subtree, so subtrees that end before a window are skipped whole. A window
+    query costs O(log n + k) for the k intervals it returns.
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[int, int, Any]]):
+        items = sorted(intervals, key=lambda interval: (interval[0], interval[1]))
+        self.starts = [start for start, _, _ in items]
+        self.ends = [end for _, end, _ in items]
+        self.values = [value for _, _, value in items]
+        # latest end of the subtree rooted at each position
+        self.latest = [0] * len(items)
+        self._build(0, len(items))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def _build(self, low: int, high: int) -> int:
+        if low >= high:
+            return -1
+        mid = (low + high) // 2
+        latest = max(self.ends[mid], self._build(low, mid), self._build(mid + 1, high))
+        self.latest[mid] = latest
+        return latest
+
+    def overlapping(self, start: int, end: int) -> List[Tuple[int, int, Any]]:
+        """(start, end, value) of the intervals overlapping [start, end), by start"""
+        found: List[Tuple[int, int, Any]] = []
+        self._collect(0, len(self.starts), start, end, found)
+        return found
+
+    def _collect(self, low: int, high: int, start: int, end: int, found: List[Tuple[int, int, Any]]):
+        if low >= high:
+            return
+        mid = (low + high) // 2
+        if self.latest[mid] <= start:
+            # Everything below mid ends before the window
+            return
+        self._collect(low, mid, start, end, found)
+        if self.starts[mid] < end:
+            if self.ends[mid] > start:
+                found.append((self.starts[mid], self.ends[mid], self.values[mid]))
+            # Right of mid starts no earlier, so only worth visiting while mid starts inside the window
+            self._collect(mid + 1, high, start, end, found)
+
+
+def _booking(appointment: Dict) -> Optional[Tuple[int, int]]:
+    """[start, end) of an appointment that holds time, in epoch seconds"""
+    if appointment.get("status") in NON_BLOCKING_STATUSES or not appointment.get("start"):
+        return None
+    try:
+        start = parse_time(appointment["start"])
+        if appointment.get("end"):
+            end = parse_time(appointment["end"])
+        else:
+            end = start + int(appointment.get("minutesDuration") or 0) * 60
+    except (TypeError, ValueError):
+        return None
+    return (start, end) if end > start else None
+
+
+class Schedules:
+    """Schedule resources of every Practitioner and Location, with their bookings"""
+
+    def __init__(self, data: Dict[str, Any], default_hours: WorkingHours):
+        self.default_hours = default_hours
+        # actor reference -> weekly hours / booked appointments / Schedule resource
+        self.hours: Dict[str, WorkingHours] = {}
+        self.booked: Dict[str, IntervalTree] = {}
+        self.by_actor: Dict[str, Dict] = {}
+        # Schedule id -> actor reference
+        self.actors: Dict[str, str] = {}
+
+        roles: Dict[str, List[Dict]] = {}
+        actors: Dict[str, None] = {}
+        for practitioner in data.get("Practitioner", []) or []:
+            if isinstance(practitioner, dict) and practitioner.get("id"):
+                actors[f"Practitioner/{practitioner['id']}"] = None
+        for role in data.get("PractitionerRole", []) or []:
+            if not isinstance(role, dict):
+                continue
+            for reference in extract_references(role, ("practitioner",)) + extract_references(role, ("location",)):
+                actors[reference] = None
+                roles.setdefault(reference, []).append(role)
+
+        bookings: Dict[str, List[Tuple[int, int, str]]] = {}
+        for appointment in data.get("Appointment", []) or []:
+            if not isinstance(appointment, dict):
+                continue
+            references = extract_references(appointment, ("participant", "actor"), SCHEDULED_TYPES)
+            actors.update(dict.fromkeys(references))
+            booking = _booking(appointment)
+            if booking is None:
+                continue
+            for reference in references:
+                bookings.setdefault(reference, []).append((booking[0], booking[1], appointment.get("id")))
+
+        for reference in actors:
+            actor_type, _, actor_id = reference.partition("/")
+            schedule_id = f"{actor_type}-{actor_id}"
+            hours = available_hours(roles.get(reference, [])) or default_hours
+            self.hours[reference] = hours
+            self.booked[reference] = IntervalTree(bookings.get(reference, []))
+            self.actors[schedule_id] = reference
+            self.by_actor[reference] = {
+                "resourceType": "Schedule",
+                "id": schedule_id,
+                "active": True,
+                "actor": [{"reference": reference}],
+                "comment": f"Working hours (UTC): {describe_hours(hours)}",
+            }
+
+    @property
+    def schedules(self) -> List[Dict]:
+        return list(self.by_actor.values())
+
+    def actor(self, schedule: str) -> Optional[str]:
+        """Actor reference of a Schedule id or 'Schedule/id' reference"""
+        return self.actors.get(schedule.replace("Schedule/", ""))
+
+    def resolve(self, actor: str, actor_type: str) -> Optional[str]:
+        """Scheduled actor reference for an id or 'Type/id' of actor_type, None if it has no schedule"""
+        reference = normalize_reference(actor) if "/" in actor else f"{actor_type}/{actor}"
+        return reference if reference in self.by_actor else None
+
+    def working(self, reference: str, start: int, end: int) -> List[Tuple[int, int]]:
+        """The actor's working blocks clipped to [start, end)"""
+        hours = self.hours[reference]
+        blocks = []
+        day = start - start % DAY_SECONDS
+        while day < end:
+            weekday = datetime.fromtimestamp(day, timezone.utc).weekday()
+            for block_start, block_end in hours.get(weekday, []):
+                low, high = max(day + block_start * 60, start), min(day + block_end * 60, end)
+                if high > low:
+                    blocks.append((low, high))
+            day += DAY_SECONDS
+        return blocks
+
+    def busy(self, references: List[str], start: int, end: int) -> List[Tuple[int, int]]:
+        """Union of the actors' booked time overlapping [start, end)"""
+        return _merged(
+            (booked_start, booked_end)
+            for reference in references
+            for booked_start, booked_end, _ in self.booked[reference].overlapping(start, end)
+        )
+
+    def free(self, references: List[str], start: int, end: int, minutes: int) -> List[Tuple[int, int]]:
+        """
+        [start, end) of the slots of `minutes` in [start, end) when every
+        actor works and none is booked, on a grid from the start of each
+        shared working block
+        """
+        length = minutes * 60
+        blocks = self.working(references[0], start, end)
+        for reference in references[1:]:
+            blocks = _intersected(blocks, self.working(reference, start, end))
+        busy = self.busy(references, start, end)
+        slots = []
+        cursor = 0
+        for block_start, block_end in blocks:
+            slot = block_start
+            while slot + length <= block_end:
+                while cursor < len(busy) and busy[cursor][1] <= slot:
+                    cursor += 1
+                if cursor < len(busy) and busy[cursor][0] < slot + length:
+                    # Booked: resume at the first grid point after the booking
+                    slot += -(-(busy[cursor][1] - slot) // length) * length
+                    continue
+                slots.append((slot, slot + length))
+                slot += length
+        return slots
+
+    def slot(self, reference: str, start: int, end: int, status: str) -> Dict:
+        """Slot resource on the actor's Schedule"""
+        schedule_id = self.by_actor[reference]["id"]
+        stamp = datetime.fromtimestamp(start, timezone.utc).strftime("%Y%m%d%H%M")
+        return {
+            "resourceType": "Slot",
+            "id": f"{schedule_id}-{stamp}-{(end - start) // 60}",
+            "schedule": {"reference": f"Schedule/{schedule_id}"},
+            "status": status,
+            "start": format_time(start),
+            "end": format_time(end),
+        }
+
+    def slots(self, reference: str, start: int, end: int, minutes: int, status: Optional[str]) -> List[Dict]:
+        """Free slots of `minutes` and/or busy slots (one per booking) of the actor in [start, end), by start"""
+        found = []
+        if status in (None, "free"):
+            found.extend((slot_start, slot_end, "free") for slot_start, slot_end in self.free([reference], start, end, minutes))
+        if status in (None, "busy"):
+            found.extend(
+                (booked_start, booked_end, "busy")
+                for booked_start, booked_end, _ in self.booked[reference].overlapping(start, end)
+            )
+        found.sort()
+        return [self.slot(reference, slot_start, slot_end, slot_status) for slot_start, slot_end, slot_status in found]
@@ -0,0 +1,939 @@
+"""
+Declarative FHIR search parameters and the predicates compiled from them
+
+Every searchable parameter is declared once per resource type with a
+FHIRPath-like expression and a type (token, reference, date, string,
+quantity). A search is compiled once per parameter signature, i.e. resource
+type plus the set of parameter names, into index lookups and an ordered list
+of predicate factories; only the values are bound per request.
+"""
+import functools
+import re
+from datetime import date, datetime, timezone
+from typing import Optional, List, Dict, Any, Callable, Tuple
+
+from fhir_index import REFERENCE_PARAMS, normalize_reference, resource_body
+
+PARAMETER_TYPES = ("token", "reference", "date", "string", "quantity")
+
+# Parameter types a search can be sorted by (_sort)
+SORTABLE_TYPES = ("token", "date", "string")
+
+# _sort keys kept as presorted orderings; other sortable parameters are ranked per request
+PRESORTED_PARAMS = ("date", "status", "code")
+
+# Predicates run cheapest first
+PREDICATE_COST = {"token": 0, "reference": 1, "date": 2, "quantity": 2, "string": 3}
+
+DATE_PREFIXES = ("ge", "le", "gt", "lt", "eq")
+DATE_COMPARATORS = {
+    "ge": lambda stored, bound: stored >= bound,
+    "le": lambda stored, bound: stored <= bound,
+    "gt": lambda stored, bound: stored > bound,
+    "lt": lambda stored, bound: stored < bound,
+    "eq": lambda stored, bound: stored == bound,
+}
+
+QUANTITY_PREFIXES = ("eq", "ne", "gt", "lt", "ge", "le", "ap")
+
+_SEGMENT = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)(?:\[(\d+)\])?$")
+
+# Commas separate OR values unless escaped as '\,'
+_OR_SEPARATOR = re.compile(r"(?<!\\),")
+
+
+def _step(name: str, position: Optional[int], inner: Optional[Callable]) -> Callable:
+    """
+    One path segment: read name from a dict node (all list items, or item
+    [position]) and pass it on, or collect it when this is the last segment
+    """
+    if inner is None:
+        if position is None:
+            def step(node: Any, found: List[Any]):
+                if isinstance(node, dict):
+                    value = node.get(name)
+                    if isinstance(value, list):
+                        found.extend(value)
+                    elif value is not None:
+                        found.append(value)
+        else:
+            def step(node: Any, found: List[Any]):
+                if isinstance(node, dict):
+                    value = node.get(name)
+                    if isinstance(value, list):
+                        if position < len(value):
+                            found.append(value[position])
+                    elif value is not None and not position:
+                        found.append(value)
+    elif position is None:
+        def step(node: Any, found: List[Any]):
+            if isinstance(node, dict):
+                value = node.get(name)
+                if isinstance(value, list):
+                    for item in value:
+                        inner(item, found)
+                elif value is not None:
+                    inner(value, found)
+    else:
+        def step(node: Any, found: List[Any]):
+            if isinstance(node, dict):
+                value = node.get(name)
+                if isinstance(value, list):
+                    if position < len(value):
+                        inner(value[position], found)
+                elif value is not None and not position:
+                    inner(value, found)
+    return step
+
+
+def _compile_steps(steps: Tuple[Tuple[str, Optional[int]], ...]) -> Callable:
+    """Chain the segments of one path into a single (node, found) callable"""
+    call = None
+    for name, position in reversed(steps):
+        call = _step(name, position, call)
+    return call or (lambda node, found: found.append(node))
+
+
+def _parse_path(expression: str) -> Tuple[Optional[str], List[Tuple[Tuple[str, Optional[int]], ...]]]:
+    """(leading resource type or None, (name, [n]) steps of each '|' branch)"""
+    resource_types = set()
+    branches = []
+    for branch in expression.split("|"):
+        segments = branch.strip().split(".")
+        if segments and segments[0][:1].isupper():
+            resource_types.add(segments[0])
+            segments = segments[1:]
+        steps = []
+        for segment in segments:
+            match = _SEGMENT.match(segment)
+            if not match:
+                raise ValueError(f"Unsupported path segment '{segment}' in '{expression}'")
+            steps.append((match.group(1), int(match.group(2)) if match.group(2) is not None else None))
+        branches.append(tuple(steps))
+    resource_type = resource_types.pop() if len(resource_types) == 1 else None
+    return resource_type, branches
+
+
+def compile_path(expression: str) -> Callable[[Dict], List[Any]]:
+    """
+    Compile a FHIRPath-like expression into an extractor returning the
+    matching nodes. Supports dotted paths (descending into lists), [n]
+    indexing and '|' unions; a leading resource type is ignored, e.g.
+    'Condition.category.coding[0].code | Condition.code.coding.code'.
+    """
+    _, branches = _parse_path(expression)
+    compiled = tuple(_compile_steps(steps) for steps in branches)
+
+    def extract(resource: Dict) -> List[Any]:
+        found: List[Any] = []
+        body = resource_body(resource)
+        for branch in compiled:
+            branch(body, found)
+        return found
+
+    return extract
+
+
+# Stand-in for a missing parent object in _direct_matcher
+_NO_NODE: Dict = {}
+
+
+def _match_leaf(name: str, position: Optional[int], test: Optional[Callable[[str], bool]],
+                wanted: Optional[str]) -> Callable[[Dict], bool]:
+    """
+    Last path segment of a matcher: whether a string at name passes test,
+    or equals wanted (compared inline, without a call per value)
+    """
+    if wanted is not None:
+        if position is None:
+            def step(node: Dict) -> bool:
+                value = node.get(name)
+                if value.__class__ is list:
+                    return wanted in value
+                return value == wanted
+        else:
+            def step(node: Dict) -> bool:
+                value = node.get(name)
+                if value.__class__ is list:
+                    return position < len(value) and value[position] == wanted
+                return not position and value == wanted
+    elif position is None:
+        def step(node: Dict) -> bool:
+            value = node.get(name)
+            if value.__class__ is list:
+                for item in value:
+                    if item.__class__ is str and item and test(item):
+                        return True
+                return False
+            return value.__class__ is str and value != "" and test(value)
+    else:
+        def step(node: Dict) -> bool:
+            value = node.get(name)
+            if value.__class__ is list:
+                if position >= len(value):
+                    return False
+                value = value[position]
+            elif position:
+                return False
+            return value.__class__ is str and value != "" and test(value)
+    return step
+
+
+def _match_step(name: str, position: Optional[int], inner: Callable[[Dict], bool]) -> Callable[[Dict], bool]:
+    """Inner path segment of a matcher: whether any dict at name matches inner"""
+    if position is None:
+        def step(node: Dict) -> bool:
+            value = node.get(name)
+            if value.__class__ is list:
+                for item in value:
+                    if item.__class__ is dict and inner(item):
+                        return True
+                return False
+            return value.__class__ is dict and inner(value)
+    else:
+        def step(node: Dict) -> bool:
+            value = node.get(name)
+            if value.__class__ is list:
+                if position >= len(value):
+                    return False
+                value = value[position]
+            elif position:
+                return False
+            return value.__class__ is dict and inner(value)
+    return step
+
+
+def _direct_matcher(steps: Tuple[Tuple[str, Optional[int]], ...], test: Optional[Callable[[str], bool]],
+                    wanted: Optional[str], needle: Optional[str],
+                    general: Callable[[Dict], bool]) -> Callable[[Dict], bool]:
+    """
+    Matcher for a one- or two-segment path without [n] (Encounter.class.code,
+    Observation.effectiveDateTime): the single value is read with inline
+    .get calls and compared in place. Anything but a string there (a list,
+    null, a non-object parent) hands the resource to the general matcher.
+    """
+    if len(steps) == 1:
+        (name, _), = steps
+    else:
+        (parent, _), (name, _) = steps
+
+    if len(steps) == 1 and wanted is not None:
+        def match(resource: Dict) -> bool:
+            value = resource.get(name, "")
+            if value.__class__ is str:
+                return value == wanted
+            return general(resource)
+    elif len(steps) == 1 and needle is not None:
+        def match(resource: Dict) -> bool:
+            value = resource.get(name, "")
+            if value.__class__ is str:
+                return needle in value
+            return general(resource)
+    elif len(steps) == 1:
+        def match(resource: Dict) -> bool:
+            value = resource.get(name, "")
+            if value.__class__ is str:
+                return value != "" and test(value)
+            return general(resource)
+    elif wanted is not None:
+        def match(resource: Dict) -> bool:
+            try:
+                value = resource.get(parent, _NO_NODE).get(name, "")
+            except AttributeError:
+                return general(resource)
+            if value.__class__ is str:
+                return value == wanted
+            return general(resource)
+    elif needle is not None:
+        def match(resource: Dict) -> bool:
+            try:
+                value = resource.get(parent, _NO_NODE).get(name, "")
+            except AttributeError:
+                return general(resource)
+            if value.__class__ is str:
+                return needle in value
+            return general(resource)
+    else:
+        def match(resource: Dict) -> bool:
+            try:
+                value = resource.get(parent, _NO_NODE).get(name, "")
+            except AttributeError:
+                return general(resource)
+            if value.__class__ is str:
+                return value != "" and test(value)
+            return general(resource)
+    return match
+
+
+def compile_matcher(expression: str, test: Optional[Callable[[str], bool]] = None,
+                    wanted: Optional[str] = None, needle: Optional[str] = None) -> Callable[[Dict], bool]:
+    """
+    Compile a path expression (as compile_path) straight into a predicate:
+    whether any non-empty string it reaches passes test, equals wanted or
+    contains needle. The path is walked with early exit and no intermediate
+    lists; the Patient data envelope is only looked for when the expression
+    may address a Patient.
+    """
+    resource_type, branches = _parse_path(expression)
+    if not all(branches):
+        # A bare leading type addresses the resource itself, which is never a string
+        return lambda resource: False
+    if needle is not None and wanted is None:
+        test = lambda value: needle in value
+    enveloped = resource_type is None or resource_type == "Patient"
+    matchers = []
+    for steps in branches:
+        name, position = steps[-1]
+        step = _match_leaf(name, position, test, wanted)
+        for name, position in reversed(steps[:-1]):
+            step = _match_step(name, position, step)
+        if not enveloped and len(steps) <= 2 and all(position is None for _, position in steps):
+            step = _direct_matcher(steps, test, wanted, needle, step)
+        matchers.append(step)
+    match = any_of(matchers)
+    if enveloped:
+        return lambda resource: match(resource_body(resource))
+    return match
+
+
+def all_of(predicates: Tuple[Callable[[Dict], bool], ...]) -> Callable[[Dict], bool]:
+    """
+    Conjunction of predicates, without a generator per resource for the
+    common one- and two-predicate cases. A pair is also kept on the result
+    as .pair so the filter loops can test both inline.
+    """
+    if len(predicates) == 1:
+        return predicates[0]
+    if len(predicates) == 2:
+        first, second = predicates
+        match = lambda resource: first(resource) and second(resource)
+        match.pair = (first, second)
+        return match
+    return lambda resource: all(predicate(resource) for predicate in predicates)
+
+
+def any_of(predicates: List[Callable[[Dict], bool]]) -> Callable[[Dict], bool]:
+    """Disjunction of predicates (OR values), as all_of"""
+    if len(predicates) == 1:
+        return predicates[0]
+    if len(predicates) == 2:
+        first, second = predicates
+        return lambda resource: first(resource) or second(resource)
+    return lambda resource: any(predicate(resource) for predicate in predicates)
+
+
+def split_values(value: str) -> List[str]:
+    """Values of a comma-separated OR search ('booked,arrived'); empty items are dropped"""
+    return [item.replace("\\,", ",") for item in _OR_SEPARATOR.split(value) if item]
+
+
+def _strings(nodes: List[Any]) -> List[str]:
+    return [node for node in nodes if isinstance(node, str) and node]
+
+
+class SearchParameter:
+    """
+    One search parameter of a resource type.
+
+    index: 'exact' when an index answers it exactly (no predicate needed once
+    applied), 'superset' when the index only narrows candidates, 'only' when
+    the index defines the parameter (patient compartment), None otherwise.
+    match: 'exact' or 'contains' for references.
+    """
+
+    def __init__(self, name: str, type: str, expression: str, index: Optional[str] = None,
+                 target: Optional[str] = None, match: str = "exact",
+                 extract: Optional[Callable[[Dict], List[Any]]] = None):
+        if type not in PARAMETER_TYPES:
+            raise ValueError(f"Unknown search parameter type '{type}'")
+        self.name = name
+        self.type = type
+        self.expression = expression
+        self.index = index
+        self.target = target
+        self.match = match
+        self.extract = extract or compile_path(expression)
+        # Predicates walk the expression directly unless a custom extractor defines the values
+        self.compiled = extract is None
+
+    def matcher(self, test: Optional[Callable[[str], bool]] = None, wanted: Optional[str] = None,
+                needle: Optional[str] = None) -> Callable[[Dict], bool]:
+        """Predicate: whether any string value of the parameter passes test, equals wanted or contains needle"""
+        if self.compiled:
+            return compile_matcher(self.expression, test, wanted, needle)
+        extract = self.extract
+        if wanted is not None:
+            return lambda resource: wanted in extract(resource)
+        if needle is not None:
+            test = lambda value: needle in value
+        return lambda resource: any(test(value) for value in _strings(extract(resource)))
+
+    def values(self, resource: Dict) -> List[str]:
+        """String values of the parameter, as indexed for tokens"""
+        return list(dict.fromkeys(_strings(self.extract(resource))))
+
+    def texts(self, resource: Dict) -> List[str]:
+        """Lowercased string values, as string predicates compare them"""
+        return [text.lower() for text in _strings(self.extract(resource))]
+
+    def days(self, resource: Dict) -> List[Optional[int]]:
+        """Day ordinals of the stored dates (None where a date does not parse), for the date index"""
+        days = []
+        for stored in _strings(self.extract(resource)):
+            try:
+                days.append(parse_date(stored).toordinal())
+            except ValueError:
+                days.append(None)
+        return days
+
+    def sort_values(self, resource: Dict) -> List[Any]:
+        """Comparable values for _sort: instants for dates, case-folded strings, raw tokens"""
+        values = _strings(self.extract(resource))
+        if self.type == "date":
+            return [instant for instant in map(parse_instant, values) if instant is not None]
+        if self.type == "string":
+            return [value.casefold() for value in values]
+        return values
+
+    def predicate(self, value: str) -> Optional[Callable[[Dict], bool]]:
+        """Compile value into a predicate over resources (None for index-only parameters)"""
+        if self.index == "only":
+            return None
+        # value=a,b matches resources matching any of the values
+        return any_of([PREDICATE_BUILDERS[self.type](self, item) for item in split_values(value)])
+
+    def __repr__(self) -> str:
+        return f"SearchParameter({self.name!r}, {self.type!r}, {self.expression!r})"
+
+
+def _token_predicate(param: SearchParameter, value: str) -> Callable[[Dict], bool]:
+    return param.matcher(wanted=value)
+
+
+def reference_needle(param: SearchParameter, value: str) -> str:
+    """Substring a 'contains' reference must hold ('Organization/x' for typed parameters)"""
+    return f"{param.target}/{value.replace(param.target + '/', '')}" if param.target else value
+
+
+def _reference_predicate(param: SearchParameter, value: str) -> Callable[[Dict], bool]:
+    if param.match == "contains":
+        needle = reference_needle(param, value)
+        return param.matcher(needle=needle)
+    if param.target is None:
+        # Untyped references: 'Type/id' matches exactly, a bare id matches any type
+        if "/" in value:
+            wanted = normalize_reference(value)
+            return param.matcher(lambda reference: normalize_reference(reference) == wanted)
+        return param.matcher(lambda reference: reference.rpartition("/")[2] == value)
+    prefix = f"{param.target}/"
+    wanted = value.replace(prefix, "")
+    return param.matcher(lambda reference: reference.replace(prefix, "") == wanted)
+
+
+def parse_date(value: str):
+    """Calendar date of an ISO date or dateTime"""
+    if "T" in value:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).date()
+    return datetime.fromisoformat(value).date()
+
+
+def parse_instant(value: str) -> Optional[float]:
+    """POSIX timestamp of an ISO date or dateTime (UTC when it has no offset), None if invalid"""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def date_search(value: str) -> Tuple[Optional[str], Optional[date], str]:
+    """
+    Split a date search value into (prefix, bound, text): bound is set for
+    eq/ge/le/gt/lt with a valid date, otherwise text is matched as a substring
+    """
+    lowered = value.lower().strip()
+    if not lowered.startswith(DATE_PREFIXES):
+        return None, None, value
+    prefix, date_str = lowered[:2], lowered[2:]
+    try:
+        return prefix, datetime.fromisoformat(date_str).date(), date_str
+    except ValueError:
+        return prefix, None, date_str
+
+
+def date_matches(stored: str, value: str) -> bool:
+    """
+    FHIR date search: eq/ge/le/gt/lt prefixes compare calendar dates; other
+    values (e.g. '2025-11') match as a substring of the stored date
+    """
+    try:
+        stored_date = parse_date(stored)
+    except ValueError:
+        return value in stored
+    prefix, bound, text = date_search(value)
+    if bound is None:
+        return text in stored
+    return DATE_COMPARATORS[prefix](stored_date, bound)
+
+
+def _date_predicate(param: SearchParameter, value: str) -> Callable[[Dict], bool]:
+    prefix, bound, text = date_search(value)
+    if prefix is None:
+        # Without a prefix every stored date, parseable or not, is a substring match
+        return param.matcher(needle=value)
+    compare = DATE_COMPARATORS[prefix]
+
+    # date_matches with the search value parsed once
+    def test(stored: str) -> bool:
+        try:
+            stored_date = parse_date(stored)
+        except ValueError:
+            return value in stored
+        if bound is None:
+            return text in stored
+        return compare(stored_date, bound)
+
+    return param.matcher(test)
+
+
+def _string_predicate(param: SearchParameter, value: str) -> Callable[[Dict], bool]:
+    needle = value.lower()
+    return param.matcher(lambda text: needle in text.lower())
+
+
+def parse_quantity(value: str) -> Tuple[str, float, float, Optional[str], Optional[str]]:
+    """Split '[prefix]number[|system|code]' into (prefix, number, precision, system, code)"""
+    prefix = "eq"
+    if value[:2] in QUANTITY_PREFIXES:
+        prefix, value = value[:2], value[2:]
+    number, _, unit = value.partition("|")
+    system, _, code = unit.partition("|")
+    if not code and system:
+        system, code = "", system
+    decimals = len(number.partition(".")[2])
+    return prefix, float(number), 0.5 * 10 ** -decimals, system or None, code or None
+
+
+def _quantity_predicate(param: SearchParameter, value: str) -> Callable[[Dict], bool]:
+    extract = param.extract
+    try:
+        prefix, number, precision, system, code = parse_quantity(value)
+    except ValueError:
+        return lambda resource: False
+
+    def compare(stored: float) -> bool:
+        if prefix == "eq":
+            return number - precision <= stored < number + precision
+        if prefix == "ne":
+            return not number - precision <= stored < number + precision
+        if prefix == "ap":
+            return abs(stored - number) <= abs(number) * 0.1
+        return DATE_COMPARATORS[prefix](stored, number)
+
+    def matches(resource: Dict) -> bool:
+        for quantity in extract(resource):
+            if not isinstance(quantity, dict) or not isinstance(quantity.get("value"), (int, float)):
+                continue
+            if system and quantity.get("system") != system:
+                continue
+            if code and code not in (quantity.get("code"), quantity.get("unit")):
+                continue
+            if compare(quantity["value"]):
+                return True
+        return False
+
+    return matches
+
+
+PREDICATE_BUILDERS = {
+    "token": _token_predicate,
+    "reference": _reference_predicate,
+    "date": _date_predicate,
+    "string": _string_predicate,
+    "quantity": _quantity_predicate,
+}
+
+
+def _human_names(resource: Dict) -> List[str]:
+    """HumanName.text, or 'given family' when there is no text"""
+    return [
+        name.get("text", "") or f"{' '.join(name.get('given', []))} {name.get('family', '')}"
+        for name in resource_body(resource).get("name", []) if isinstance(name, dict)
+    ]
+
+
+def _given_names(resource: Dict) -> List[str]:
+    """All given names of each HumanName, space-separated"""
+    return [
+        " ".join(name.get("given", []))
+        for name in resource_body(resource).get("name", []) if isinstance(name, dict)
+    ]
+
+
+def _identifier_tokens(resource: Dict) -> List[str]:
+    """Identifier tokens: value, system|value (|value without a system) and system|"""
+    tokens = []
+    for identifier in resource_body(resource).get("identifier", []) or []:
+        if not isinstance(identifier, dict):
+            continue
+        system, value = identifier.get("system"), identifier.get("value")
+        if isinstance(value, str) and value:
+            tokens.append(value)
+            tokens.append(f"{system}|{value}" if system else f"|{value}")
+        if isinstance(system, str) and system:
+            tokens.append(f"{system}|")
+    return tokens
+
+
+def _target_types(resource: Dict) -> List[str]:
+    """Resource types of Provenance.target references"""
+    return [
+        reference.partition("/")[0]
+        for reference in _strings(_PROVENANCE_TARGETS(resource)) if "/" in reference
+    ]
+
+
+_PROVENANCE_TARGETS = compile_path("Provenance.target.reference")
+
+
+def _parameters(*params: SearchParameter) -> Dict[str, SearchParameter]:
+    return {param.name: param for param in params}
+
+
+def _id() -> SearchParameter:
+    return SearchParameter("_id", "token", "id", index="superset")
+
+
+def _identifier() -> SearchParameter:
+    return SearchParameter("identifier", "token", "identifier", index="exact", extract=_identifier_tokens)
+
+
+def _compartment() -> SearchParameter:
+    return SearchParameter("patient", "reference", "patient", index="only", target="Patient")
+
+
+# Search parameters per resource type
+SEARCH_PARAMETERS: Dict[str, Dict[str, SearchParameter]] = {
+    "Appointment": _parameters(
+        _id(),
+        _identifier(),
+        _compartment(),
+        SearchParameter("status", "token", "Appointment.status", index="exact"),
+        SearchParameter("date", "date", "Appointment.start", index="superset"),
+        SearchParameter("service-category", "token", "Appointment.serviceCategory.coding.code", index="exact"),
+        SearchParameter("actor", "reference", "Appointment.participant.actor.reference", index="exact"),
+        SearchParameter("practitioner", "reference", "Appointment.participant.actor.reference", index="exact",
+                        target="Practitioner"),
+        SearchParameter("location", "reference", "Appointment.participant.actor.reference", index="exact",
+                        target="Location"),
+    ),
+    "Condition": _parameters(
+        _id(),
+        _identifier(),
+        _compartment(),
+        SearchParameter("clinical-status", "token", "Condition.clinicalStatus.coding[0].code", index="exact"),
+        SearchParameter("category", "token", "Condition.category.coding[0].code", index="exact"),
+        SearchParameter("code", "token", "Condition.code.coding.code", index="exact"),
+    ),
+    "Consent": _parameters(
+        _id(),
+        _identifier(),
+        _compartment(),
+        SearchParameter("status", "token", "Consent.status", index="exact"),
+        SearchParameter("category", "token", "Consent.category.coding[0].code", index="exact"),
+    ),
+    "Coverage": _parameters(
+        _id(),
+        _identifier(),
+        _compartment(),
+    ),
+    "DocumentReference": _parameters(
+        _id(),
+        _identifier(),
+        _compartment(),
+        SearchParameter("status", "token", "DocumentReference.status", index="exact"),
+        SearchParameter("date", "date", "DocumentReference.date", index="superset"),
+        SearchParameter("type", "token", "DocumentReference.type.coding.code", index="exact"),
+    ),
+    "Encounter": _parameters(
+        _id(),
+        _identifier(),
+        _compartment(),
+        SearchParameter("organization", "reference", "Encounter.serviceProvider.reference | Encounter.payor.reference",
+                        target="Organization", match="contains"),
+        SearchParameter("status", "token", "Encounter.status", index="exact"),
+        SearchParameter("class", "token", "Encounter.class.code", index="exact"),
+        SearchParameter("date", "date", "Encounter.period.start", index="superset"),
+    ),
+    "Observation": _parameters(
+        _id(),
+        _identifier(),
+        _compartment(),
+        SearchParameter("encounter", "reference", "Observation.encounter.reference", index="superset", target="Encounter"),
+        SearchParameter("category", "token", "Observation.category.coding[0].code", index="exact"),
+        SearchParameter("code", "token", "Observation.code.coding.code", index="exact"),
+        SearchParameter("date", "date", "Observation.effectiveDateTime", index="superset"),
+        SearchParameter("value-quantity", "quantity", "Observation.valueQuantity | Observation.component.valueQuantity"),
+    ),
+    "Organization": _parameters(
+        _id(),
+        _identifier(),
+        SearchParameter("name", "string", "Organization.name | Organization.alias", index="superset"),
+        SearchParameter("address-city", "string", "Organization.address.city", index="superset"),
+        SearchParameter("address-state", "string", "Organization.address.state", index="superset"),
+    ),
+    "Patient": _parameters(
+        _id(),
+        _identifier(),
+        SearchParameter("name", "string", "Patient.name", index="superset", extract=_human_names),
+        SearchParameter("family", "string", "Patient.name.family", index="superset"),
+        SearchParameter("given", "string", "Patient.name.given", index="superset", extract=_given_names),
+        SearchParameter("birthdate", "date", "Patient.birthDate", index="superset"),
+        SearchParameter("gender", "token", "Patient.gender", index="exact"),
+    ),
+    "Practitioner": _parameters(
+        _id(),
+        _identifier(),
+        SearchParameter("name", "string", "Practitioner.name", index="superset", extract=_human_names),
+        SearchParameter("family", "string", "Practitioner.name.family", index="superset"),
+        SearchParameter("given", "string", "Practitioner.name.given", index="superset", extract=_given_names),
+        SearchParameter("address-city", "string", "Practitioner.address.city", index="superset"),
+        SearchParameter("address-state", "string", "Practitioner.address.state", index="superset"),
+    ),
+    "PractitionerRole": _parameters(
+        _id(),
+        _identifier(),
+        SearchParameter("practitioner", "reference", "PractitionerRole.practitioner.reference",
+                        index="superset", target="Practitioner"),
+        SearchParameter("organization", "reference", "PractitionerRole.organization.reference",
+                        index="superset", target="Organization"),
+        SearchParameter("location", "reference", "PractitionerRole.location.reference",
+                        index="superset", target="Location"),
+        SearchParameter("specialty", "token", "PractitionerRole.specialty.coding.code", index="exact"),
+    ),
+    "Schedule": _parameters(
+        _id(),
+        SearchParameter("actor", "reference", "Schedule.actor.reference", index="exact"),
+    ),
+    "Procedure": _parameters(
+        _id(),
+        _identifier(),
+        _compartment(),
+        SearchParameter("status", "token", "Procedure.status", index="exact"),
+        SearchParameter("date", "date", "Procedure.performedDateTime", index="superset"),
+    ),
+    "Provenance": _parameters(
+        _id(),
+        _identifier(),
+        SearchParameter("target", "reference", "Provenance.target.reference", index="exact"),
+        SearchParameter("target-type", "token", "Provenance.target.reference", index="exact", extract=_target_types),
+        SearchParameter("agent", "reference", "Provenance.agent.who.reference", index="exact"),
+        SearchParameter("recorded", "date", "Provenance.recorded", index="superset"),
+    ),
+}
+
+
+def token_indexes() -> Dict[str, Dict[str, Callable[[Dict], List[str]]]]:
+    """Value extractors for every exactly-indexed token parameter, for FHIRIndex"""
+    return {
+        resource_type: {
+            name: param.values for name, param in params.items()
+            if param.type == "token" and param.index == "exact"
+        }
+        for resource_type, params in SEARCH_PARAMETERS.items()
+    }
+
+
+def string_indexes() -> Dict[str, Dict[str, Callable[[Dict], List[str]]]]:
+    """Text extractors of the n-gram-indexed string parameters, for FHIRIndex"""
+    return {
+        resource_type: {
+            name: param.texts for name, param in params.items()
+            if param.type == "string" and param.index == "superset"
+        }
+        for resource_type, params in SEARCH_PARAMETERS.items()
+    }
+
+
+def date_indexes() -> Dict[str, Dict[str, Callable[[Dict], List[Optional[int]]]]]:
+    """Day extractors of the indexed date parameters, for FHIRIndex"""
+    return {
+        resource_type: {
+            name: param.days for name, param in params.items()
+            if param.type == "date" and param.index == "superset"
+        }
+        for resource_type, params in SEARCH_PARAMETERS.items()
+    }
+
+
+# Per-patient time series (type -> (group token parameter, code token parameter, date parameter)), for $lastn
+SERIES_PARAMS = {"Observation": ("category", "code", "date")}
+
+
+def series_indexes() -> Dict[str, Tuple[Callable[[Dict], List[str]], Callable[[Dict], List[str]],
+                                         Callable[[Dict], List[Any]]]]:
+    """(group, code and instant extractors) of the per-patient time series, for FHIRIndex"""
+    return {
+        resource_type: (
+            SEARCH_PARAMETERS[resource_type][group].values,
+            SEARCH_PARAMETERS[resource_type][code].values,
+            SEARCH_PARAMETERS[resource_type][time].sort_values,
+        )
+        for resource_type, (group, code, time) in SERIES_PARAMS.items()
+    }
+
+
+def sort_indexes() -> Dict[str, Dict[str, Callable[[Dict], List[Any]]]]:
+    """Sort value extractors of the presorted parameters, for FHIRIndex"""
+    return {
+        resource_type: {
+            name: param.sort_values for name, param in params.items()
+            if param.type in SORTABLE_TYPES and name in PRESORTED_PARAMS
+        }
+        for resource_type, params in SEARCH_PARAMETERS.items()
+    }
+
+
+def parse_sort(resource_type: str, value: str) -> List[Tuple[str, bool]]:
+    """Parse _sort ('-date,status') into (parameter, descending) keys"""
+    keys = []
+    for item in value.split(","):
+        item = item.strip()
+        name = item.lstrip("-")
+        param = SEARCH_PARAMETERS.get(resource_type, {}).get(name)
+        if param is None or param.type not in SORTABLE_TYPES:
+            raise ValueError(f"Unsupported _sort parameter '{name}' for {resource_type}")
+        keys.append((name, item.startswith("-")))
+    return keys
+
+
+def parse_chain(resource_type: str, name: str) -> Tuple[str, str, str]:
+    """
+    Split a chained parameter ('patient.family', 'subject:Patient.name') into
+    (reference parameter, target type, parameter of the target). The rest of
+    the chain is validated against the target type, so it may chain again.
+    """
+    reference, _, rest = name.partition(".")
+    param_name, _, target = reference.partition(":")
+    param = SEARCH_PARAMETERS.get(resource_type, {}).get(param_name)
+    if param is None or param.type != "reference" or param.index is None:
+        raise ValueError(f"Unsupported chained parameter '{name}' for {resource_type}: "
+                         f"'{param_name}' is not an indexed reference parameter")
+    target = target or param.target
+    if target is None:
+        raise ValueError(f"Chained parameter '{name}' needs a target type, e.g. '{param_name}:Patient.{rest}'")
+    if target not in SEARCH_PARAMETERS:
+        raise ValueError(f"Unsupported chained parameter '{name}': {target} has no search parameters")
+    if "." in rest:
+        parse_chain(target, rest)
+    elif rest not in SEARCH_PARAMETERS[target]:
+        raise ValueError(f"Unsupported chained parameter '{name}': {target} has no parameter '{rest}'")
+    return param_name, target, rest
+
+
+def parse_has(resource_type: str, name: str) -> Tuple[str, str, str]:
+    """
+    Split a reverse chain ('_has:Condition:patient:code') into (source type,
+    its reference parameter pointing at resource_type, parameter of the
+    source). The parameter may itself be chained or another _has.
+    """
+    parts = name.split(":", 3)
+    if len(parts) != 4 or parts[0] != "_has":
+        raise ValueError(f"Invalid _has parameter '{name}': expected _has:Type:reference:parameter")
+    _, source, param_name, rest = parts
+    if source not in SEARCH_PARAMETERS:
+        raise ValueError(f"Unsupported _has parameter '{name}': {source} has no search parameters")
+    param = SEARCH_PARAMETERS[source].get(param_name)
+    if (param is None or param.type != "reference" or param.index is None
+            or param_name not in REFERENCE_PARAMS.get(source, {}) or param.target not in (None, resource_type)):
+        raise ValueError(f"Unsupported _has parameter '{name}': '{param_name}' is not an indexed "
+                         f"{source} reference to {resource_type}")
+    if rest.startswith("_has:"):
+        parse_has(source, rest)
+    elif "." in rest:
+        parse_chain(source, rest)
+    elif rest not in SEARCH_PARAMETERS[source]:
+        raise ValueError(f"Unsupported _has parameter '{name}': {source} has no parameter '{rest}'")
+    return source, param_name, rest
+
+
+def resolve_parameter(resource_type: str, name: str) -> Optional[SearchParameter]:
+    """
+    The registered parameter for a name, with its modifier applied: only
+    reference ':contains' (a partial match of the reference string) is
+    supported. None when there is no such parameter.
+    """
+    base, _, modifier = name.partition(":")
+    param = SEARCH_PARAMETERS.get(resource_type, {}).get(base)
+    if param is None or not modifier:
+        return param
+    if modifier == "contains" and param.type == "reference" and param.index != "only":
+        return SearchParameter(name, "reference", param.expression, target=param.target, match="contains",
+                               extract=param.extract)
+    return None
+
+
+class CompiledQuery:
+    """A parameter signature compiled into index parameters and ordered predicate factories"""
+
+    def __init__(self, resource_type: str, names: Tuple[str, ...]):
+        parameters = {name: resolve_parameter(resource_type, name) for name in names}
+        unknown = [name for name, param in parameters.items() if param is None]
+        if unknown:
+            raise KeyError(f"Unsupported {resource_type} search parameters: {', '.join(unknown)}")
+        self.resource_type = resource_type
+        self.parameters = list(parameters.values())
+        # Looked up in the indexes before any predicate runs
+        self.indexed = tuple(param.name for param in self.parameters if param.index)
+        # Must be answered by their index (no predicate exists)
+        self.index_only = frozenset(param.name for param in self.parameters if param.index == "only")
+        self.exact = frozenset(param.name for param in self.parameters if param.index in ("exact", "only"))
+        self.filtered = sorted(
+            (param for param in self.parameters if param.index != "only"),
+            key=lambda param: (PREDICATE_COST[param.type], param.name)
+        )
+
+    def predicate(self, values: Dict[str, str], applied: Tuple[str, ...] = (),
+                  evaluated: Tuple[str, ...] = ()) -> Optional[Callable[[Dict], bool]]:
+        """
+        One predicate for every parameter not already answered exactly by an
+        applied index or evaluated as a columnar mask, or None when nothing
+        is left to check
+        """
+        answered = self.exact.intersection(applied).union(evaluated)
+        predicates = tuple(
+            param.predicate(values[param.name]) for param in self.filtered if param.name not in answered
+        )
+        if not predicates:
+            return None
+        return all_of(predicates)
+
+    def predicate_names(self, applied: Tuple[str, ...] = (), evaluated: Tuple[str, ...] = ()) -> List[str]:
+        answered = self.exact.intersection(applied).union(evaluated)
+        return [param.name for param in self.filtered if param.name not in answered]
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_query(resource_type: str, names: Tuple[str, ...]) -> CompiledQuery:
+    """Compiled form of a parameter signature (names sorted), cached"""
+    return CompiledQuery(resource_type, names)
+
+
+def filter_resources(resources: List[Dict], predicate: Callable[[Dict], bool]) -> List[Dict]:
+    """Resources matching a compiled predicate, in order"""
+    pair = getattr(predicate, "pair", None)
+    if pair is not None:
+        first, second = pair
+        return [resource for resource in resources if first(resource) and second(resource)]
+    return [resource for resource in resources if predicate(resource)]
+
+
+def filter_positions(positions: List[int], resources: List[Dict], predicate: Callable[[Dict], bool]) -> List[int]:
+    """Positions into resources whose resource matches a compiled predicate, in order"""
+    pair = getattr(predicate, "pair", None)
+    if pair is not None:
+        first, second = pair
+        return [position for position in positions if first(resources[position]) and second(resources[position])]
+    return [position for position in positions if predicate(resources[position])]